@@ -18,10 +18,11 @@ from reminder_bot import ReminderBot
 from stock_manager import (
     handle_stock_command, get_stock_summary, get_stock_transactions,
     get_stock_cost_analysis, get_stock_account_list, get_stock_help,
-    is_stock_command, is_stock_query, get_stock_realtime_pnl
+    is_stock_command, is_stock_query, get_stock_realtime_pnl,
+    get_stock_sync_status
 )
 # 匯入股票分析和提醒模組
-from stock_analyzer import analyze_stock, quick_analyze_stock
+from stock_analyzer import analyze_stock, quick_analyze_stock, backtest_stock, volume_profile_stock
 from stock_notifier import (
     add_stock_price_alert, add_stock_technical_alert, 
     get_stock_alerts, delete_stock_alert, check_stock_alerts
@@ -83,6 +84,16 @@ class BackgroundServices:
         self.services.append('reminder_bot')
         print("✅ 智能提醒機器人已啟動 (包含帳單和生理期提醒)")
     
+    def start_intraday_collector(self):
+        """啟動盤中1分K收集器"""
+        try:
+            from stock_intraday import intraday_collector
+            intraday_collector.start()
+            self.services.append('intraday_collector')
+            print("✅ 盤中1分K收集器已啟動")
+        except Exception as e:
+            print(f"⚠️ 盤中1分K收集器啟動失敗: {e}")
+    
     def start_bill_scheduler(self, bill_scheduler):
         """啟動帳單分析定時任務"""
         try:
@@ -659,7 +670,8 @@ def is_stock_analysis_command(message_text):
     """檢查是否為股票分析指令"""
     analysis_keywords = [
         '分析', '技術分析', '支撐', '壓力', '買點', '賣點',
-        '提醒', '到價提醒', '設定提醒', '提醒列表', '刪除提醒', '持股分析'
+        '提醒', '到價提醒', '設定提醒', '提醒列表', '刪除提醒', '持股分析',
+        '回測', '掃描', '籌碼區'
     ]
     
     for keyword in analysis_keywords:
@@ -670,6 +682,8 @@ def is_stock_analysis_command(message_text):
         return True
     if re.match(r'提醒\s+\w+\s+\d+', message_text):
         return True
+    if re.match(r'盤中\s+\S+', message_text):
+        return True
     
     return False
 
@@ -805,6 +819,51 @@ def handle_stock_analysis_command(message_text, user_id):
             result += "💡 輸入「分析 股票名稱」查看完整技術分析"
             return result
         
+        # 8. 持股/提醒掃描
+        elif message_text.strip() == '掃描':
+            from stock_screener import scan_watchlist
+            return scan_watchlist()
+        
+        # 9. 訊號回測
+        elif match := re.match(r'回測\s+(.+)', message_text):
+            stock_input = match.group(1).strip()
+            from stock_manager import stock_manager
+            stock_code = stock_manager.stock_data['stock_codes'].get(stock_input)
+            if not stock_code:
+                stock_code = stock_input if stock_input.isdigit() else None
+            
+            if stock_code:
+                return backtest_stock(stock_code, stock_input if stock_input != stock_code else None)
+            else:
+                return f"❌ 找不到「{stock_input}」的股票代號"
+        
+        # 10. 籌碼區（成交量價格分布）
+        elif match := re.match(r'籌碼區\s+(.+)', message_text):
+            stock_input = match.group(1).strip()
+            from stock_manager import stock_manager
+            stock_code = stock_manager.stock_data['stock_codes'].get(stock_input)
+            if not stock_code:
+                stock_code = stock_input if stock_input.isdigit() else None
+            
+            if stock_code:
+                return volume_profile_stock(stock_code, stock_input if stock_input != stock_code else None)
+            else:
+                return f"❌ 找不到「{stock_input}」的股票代號"
+        
+        # 11. 盤中1分K走勢（VWAP / RSI / 突破）
+        elif match := re.match(r'盤中\s+(.+)', message_text):
+            stock_input = match.group(1).strip()
+            from stock_manager import stock_manager
+            from stock_intraday import get_intraday_report
+            stock_code = stock_manager.stock_data['stock_codes'].get(stock_input)
+            if not stock_code:
+                stock_code = stock_input if stock_input.isdigit() else None
+            
+            if stock_code:
+                return get_intraday_report(stock_code, stock_input if stock_input != stock_code else None)
+            else:
+                return f"❌ 找不到「{stock_input}」的股票代號"
+        
         else:
             return None
             
@@ -861,6 +920,8 @@ def enhanced_message_router(message_text, user_id):
                 return get_stock_account_list()
             elif message_text == '股票幫助':
                 return get_stock_help()
+            elif message_text == '同步狀態':
+                return get_stock_sync_status()
             elif message_text.startswith('交易記錄'):
                 parts = message_text.split()
                 account_name = parts[1] if len(parts) > 1 else None
@@ -964,6 +1025,7 @@ def initialize_app():
     # 啟動背景服務
     bg_services.start_keep_alive()
     bg_services.start_reminder_bot()
+    bg_services.start_intraday_collector()
     
     # 啟動帳單分析定時任務（包含同步功能）
     try:
@@ -577,6 +577,13 @@ class ReminderBot:
                 except Exception as e:
                     print(f"⚠️ 股票提醒檢查失敗: {e}")
                 
+                # 收盤資料定稿後，背景產生持股/提醒股票的盤後分析快照
+                try:
+                    from stock_snapshots import run_nightly_snapshots
+                    run_nightly_snapshots()
+                except Exception as e:
+                    print(f"⚠️ 盤後分析快照排程失敗: {e}")
+                
                 # 3. 檢查每日提醒
                 if user_id:
                     # 早上提醒
@@ -6,12 +6,20 @@ stock_analyzer.py - 股票技術分析模組 (改良版)
 3. 成交量確認機制
 4. 更智能的突破判斷
 """
-import yfinance as yf
 import pandas as pd
 import numpy as np
-import requests
 from datetime import datetime, timedelta
 import pytz
+from stock_indicators import indicator_engine
+from stock_backtest import backtest_signals, format_backtest_report
+from stock_volume_profile import volume_profile, multi_timeframe_profiles, format_volume_profile_report, PROFILE_PERIODS
+from stock_bar_store import bar_store, period_start, slice_period
+from stock_symbols import symbol_directory
+from stock_providers import market_data
+from stock_prices import price_store
+from stock_snapshots import snapshot_store
+from utils.ttl_cache import TTLCache, market_hours_ttl
+from utils.singleflight import SingleFlight
 
 TAIWAN_TZ = pytz.timezone('Asia/Taipei')
 
@@ -20,89 +28,91 @@ class StockAnalyzer:
     
     def __init__(self):
         """初始化分析器"""
-        self.cache = {}
-        self.cache_timeout = 300  # 5分鐘快取
+        # 日K快取：有筆數與記憶體上限，讀取時回傳副本（即時價更新不會污染共用資料）
+        self.cache = TTLCache('stock_history', max_entries=200, max_bytes=64 * 1024 * 1024, default_ttl=300)
+        # 並行請求合併：同一檔股票同時查詢時只打一次上游
+        self.inflight = SingleFlight('stock_analyzer')
+    
+    HISTORY_PERIOD = '1y'  # 每檔股票共用的日K區間，較短的 period 從中切出
+    RESAMPLE_RULES = {'W': 'W-FRI', 'M': 'ME'}
+    
+    def get_realtime_prices(self, stock_codes):
+        """批次取得台股即時報價（TWSE 官方 API，失敗時改用 Yahoo）
+        
+        一次請求以 | 串接多個 ex_ch 頻道，市場已知的代號只查對應頻道，
+        未知的代號同時查詢 tse_ 與 otc_，並從回應中記住所屬市場。
+        報價依交易日曆快取，休市時直接使用最後一筆報價，不再連網。
+        回傳 {代號: 報價}，查不到的代號不會出現在結果中。
+        報價存在全程序共用的 price_store，記帳、提醒與分析讀取同一份報價。
+        """
+        return price_store.get_quotes(stock_codes)
     
     def get_realtime_price(self, stock_code):
         """取得台股即時報價（TWSE 官方 API）"""
+        return price_store.get_quote(stock_code)
+    
+    def get_stock_data(self, stock_code, period='3mo'):
+        """取得股票歷史資料（改良版快取）
+        
+        每檔股票只下載一份 HISTORY_PERIOD 的日K，較短的 period 直接從中切出，
+        1mo 的快速分析與 3mo 的完整分析共用同一份資料與快取。
+        """
         try:
-            # 判斷是上市還是上櫃
-            code = stock_code.replace('.TW', '').replace('.TWO', '')
-            
-            # 嘗試上市股票
-            url = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
-            params = {
-                'ex_ch': f'tse_{code}.tw',
-                'json': '1',
-                'delay': '0'
-            }
-            
-            response = requests.get(url, params=params, timeout=5)
-            data = response.json()
-            
-            if data.get('msgArray') and len(data['msgArray']) > 0:
-                stock = data['msgArray'][0]
-                price = stock.get('z', '')  # 最新成交價
-                if price and price != '-':
-                    return {
-                        'price': float(price),
-                        'change': float(stock.get('c', 0)),  # 漲跌
-                        'change_pct': float(stock.get('d', 0)),  # 漲跌幅
-                        'volume': int(stock.get('v', 0)),  # 成交量
-                        'time': stock.get('t', ''),  # 時間
-                        'source': 'TWSE_realtime'
-                    }
-            
-            # 如果不是上市，嘗試上櫃
-            params['ex_ch'] = f'otc_{code}.tw'
-            response = requests.get(url, params=params, timeout=5)
-            data = response.json()
+            # 格式化台股代號（依代號目錄決定 .TW / .TWO）
+            formatted_code = symbol_directory.yahoo_symbol(stock_code)
+            base_period = self._base_period(period)
             
-            if data.get('msgArray') and len(data['msgArray']) > 0:
-                stock = data['msgArray'][0]
-                price = stock.get('z', '')
-                if price and price != '-':
-                    return {
-                        'price': float(price),
-                        'change': float(stock.get('c', 0)),
-                        'change_pct': float(stock.get('d', 0)),
-                        'volume': int(stock.get('v', 0)),
-                        'time': stock.get('t', ''),
-                        'source': 'TWSE_realtime'
-                    }
+            cache_key = f"{formatted_code}_{base_period}"
+            df = self.cache.get(cache_key)
+            if df is None:
+                # 同一檔股票同時被查詢時只下載一次
+                df = self.inflight.do(('history', cache_key), self._fetch_stock_data,
+                                      stock_code, formatted_code, base_period, cache_key)
+            if df is None or base_period == period:
+                return df
             
-            return None
+            df = slice_period(df, period)
+            df.attrs['symbol'] = formatted_code
+            return df
             
         except Exception as e:
-            print(f"取得即時報價失敗: {e}")
+            print(f"取得股票資料失敗: {e}")
             return None
     
-    def get_stock_data(self, stock_code, period='3mo'):
-        """取得股票歷史資料（改良版快取）"""
+    def _base_period(self, period):
+        """實際下載的區間：HISTORY_PERIOD 涵蓋得到就用它，否則（如 5y 回測）用 period 本身"""
+        base_start = period_start(self.HISTORY_PERIOD)
+        start = period_start(period)
+        if start is None or base_start is None or start < base_start:
+            return period
+        return self.HISTORY_PERIOD
+    
+    def get_resampled_data(self, stock_code, rule='W', period='1y'):
+        """由日K在本地合成週K / 月K（rule: 'W' 週、'M' 月），不另外下載"""
+        df = self.get_stock_data(stock_code, period=period)
+        if df is None or df.empty:
+            return None
+        
+        aggregation = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+        columns = {k: v for k, v in aggregation.items() if k in df.columns}
         try:
-            # 格式化台股代號
-            if not stock_code.endswith('.TW') and not stock_code.endswith('.TWO'):
-                formatted_code = f"{stock_code}.TW"
-            else:
-                formatted_code = stock_code
-            
-            # 智能快取：盤中1分鐘，收盤後5分鐘
-            taiwan_now = datetime.now(TAIWAN_TZ)
-            is_trading_hours = (9 <= taiwan_now.hour < 14) and taiwan_now.weekday() < 5
-            cache_timeout = 60 if is_trading_hours else 300
-            
-            cache_key = f"{formatted_code}_{period}"
-            if cache_key in self.cache:
-                cached_time, cached_data = self.cache[cache_key]
-                if (datetime.now() - cached_time).seconds < cache_timeout:
-                    return cached_data
-            
-            # 下載資料
-            stock = yf.Ticker(formatted_code)
-            df = stock.history(period=period)
+            resampled = df.resample(self.RESAMPLE_RULES[rule]).agg(columns)
+        except ValueError:
+            # 舊版 pandas 的月底別名為 'M'
+            resampled = df.resample(rule).agg(columns)
+        resampled = resampled.dropna(subset=['Close'])
+        resampled.attrs['symbol'] = f"{df.attrs.get('symbol', stock_code)}_{rule}"
+        return resampled
+    
+    def _fetch_stock_data(self, stock_code, formatted_code, period, cache_key):
+        """讀取日K、套用即時價並寫入快取"""
+        try:
+            # 讀取日K（本地資料庫只補抓缺少的K棒）
+            df = self._load_history(formatted_code, period)
             
-            if df.empty:
+            if df is None or df.empty:
                 return None
+            df.attrs['symbol'] = formatted_code
             
             # 嘗試更新最新價格（即時報價）
             realtime_data = self.get_realtime_price(stock_code)
@@ -111,30 +121,76 @@ class StockAnalyzer:
                 df.loc[df.index[-1], 'Close'] = realtime_data['price']
                 print(f"✅ 使用即時報價: {realtime_data['price']} ({realtime_data['time']})")
             
-            # 儲存快取
-            self.cache[cache_key] = (datetime.now(), df)
+            # 串流指標以這份基準日K更新（只改最後一根時常數時間），1mo/3mo 切片直接讀取
+            indicator_engine.track(df)
+            
+            # 儲存快取：盤中1分鐘，收盤後5分鐘
+            self.cache.set(cache_key, df, ttl=market_hours_ttl(60, 300))
             return df
             
         except Exception as e:
             print(f"取得股票資料失敗: {e}")
             return None
     
+    def _load_history(self, formatted_code, period):
+        """讀取日K：優先使用本地資料庫，只向資料來源補抓最後一筆之後的資料"""
+        if bar_store is None:
+            return market_data.history(formatted_code, period=period)
+        
+        try:
+            if not bar_store.is_up_to_date(formatted_code):
+                anchor = bar_store.anchor_bar(formatted_code)
+                if anchor:
+                    # 從已定稿的倒數第二根開始抓，順便把盤中未定稿的K棒換成最新資料
+                    anchor_date, anchor_close = anchor
+                    new_bars = market_data.history(formatted_code, start=anchor_date)
+                    if self._adjustment_changed(new_bars, anchor_date, anchor_close):
+                        # 除權息後資料源重新還原整段歷史，舊K棒與新K棒基準不同，整段重新下載
+                        print(f"🔁 {formatted_code} 還原價基準改變（除權息），重新下載完整日K")
+                        bar_store.replace(formatted_code, market_data.history(formatted_code, period='max'))
+                    else:
+                        bar_store.upsert(formatted_code, new_bars)
+                else:
+                    # 第一次查詢：保存完整歷史
+                    bar_store.upsert(formatted_code, market_data.history(formatted_code, period='max'))
+            
+            return bar_store.load(formatted_code, period)
+            
+        except Exception as e:
+            print(f"⚠️ 本地日K資料庫讀取失敗，改為直接下載: {e}")
+            return market_data.history(formatted_code, period=period)
+    
+    @staticmethod
+    def _adjustment_changed(new_bars, anchor_date, anchor_close, tolerance=1e-4):
+        """重疊的已定稿K棒收盤價不同時，代表還原價基準已改變"""
+        if new_bars is None or new_bars.empty or not anchor_close:
+            return False
+        overlap = new_bars[new_bars.index.strftime('%Y-%m-%d') == anchor_date]
+        if overlap.empty:
+            return False
+        return abs(overlap['Close'].iloc[0] / anchor_close - 1) > tolerance
+    
     def calculate_bollinger_bands(self, df, window=20, num_std=2):
         """計算布林通道"""
         if df is None or df.empty:
             return None
         
-        ma = df['Close'].rolling(window=window).mean()
-        std = df['Close'].rolling(window=window).std()
-        
-        upper_band = ma + (std * num_std)
-        lower_band = ma - (std * num_std)
+        if window == 20 and num_std == 2:
+            # 預設參數直接讀取共用指標表
+            latest = indicator_engine.latest(df)
+            ma, upper_band, lower_band = latest['ma20'], latest['bb_upper'], latest['bb_lower']
+        else:
+            ma_series = df['Close'].rolling(window=window).mean()
+            std = df['Close'].rolling(window=window).std()
+            ma = ma_series.iloc[-1]
+            upper_band = (ma_series + (std * num_std)).iloc[-1]
+            lower_band = (ma_series - (std * num_std)).iloc[-1]
         
         return {
-            'upper': round(upper_band.iloc[-1], 2) if pd.notna(upper_band.iloc[-1]) else None,
-            'middle': round(ma.iloc[-1], 2) if pd.notna(ma.iloc[-1]) else None,
-            'lower': round(lower_band.iloc[-1], 2) if pd.notna(lower_band.iloc[-1]) else None,
-            'bandwidth': round(((upper_band.iloc[-1] - lower_band.iloc[-1]) / ma.iloc[-1]) * 100, 2) if pd.notna(ma.iloc[-1]) else None
+            'upper': round(upper_band, 2) if pd.notna(upper_band) else None,
+            'middle': round(ma, 2) if pd.notna(ma) else None,
+            'lower': round(lower_band, 2) if pd.notna(lower_band) else None,
+            'bandwidth': round(((upper_band - lower_band) / ma) * 100, 2) if pd.notna(ma) else None
         }
     
     def check_volume_confirmation(self, df, window=20):
@@ -142,7 +198,10 @@ class StockAnalyzer:
         if df is None or df.empty:
             return None
         
-        avg_volume = df['Volume'].rolling(window=window).mean().iloc[-1]
+        if window == 20:
+            avg_volume = indicator_engine.latest(df)['vol_ma20']
+        else:
+            avg_volume = df['Volume'].rolling(window=window).mean().iloc[-1]
         current_volume = df['Volume'].iloc[-1]
         
         if avg_volume == 0:
@@ -159,27 +218,38 @@ class StockAnalyzer:
         else:
             return {'status': 'normal', 'ratio': round(volume_ratio, 2), 'text': '量能正常'}
     
+    @staticmethod
+    def find_swing_points(series, window=20, kind='low'):
+        """找出前波高低點（向量化）
+
+        與逐筆比對 series.iloc[i-window:i+window] 的結果相同：
+        第 i 根K棒為區間 [i-window, i+window) 內的最低(最高)值即視為轉折點，
+        改用滾動視窗一次算完，複雜度 O(n)。
+        """
+        n = len(series)
+        if n <= 2 * window:
+            return series.iloc[:0].to_numpy()
+
+        # 滾動視窗結束於 i+window-1，即涵蓋 [i-window, i+window)
+        rolling = series.rolling(window=2 * window, min_periods=1)
+        extreme = rolling.min() if kind == 'low' else rolling.max()
+        centered = extreme.to_numpy()[2 * window - 1:n - 1]
+
+        values = series.to_numpy()[window:n - window]
+        return values[values == centered]
+
     def calculate_support_resistance(self, df, window=20):
         """計算支撐壓力位（改良版）"""
         if df is None or df.empty:
             return None
         
-        supports = []
-        resistances = []
-        
-        # 1. 前波高低點法
-        for i in range(window, len(df) - window):
-            if df['Low'].iloc[i] == df['Low'].iloc[i-window:i+window].min():
-                supports.append(df['Low'].iloc[i])
-            
-            if df['High'].iloc[i] == df['High'].iloc[i-window:i+window].max():
-                resistances.append(df['High'].iloc[i])
+        # 1. 前波高低點法（向量化）
+        supports = self.find_swing_points(df['Low'], window, 'low').tolist()
+        resistances = self.find_swing_points(df['High'], window, 'high').tolist()
         
-        # 2. 均線支撐壓力
-        ma5 = df['Close'].rolling(window=5).mean().iloc[-1]
-        ma10 = df['Close'].rolling(window=10).mean().iloc[-1]
-        ma20 = df['Close'].rolling(window=20).mean().iloc[-1]
-        ma60 = df['Close'].rolling(window=60).mean().iloc[-1]
+        # 2. 均線支撐壓力（讀取共用指標表）
+        latest = indicator_engine.latest(df)
+        ma5, ma10, ma20, ma60 = latest['ma5'], latest['ma10'], latest['ma20'], latest['ma60']
         
         current_price = df['Close'].iloc[-1]
         
@@ -199,12 +269,11 @@ class StockAnalyzer:
             if bollinger['upper'] and bollinger['upper'] > current_price:
                 resistances.append(bollinger['upper'])
         
-        # 4. 成交量密集區
-        volume_price = df.groupby(pd.cut(df['Close'], bins=30))['Volume'].sum()
-        top_volume_prices = volume_price.nlargest(3)
+        # 4. 成交量密集區（numpy 成交量價格分布）
+        profile = volume_profile(df, bins=30, top_n=3)
         
-        for interval in top_volume_prices.index:
-            mid_price = (interval.left + interval.right) / 2
+        for zone in (profile['top_zones'] if profile else []):
+            mid_price = zone['mid']
             if mid_price < current_price:
                 supports.append(mid_price)
             else:
@@ -225,36 +294,26 @@ class StockAnalyzer:
         }
     
     def calculate_indicators(self, df):
-        """計算技術指標"""
+        """計算技術指標（讀取共用指標表）"""
         if df is None or df.empty:
             return None
         
         indicators = {}
+        latest = indicator_engine.latest(df)
         
         # RSI
-        delta = df['Close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        indicators['rsi'] = round(rsi.iloc[-1], 2) if pd.notna(rsi.iloc[-1]) else None
+        rsi = latest['rsi']
+        indicators['rsi'] = round(rsi, 2) if pd.notna(rsi) else None
         
         # KD
-        low_14 = df['Low'].rolling(window=14).min()
-        high_14 = df['High'].rolling(window=14).max()
-        rsv = (df['Close'] - low_14) / (high_14 - low_14) * 100
-        k = rsv.ewm(com=2).mean()
-        d = k.ewm(com=2).mean()
-        indicators['k'] = round(k.iloc[-1], 2) if pd.notna(k.iloc[-1]) else None
-        indicators['d'] = round(d.iloc[-1], 2) if pd.notna(d.iloc[-1]) else None
+        k, d = latest['k'], latest['d']
+        indicators['k'] = round(k, 2) if pd.notna(k) else None
+        indicators['d'] = round(d, 2) if pd.notna(d) else None
         
         # MACD
-        ema12 = df['Close'].ewm(span=12).mean()
-        ema26 = df['Close'].ewm(span=26).mean()
-        macd = ema12 - ema26
-        signal = macd.ewm(span=9).mean()
-        indicators['macd'] = round(macd.iloc[-1], 2) if pd.notna(macd.iloc[-1]) else None
-        indicators['macd_signal'] = round(signal.iloc[-1], 2) if pd.notna(signal.iloc[-1]) else None
+        macd, signal = latest['macd'], latest['macd_signal']
+        indicators['macd'] = round(macd, 2) if pd.notna(macd) else None
+        indicators['macd_signal'] = round(signal, 2) if pd.notna(signal) else None
         
         return indicators
     
@@ -618,15 +677,121 @@ class StockAnalyzer:
             'resistance': round(nearest_resistance, 2) if nearest_resistance else None
         }
 
+    def backtest(self, stock_code, period='5y', horizons=(5, 10, 20), thresholds=None):
+        """回測買賣訊號規則（每根K棒套用與 analyze() 相同的支撐壓力與訊號規則）"""
+        df = self.get_stock_data(stock_code, period=period)
+        if df is None or df.empty:
+            return None
+        return backtest_signals(df, horizons=horizons, thresholds=thresholds)
+    
+    def backtest_watchlist(self, stock_codes, period='5y', horizons=(5, 10, 20), thresholds=None):
+        """回測多檔股票，回傳 {代號: 回測結果}"""
+        results = {}
+        for stock_code in stock_codes:
+            try:
+                results[stock_code] = self.backtest(stock_code, period, horizons, thresholds)
+            except Exception as e:
+                print(f"回測 {stock_code} 失敗: {e}")
+                results[stock_code] = None
+        return results
+    
+    def volume_profile_analysis(self, stock_code, stock_name=None, periods=PROFILE_PERIODS):
+        """籌碼區：1mo/3mo/1y 成交量價格分布（共用一份 1y 日K）"""
+        try:
+            df = self.get_stock_data(stock_code, period='1y')
+            label = f"{stock_name} ({stock_code})" if stock_name else stock_code
+            if df is None or df.empty:
+                return f"❌ 無法取得 {label} 的資料"
+            
+            profiles = multi_timeframe_profiles(df, periods=periods)
+            current_price = round(float(df['Close'].iloc[-1]), 2)
+            return format_volume_profile_report(label, current_price, profiles)
+            
+        except Exception as e:
+            print(f"籌碼區分析失敗: {e}")
+            return f"❌ 籌碼區分析失敗：{str(e)}"
+    
+    def stats(self):
+        """快取與並行請求合併統計（可觀察省下多少次上游請求）"""
+        return {
+            'history_cache': self.cache.stats(),
+            'last_prices': price_store.stats(),
+            'inflight': self.inflight.stats(),
+            'providers': market_data.stats()
+        }
+
 
 # 建立全域實例
 stock_analyzer = StockAnalyzer()
 
 # 對外接口
 def analyze_stock(stock_code, stock_name=None):
-    """分析股票 - 對外接口"""
+    """分析股票 - 對外接口（休市時優先回傳盤後快照）"""
+    snapshot = snapshot_store.get(stock_code, 'analysis', stock_name)
+    if snapshot:
+        return f"{snapshot['analysis']}\n🗂️ 盤後快照（{snapshot['computed_at']}）"
     return stock_analyzer.analyze(stock_code, stock_name)
 
 def quick_analyze_stock(stock_code, stock_name=None):
-    """快速分析 - 對外接口"""
+    """快速分析 - 對外接口（休市時優先回傳盤後快照）"""
+    snapshot = snapshot_store.get(stock_code, 'quick', stock_name)
+    if snapshot:
+        return dict(snapshot['quick'])
     return stock_analyzer.quick_analysis(stock_code, stock_name)
+
+def backtest_stock(stock_code, stock_name=None):
+    """訊號回測 - 對外接口"""
+    label = f"{stock_name} ({stock_code})" if stock_name else stock_code
+    return format_backtest_report(label, stock_analyzer.backtest(stock_code))
+
+def volume_profile_stock(stock_code, stock_name=None):
+    """籌碼區 - 對外接口"""
+    return stock_analyzer.volume_profile_analysis(stock_code, stock_name)
+
+def get_realtime_prices(stock_codes):
+    """批次即時報價 - 對外接口"""
+    return stock_analyzer.get_realtime_prices(stock_codes)
+
+
+def _legacy_swing_points(df, window=20):
+    """舊版逐筆迴圈（僅供效能比對）"""
+    supports, resistances = [], []
+    for i in range(window, len(df) - window):
+        if df['Low'].iloc[i] == df['Low'].iloc[i-window:i+window].min():
+            supports.append(df['Low'].iloc[i])
+        if df['High'].iloc[i] == df['High'].iloc[i-window:i+window].max():
+            resistances.append(df['High'].iloc[i])
+    return supports, resistances
+
+
+def benchmark_swing_points(years=(1, 5, 10), window=20, repeat=3):
+    """前波高低點效能比對：舊版迴圈 vs 向量化"""
+    import time
+
+    rng = np.random.default_rng(0)
+    for y in years:
+        n = 252 * y
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+        df = pd.DataFrame({
+            'High': np.round(close * (1 + rng.uniform(0, 0.02, n)), 2),
+            'Low': np.round(close * (1 - rng.uniform(0, 0.02, n)), 2),
+        }, index=pd.bdate_range('2000-01-03', periods=n))
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            old_s, old_r = _legacy_swing_points(df, window)
+        legacy = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            new_s = StockAnalyzer.find_swing_points(df['Low'], window, 'low')
+            new_r = StockAnalyzer.find_swing_points(df['High'], window, 'high')
+        vectorized = (time.perf_counter() - start) / repeat
+
+        same = set(old_s) == set(new_s) and set(old_r) == set(new_r)
+        print(f"{y:>2}y ({n} 根): 迴圈 {legacy*1000:8.1f}ms | 向量化 {vectorized*1000:6.2f}ms | "
+              f"加速 {legacy/vectorized:6.1f}x | 結果一致: {'✅' if same else '❌'}")
+
+
+if __name__ == "__main__":
+    benchmark_swing_points()
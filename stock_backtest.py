@@ -0,0 +1,288 @@
+"""
+stock_backtest.py - 買賣訊號回測
+把 analyze_buy_signals / analyze_sell_signals / generate_suggestions 的規則
+套用到每一根歷史K棒，統計訊號出現後 N 日的勝率、平均報酬與策略回撤，
+用資料來調整門檻，而不是逐日重跑 analyze()。
+
+每根K棒都以「當天往回 3 個月」的資料重建 calculate_support_resistance 的支撐壓力：
+前波高低點、MA5/10/20/60、布林上下軌與成交量密集區，取最近 5 個並逐一評分，
+與即時分析相同。指標以完整歷史一次算完，與在 3 個月切片上計算只差浮點誤差
+（KD 為 EWM，差距小於 1e-6），只有剛好落在小數第 2 位進位邊界時才可能差一個價位。
+"""
+import numpy as np
+import pandas as pd
+from stock_bar_store import PERIOD_OFFSETS
+from stock_indicators import indicator_engine
+from stock_volume_profile import trailing_zone_mids
+
+# 與 StockAnalyzer 判斷規則相同的預設門檻
+DEFAULT_THRESHOLDS = {
+    'support_band': 2,        # 價格在支撐下方 0~2% 視為接近支撐
+    'resistance_band': 2,     # 價格距壓力 0~2% 視為接近壓力
+    'bollinger_band': 1,      # 距布林上下軌 ±1%
+    'rsi_oversold': 30,
+    'rsi_overbought': 70,
+    'k_oversold': 20,
+    'k_overbought': 80,
+    'volume_strong': 1.5,
+    'volume_weak': 0.5,
+    'shadow_ratio': 2,        # 影線 > 實體 2 倍
+    'action_strength': 5,     # 強度 >= 5 建議買/賣
+    'consider_strength': 3,   # 強度 >= 3 可考慮
+    'swing_window': 20,
+    'level_count': 5,         # 支撐壓力各取最近 5 個
+    'lookback_period': '3mo', # 與 analyze() 使用的日K區間相同
+}
+
+ACTION_CODES = ['hold', 'buy', 'sell', 'consider_buy', 'consider_sell']
+
+# 指標在切片中需要的最少K棒數（不足時即時分析得到 NaN）
+MIN_BARS = {'ma5': 5, 'ma10': 10, 'ma20': 20, 'ma60': 60, 'bb': 20, 'rsi': 15, 'kd': 14, 'vol_ma20': 20}
+
+
+def _window_starts(index, period):
+    """每根K棒往回 period 的切片起點（與 slice_period 相同：日期 >= 當天 - period）"""
+    offset = PERIOD_OFFSETS.get(period)
+    if offset is None:
+        return np.zeros(len(index), dtype=int)
+    days = index.normalize()
+    return np.searchsorted(index, days - offset, side='left')
+
+
+def _pivot_mask(series, window, kind):
+    """find_swing_points 的轉折點位置（i 為 [i-window, i+window) 內的極值）"""
+    n = len(series)
+    mask = np.zeros(n, dtype=bool)
+    if n <= 2 * window:
+        return mask
+    rolling = series.rolling(window=2 * window, min_periods=1)
+    extreme = rolling.min() if kind == 'low' else rolling.max()
+    values = series.to_numpy()
+    mask[window:n - window] = values[window:n - window] == extreme.to_numpy()[2 * window - 1:n - 1]
+    return mask
+
+
+def _round(value):
+    return round(float(value), 2)
+
+
+def _level_hits(df, frame, starts, t):
+    """逐根重建 calculate_support_resistance 的支撐壓力，回傳落在區間內的支撐/壓力個數"""
+    window = t['swing_window']
+    count = t['level_count']
+    close = df['Close'].to_numpy(dtype=float)
+    lows = df['Low'].to_numpy(dtype=float)
+    highs = df['High'].to_numpy(dtype=float)
+    low_pivots = np.flatnonzero(_pivot_mask(df['Low'], window, 'low'))
+    high_pivots = np.flatnonzero(_pivot_mask(df['High'], window, 'high'))
+    mas = {w: frame[f'ma{w}'].to_numpy(dtype=float) for w in (5, 10, 20, 60)}
+    bb_upper = frame['bb_upper'].to_numpy(dtype=float)
+    bb_lower = frame['bb_lower'].to_numpy(dtype=float)
+    zone_mids = trailing_zone_mids(close, df['Volume'].to_numpy(dtype=float), starts)
+
+    n = len(df)
+    support_hits = np.zeros(n, dtype=int)
+    resistance_hits = np.zeros(n, dtype=int)
+    for i in range(n):
+        s = int(starts[i])
+        length = i - s + 1
+        price = close[i]
+
+        # 1. 前波高低點：切片內 [s+window, i-window] 的轉折點
+        lo, hi = s + window, i - window
+        supports = lows[low_pivots[(low_pivots >= lo) & (low_pivots <= hi)]].tolist()
+        resistances = highs[high_pivots[(high_pivots >= lo) & (high_pivots <= hi)]].tolist()
+
+        # 2. 均線
+        for w, values in mas.items():
+            ma = values[i]
+            if length >= MIN_BARS[f'ma{w}'] and not np.isnan(ma):
+                (supports if ma < price else resistances).append(ma)
+
+        # 3. 布林通道（即時分析取到小數 2 位）
+        if length >= MIN_BARS['bb']:
+            lower = _round(bb_lower[i]) if not np.isnan(bb_lower[i]) else None
+            upper = _round(bb_upper[i]) if not np.isnan(bb_upper[i]) else None
+            if lower and lower < price:
+                supports.append(lower)
+            if upper and upper > price:
+                resistances.append(upper)
+
+        # 4. 成交量密集區
+        for mid in zone_mids[i]:
+            (supports if mid < price else resistances).append(mid)
+
+        supports = sorted({_round(v) for v in supports if not np.isnan(v)}, reverse=True)[:count]
+        resistances = sorted({_round(v) for v in resistances if not np.isnan(v)})[:count]
+
+        for support in supports:
+            diff = (price - support) / support * 100
+            if -t['support_band'] <= diff <= 0:
+                support_hits[i] += 1
+        for resistance in resistances:
+            diff = (resistance - price) / price * 100
+            if 0 <= diff <= t['resistance_band']:
+                resistance_hits[i] += 1
+    return support_hits, resistance_hits
+
+
+def compute_signal_strength(df, frame=None, thresholds=None):
+    """逐根計算買/賣訊號強度與建議動作
+
+    支撐壓力逐根重建（見模組說明），其餘條件以整段指標表向量化計算。
+    """
+    t = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    frame = indicator_engine.frame(df) if frame is None else frame
+
+    starts = _window_starts(df.index, t['lookback_period'])
+    length = np.arange(len(df)) - starts + 1
+
+    def usable(column, key):
+        # 切片K棒數不足時即時分析得到 NaN；數值取到小數 2 位
+        values = frame[column].round(2)
+        return values.where(length >= MIN_BARS[key])
+
+    close = df['Close']
+    open_ = df['Open']
+    body = (close - open_).abs()
+    lower_shadow = np.minimum(open_, close) - df['Low']
+    upper_shadow = df['High'] - np.maximum(open_, close)
+    # 均量為 0 時即時分析不做量能判斷
+    avg_volume = frame['vol_ma20'].where((length >= MIN_BARS['vol_ma20']) & (frame['vol_ma20'] != 0))
+    volume_ratio = df['Volume'] / avg_volume
+    bb_upper, bb_lower = usable('bb_upper', 'bb'), usable('bb_lower', 'bb')
+    rsi, k, d = usable('rsi', 'rsi'), usable('k', 'kd'), usable('d', 'kd')
+
+    support_hits, resistance_hits = _level_hits(df, frame, starts, t)
+
+    # ===== 買進訊號 =====
+    lower_diff = (close - bb_lower) / bb_lower * 100
+    buy_parts = {
+        'support': (pd.Series(support_hits, index=df.index), 3),
+        'bollinger_lower': ((lower_diff.abs() <= t['bollinger_band']) & (bb_lower != 0), 3),
+        'oversold_rsi': ((rsi < t['rsi_oversold']) & (rsi != 0), 2),
+        'oversold_kd': ((k < t['k_oversold']) & (k != 0), 2),
+    }
+    buy_strength = sum(hits.astype(int) * weight for hits, weight in buy_parts.values())
+    buy_count = sum(hits.astype(int) for hits, _ in buy_parts.values())
+    # 量能放大：前面每個訊號強度 +1
+    buy_strength = buy_strength + buy_count * (volume_ratio > t['volume_strong'])
+    buy_strength = buy_strength + 2 * (lower_shadow > body * t['shadow_ratio'])
+
+    # ===== 賣出訊號 =====
+    upper_diff = (bb_upper - close) / close * 100
+    sell_parts = {
+        'resistance': (pd.Series(resistance_hits, index=df.index), 3),
+        'bollinger_upper': ((upper_diff.abs() <= t['bollinger_band']) & (bb_upper != 0), 3),
+        'overbought_rsi': (rsi > t['rsi_overbought'], 2),
+        'overbought_kd': (k > t['k_overbought'], 2),
+    }
+    sell_strength = sum(hits.astype(int) * weight for hits, weight in sell_parts.values())
+    sell_count = sum(hits.astype(int) for hits, _ in sell_parts.values())
+    # 量能萎縮：前面每個訊號強度 +1
+    sell_strength = sell_strength + sell_count * (volume_ratio < t['volume_weak'])
+    sell_strength = sell_strength + 2 * (upper_shadow > body * t['shadow_ratio'])
+    death_cross = (k < d) & (k > t['k_overbought']) & (d != 0)
+    sell_strength = sell_strength + 3 * death_cross
+
+    # ===== 建議動作（與 generate_suggestions 相同的優先順序）=====
+    strong, consider = t['action_strength'], t['consider_strength']
+    action = np.select(
+        [
+            (buy_strength >= strong) & (buy_strength > sell_strength),
+            (sell_strength >= strong) & (sell_strength > buy_strength),
+            (buy_strength >= consider) & (sell_strength < consider),
+            (sell_strength >= consider) & (buy_strength < consider),
+        ],
+        [1, 2, 3, 4],
+        default=0
+    )
+
+    return pd.DataFrame({
+        'buy_strength': buy_strength.astype(int),
+        'sell_strength': sell_strength.astype(int),
+        'action': pd.Categorical.from_codes(action, ACTION_CODES),
+    }, index=df.index)
+
+
+def _max_drawdown(equity):
+    """最大回撤（負值，%）"""
+    if equity.empty:
+        return 0.0
+    drawdown = equity / equity.cummax() - 1
+    return round(float(drawdown.min()) * 100, 2)
+
+
+def backtest_signals(df, horizons=(5, 10, 20), thresholds=None):
+    """回測單一股票
+
+    - 買進訊號（buy / consider_buy）：N 日後上漲視為命中
+    - 賣出訊號（sell / consider_sell）：N 日後下跌視為命中
+    - 策略回撤：出現買進訊號後持有，直到出現賣出訊號
+    """
+    if df is None or len(df) < 60:
+        return None
+
+    signals = compute_signal_strength(df, thresholds=thresholds)
+    close = df['Close']
+    action = signals['action']
+    is_buy = action.isin(['buy', 'consider_buy']).to_numpy()
+    is_sell = action.isin(['sell', 'consider_sell']).to_numpy()
+
+    result = {
+        'bars': len(df),
+        'start': df.index[0].strftime('%Y/%m/%d'),
+        'end': df.index[-1].strftime('%Y/%m/%d'),
+        'buy_signals': int(is_buy.sum()),
+        'sell_signals': int(is_sell.sum()),
+        'horizons': {}
+    }
+
+    for n in horizons:
+        forward = (close.shift(-n) / close - 1).to_numpy() * 100
+        valid = ~np.isnan(forward)
+        buy_returns = forward[is_buy & valid]
+        sell_returns = forward[is_sell & valid]
+        result['horizons'][n] = {
+            'buy_hit_rate': round(float((buy_returns > 0).mean()) * 100, 1) if buy_returns.size else None,
+            'buy_avg_return': round(float(buy_returns.mean()), 2) if buy_returns.size else None,
+            'sell_hit_rate': round(float((sell_returns < 0).mean()) * 100, 1) if sell_returns.size else None,
+            'sell_avg_return': round(float(sell_returns.mean()), 2) if sell_returns.size else None,
+            'baseline_avg_return': round(float(forward[valid].mean()), 2) if valid.any() else None,
+        }
+
+    # 訊號策略：買進訊號後持有、賣出訊號後出場（訊號當天收盤進出，隔天起計算報酬）
+    position = pd.Series(np.where(is_buy, 1.0, np.where(is_sell, 0.0, np.nan)), index=df.index).ffill().fillna(0.0)
+    daily_return = close.pct_change().fillna(0.0)
+    equity = (1 + position.shift(1).fillna(0.0) * daily_return).cumprod()
+    result['strategy_return'] = round((float(equity.iloc[-1]) - 1) * 100, 2)
+    result['strategy_max_drawdown'] = _max_drawdown(equity)
+    result['buy_hold_return'] = round((float(close.iloc[-1] / close.iloc[0]) - 1) * 100, 2)
+    result['buy_hold_max_drawdown'] = _max_drawdown(close / close.iloc[0])
+    result['exposure'] = round(float(position.mean()) * 100, 1)
+    return result
+
+
+def format_backtest_report(stock_label, result):
+    """格式化回測結果（LINE 訊息）"""
+    if not result:
+        return f"❌ {stock_label} 資料不足，無法回測"
+
+    text = f"🧪 {stock_label} 訊號回測\n"
+    text += f"📅 {result['start']} ~ {result['end']} ({result['bars']} 天)\n"
+    text += f"🟢 買進訊號 {result['buy_signals']} 次 / 🔴 賣出訊號 {result['sell_signals']} 次\n"
+    text += "📐 規則與技術分析相同：每天以近3月日K重算支撐壓力（前波高低點、均線、布林、量區）\n\n"
+
+    for n, stats in result['horizons'].items():
+        text += f"⏱️ {n} 日後\n"
+        if stats['buy_hit_rate'] is not None:
+            text += f"   買訊勝率 {stats['buy_hit_rate']}%，平均 {stats['buy_avg_return']:+.2f}%\n"
+        if stats['sell_hit_rate'] is not None:
+            text += f"   賣訊勝率 {stats['sell_hit_rate']}%，平均 {stats['sell_avg_return']:+.2f}%\n"
+        if stats['baseline_avg_return'] is not None:
+            text += f"   (所有日子平均 {stats['baseline_avg_return']:+.2f}%)\n"
+
+    text += f"\n📈 訊號策略：{result['strategy_return']:+.2f}%（最大回撤 {result['strategy_max_drawdown']}%，持股 {result['exposure']}% 時間）\n"
+    text += f"📊 買進持有：{result['buy_hold_return']:+.2f}%（最大回撤 {result['buy_hold_max_drawdown']}%）\n"
+    text += "⚠️ 過去績效不代表未來，僅供調整參數參考"
+    return text
@@ -0,0 +1,163 @@
+"""
+stock_bar_store.py - 本地日K資料庫
+以 SQLite 保存每檔股票完整的日K歷史，重啟後不必重新下載，
+只補抓最後一筆之後缺少的K棒。
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytz
+from utils.data_dir import get_data_path
+from utils.trading_calendar import trading_calendar
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# yfinance period -> 往回推的時間
+PERIOD_OFFSETS = {
+    '5d': pd.DateOffset(days=5),
+    '1mo': pd.DateOffset(months=1),
+    '3mo': pd.DateOffset(months=3),
+    '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1),
+    '2y': pd.DateOffset(years=2),
+    '5y': pd.DateOffset(years=5),
+    '10y': pd.DateOffset(years=10),
+}
+
+
+def period_start(period):
+    """period 對應的起始日期（台灣時間，與 yfinance period 的起點一致），'max' 回傳 None"""
+    today = pd.Timestamp(datetime.now(TAIWAN_TZ).date())
+    if period == 'ytd':
+        return today.replace(month=1, day=1)
+    offset = PERIOD_OFFSETS.get(period)
+    return today - offset if offset is not None else None
+
+
+def slice_period(df, period):
+    """從完整歷史切出 period 區間"""
+    start = period_start(period)
+    if df is None or df.empty or start is None:
+        return df
+    return df[df.index >= start.tz_localize(df.index.tz)]
+
+
+class StockBarStore:
+    """日K資料庫（SQLite，WAL + mmap 讀取）"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('STOCK_BAR_STORE_PATH') or get_data_path('stock_bars.db')
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA mmap_size=268435456')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS bars (
+                symbol TEXT NOT NULL,
+                date TEXT NOT NULL,
+                open REAL, high REAL, low REAL, close REAL, volume REAL,
+                PRIMARY KEY (symbol, date)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fetch_log (
+                symbol TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def load(self, symbol, period='max'):
+        """讀取 period 區間的日K（依日期排序），欄位與 yfinance history 相同"""
+        sql = 'SELECT date, open, high, low, close, volume FROM bars WHERE symbol = ?'
+        params = [symbol]
+        start = period_start(period)
+        if start is not None:
+            sql += ' AND date >= ?'
+            params.append(start.strftime('%Y-%m-%d'))
+        sql += ' ORDER BY date'
+
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        if not rows:
+            return None
+
+        dates, *columns = zip(*rows)
+        index = pd.DatetimeIndex(pd.to_datetime(dates), name='Date').tz_localize(TAIWAN_TZ)
+        data = {name: np.asarray(values, dtype='float64') for name, values in zip(BAR_COLUMNS, columns)}
+        return pd.DataFrame(data, index=index)
+
+    def last_date(self, symbol):
+        """最後一筆K棒日期（YYYY-MM-DD）"""
+        with self._lock:
+            row = self.conn.execute('SELECT MAX(date) FROM bars WHERE symbol = ?', (symbol,)).fetchone()
+        return row[0] if row else None
+
+    def anchor_bar(self, symbol):
+        """用來核對還原價基準的K棒 (日期, 收盤價)：倒數第二根（已定稿），只有一根時用最後一根"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT date, close FROM bars WHERE symbol = ? ORDER BY date DESC LIMIT 2', (symbol,)
+            ).fetchall()
+        return rows[-1] if rows else None
+
+    def last_fetch_time(self, symbol):
+        """最後一次向資料源補抓的時間（台灣時間），沒有紀錄時回傳 None"""
+        with self._lock:
+            row = self.conn.execute('SELECT fetched_at FROM fetch_log WHERE symbol = ?', (symbol,)).fetchone()
+        return datetime.fromtimestamp(row[0], TAIWAN_TZ) if row else None
+
+    def upsert(self, symbol, df):
+        """寫入/覆蓋日K（同一天的盤中K棒會被收盤後的資料取代）"""
+        if df is None or df.empty:
+            return 0
+        with self._lock:
+            with self.conn:
+                self._write(symbol, df)
+        return len(df)
+
+    def _write(self, symbol, df):
+        """寫入K棒並記錄補抓時間（呼叫端需持有鎖並在同一個交易內）"""
+        dates = [ts.strftime('%Y-%m-%d') for ts in df.index]
+        values = df[BAR_COLUMNS].to_numpy(dtype='float64').tolist()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO bars (symbol, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(symbol, date, *row) for date, row in zip(dates, values)]
+        )
+        self.conn.execute(
+            'INSERT OR REPLACE INTO fetch_log (symbol, fetched_at) VALUES (?, ?)',
+            (symbol, datetime.now(TAIWAN_TZ).timestamp())
+        )
+
+    def replace(self, symbol, df):
+        """以整份日K取代該股票的資料（還原價基準改變時重新下載使用）"""
+        if df is None or df.empty:
+            return 0
+        with self._lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM bars WHERE symbol = ?', (symbol,))
+                self._write(symbol, df)
+        return len(df)
+
+    def is_up_to_date(self, symbol):
+        """最後一次補抓是否已在最近一次收盤資料定稿之後（之後到下次開盤都不必再問資料源）"""
+        # 盤中與收盤後資料定稿前，日K仍可能變動
+        if trading_calendar.is_data_settling():
+            return False
+
+        fetched_at = self.last_fetch_time(symbol)
+        return fetched_at is not None and fetched_at >= trading_calendar.last_settle()
+
+
+# 建立全域實例（資料庫無法開啟時停用，退回直接下載）
+try:
+    bar_store = StockBarStore()
+except Exception as e:
+    print(f"⚠️ 本地日K資料庫無法開啟，改為直接下載: {e}")
+    bar_store = None
@@ -0,0 +1,472 @@
+"""
+stock_indicators.py - 技術指標引擎
+所有衍生序列（均線、布林、RSI、KD、MACD、均量）集中在登錄表中宣告，
+依相依關係一次算完，並依 (股票代號, 資料版本) 快取，
+讓完整分析、快速分析、提醒與買賣訊號共用同一份指標表。
+盤中報價以每檔股票一份的串流狀態常數時間更新。
+"""
+from collections import OrderedDict, deque
+import math
+import threading
+import pandas as pd
+from utils.ttl_cache import TTLCache
+
+# 指標登錄表：名稱 -> (相依指標, 計算函數)
+INDICATOR_REGISTRY = OrderedDict()
+
+
+def indicator(name, *deps):
+    """註冊指標（計算函數接收原始 df 與已算好的相依指標 dict）"""
+    def decorator(func):
+        INDICATOR_REGISTRY[name] = (deps, func)
+        return func
+    return decorator
+
+
+# ===== 均線 / 布林通道 =====
+
+@indicator('ma5')
+def _ma5(df, s):
+    return df['Close'].rolling(window=5).mean()
+
+@indicator('ma10')
+def _ma10(df, s):
+    return df['Close'].rolling(window=10).mean()
+
+@indicator('ma20')
+def _ma20(df, s):
+    return df['Close'].rolling(window=20).mean()
+
+@indicator('ma60')
+def _ma60(df, s):
+    return df['Close'].rolling(window=60).mean()
+
+@indicator('std20')
+def _std20(df, s):
+    return df['Close'].rolling(window=20).std()
+
+@indicator('bb_upper', 'ma20', 'std20')
+def _bb_upper(df, s):
+    return s['ma20'] + (s['std20'] * 2)
+
+@indicator('bb_lower', 'ma20', 'std20')
+def _bb_lower(df, s):
+    return s['ma20'] - (s['std20'] * 2)
+
+# ===== RSI =====
+
+@indicator('rsi')
+def _rsi(df, s):
+    delta = df['Close'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rs = gain / loss
+    return 100 - (100 / (1 + rs))
+
+# ===== KD =====
+
+@indicator('rsv')
+def _rsv(df, s):
+    low_14 = df['Low'].rolling(window=14).min()
+    high_14 = df['High'].rolling(window=14).max()
+    return (df['Close'] - low_14) / (high_14 - low_14) * 100
+
+@indicator('k', 'rsv')
+def _k(df, s):
+    return s['rsv'].ewm(com=2).mean()
+
+@indicator('d', 'k')
+def _d(df, s):
+    return s['k'].ewm(com=2).mean()
+
+# ===== MACD =====
+
+@indicator('ema12')
+def _ema12(df, s):
+    return df['Close'].ewm(span=12).mean()
+
+@indicator('ema26')
+def _ema26(df, s):
+    return df['Close'].ewm(span=26).mean()
+
+@indicator('macd', 'ema12', 'ema26')
+def _macd(df, s):
+    return s['ema12'] - s['ema26']
+
+@indicator('macd_signal', 'macd')
+def _macd_signal(df, s):
+    return s['macd'].ewm(span=9).mean()
+
+# ===== 成交量 =====
+
+@indicator('vol_ma20')
+def _vol_ma20(df, s):
+    return df['Volume'].rolling(window=20).mean()
+
+
+def compute_indicator_frame(df, names=None):
+    """依登錄表計算指標（相依指標只算一次）"""
+    series = {}
+
+    def resolve(name):
+        if name in series:
+            return series[name]
+        deps, func = INDICATOR_REGISTRY[name]
+        for dep in deps:
+            resolve(dep)
+        series[name] = func(df, series)
+        return series[name]
+
+    for name in (names or INDICATOR_REGISTRY.keys()):
+        resolve(name)
+
+    return pd.DataFrame(series, index=df.index)
+
+
+BAR_FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+
+def _tail_values(df, count):
+    """最後 count 根K棒的開高低收量（只轉換尾端幾列，不複製整段資料）"""
+    positions = [df.columns.get_loc(col) for col in BAR_FIELDS if col in df.columns]
+    return df.iloc[-count:].to_numpy()[:, positions].astype(float)
+
+
+# 指標需要的最少K棒數：序列不足時 compute_indicator_frame 得到 NaN（EWM 指標第一根就有值）
+WARMUP_BARS = {
+    'ma5': 5, 'ma10': 10, 'ma20': 20, 'ma60': 60,
+    'std20': 20, 'bb_upper': 20, 'bb_lower': 20,
+    'rsi': 15, 'rsv': 14, 'k': 14, 'd': 14, 'vol_ma20': 20,
+}
+
+
+def _mask_warmup(values, length):
+    """以較長歷史算出的指標值，換成只有 length 根K棒時的結果（未暖機的指標為 NaN）"""
+    return {name: math.nan if length < WARMUP_BARS.get(name, 1) else value for name, value in values.items()}
+
+
+def data_version(df):
+    """資料版本：筆數、首尾日期與最後兩根K棒（即時報價、還原權值修正前一根也會改變版本）"""
+    return (len(df), df.index[0], df.index[-1], tuple(_tail_values(df, 2).ravel().tolist()))
+
+
+def _safe_div(numerator, denominator):
+    """與 pandas 相同的除法語意：x/0 為 ±inf，0/0 為 NaN"""
+    if denominator == 0:
+        if numerator == 0 or math.isnan(numerator):
+            return math.nan
+        return math.copysign(math.inf, numerator)
+    return numerator / denominator
+
+
+class _RollingSum:
+    """固定視窗的滾動加總（只保存已收盤的 window-1 筆，加上盤中最後一筆即為完整視窗）
+
+    NaN 不加入總和，只記錄視窗內的筆數；視窗內有 NaN 時結果為 NaN（與 rolling() 相同），
+    移出視窗後即恢復，不會讓總和永久變成 NaN。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque(maxlen=window - 1)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.nan_count = 0
+
+    def push(self, value):
+        if len(self.values) == self.values.maxlen:
+            old = self.values[0]
+            if math.isnan(old):
+                self.nan_count -= 1
+            else:
+                self.total -= old
+                self.total_sq -= old * old
+        self.values.append(value)
+        if math.isnan(value):
+            self.nan_count += 1
+        else:
+            self.total += value
+            self.total_sq += value * value
+
+    def ready(self):
+        return len(self.values) == self.window - 1 and not self.nan_count
+
+    def mean_with(self, value):
+        if not self.ready():
+            return math.nan
+        return (self.total + value) / self.window
+
+    def std_with(self, value):
+        """樣本標準差（ddof=1，與 rolling().std() 相同）"""
+        if not self.ready() or math.isnan(value):
+            return math.nan
+        n = self.window
+        total = self.total + value
+        variance = (self.total_sq + value * value - total * total / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+
+class _RollingExtreme:
+    """固定視窗的最高/最低值（視窗長度固定，每筆成本為常數）"""
+
+    def __init__(self, window, func):
+        self.window = window
+        self.values = deque(maxlen=window - 1)
+        self.func = func
+
+    def push(self, value):
+        self.values.append(value)
+
+    def with_value(self, value):
+        if len(self.values) < self.window - 1:
+            return math.nan
+        return self.func(self.func(self.values), value)
+
+
+class _EWM:
+    """指數移動平均（adjust=True，與 Series.ewm().mean() 相同）"""
+
+    def __init__(self, alpha):
+        self.decay = 1 - alpha
+        self.num = 0.0
+        self.den = 0.0
+
+    def peek(self, value):
+        num = self.num * self.decay
+        den = self.den * self.decay
+        if not math.isnan(value):
+            num += value
+            den += 1.0
+        return (num, den)
+
+    def value_of(self, state):
+        num, den = state
+        return num / den if den > 0 else math.nan
+
+    def commit(self, state):
+        self.num, self.den = state
+
+
+class StreamingIndicators:
+    """串流指標狀態：每個即時報價或新K棒以常數時間更新
+
+    狀態只保存「已收盤」的K棒，最後一根（盤中）K棒可以反覆替換，
+    計算結果與 compute_indicator_frame 的最後一列一致。
+    序列起點往後移（每天切出的 1y 區間少掉最舊一根）不影響狀態：
+    滾動視窗只保存最近幾根，EWM 中一年前K棒的權重小於 1e-8（EMA26），只差浮點誤差。
+    """
+
+    def __init__(self):
+        self.first_label = None     # 第一根K棒的日期
+        self.last_label = None      # 最後一根已收盤K棒的日期
+        self.last_bar = None        # 最後一根已收盤K棒的開高低收量
+        self.live_label = None      # 盤中K棒的日期
+        self.live_bar = None
+        self.live_values = None
+        self._live_pending = None
+
+        self.prev_close = math.nan
+        self.closes = {w: _RollingSum(w) for w in (5, 10, 20, 60)}
+        self.volumes = _RollingSum(20)
+        self.gains = _RollingSum(14)
+        self.losses = _RollingSum(14)
+        self.valid_deltas = 0
+        self.lows = _RollingExtreme(14, min)
+        self.highs = _RollingExtreme(14, max)
+        self.k_ewm = _EWM(1 / 3)
+        self.d_ewm = _EWM(1 / 3)
+        self.ema12 = _EWM(2 / 13)
+        self.ema26 = _EWM(2 / 27)
+        self.signal_ewm = _EWM(2 / 10)
+
+    @classmethod
+    def from_frame(cls, df):
+        """由歷史資料建立狀態（逐筆重播，只在第一次或換日時執行）"""
+        state = cls()
+        for label, row in zip(df.index, df[['Open', 'High', 'Low', 'Close', 'Volume']].itertuples(index=False)):
+            state.add_bar(label, *row)
+        return state
+
+    def _evaluate(self, bar):
+        """以已收盤狀態加上盤中K棒計算所有指標（不修改狀態）"""
+        _, high, low, close, volume = bar
+        values = {}
+        pending = {}
+
+        for w, rolling in self.closes.items():
+            values[f'ma{w}'] = rolling.mean_with(close)
+        values['std20'] = self.closes[20].std_with(close)
+        values['bb_upper'] = values['ma20'] + values['std20'] * 2
+        values['bb_lower'] = values['ma20'] - values['std20'] * 2
+
+        # RSI（14 日簡單平均，與 calculate_indicators 相同）
+        delta = close - self.prev_close
+        gain = max(delta, 0.0) if not math.isnan(delta) else math.nan
+        loss = max(-delta, 0.0) if not math.isnan(delta) else math.nan
+        pending['gain'], pending['loss'] = gain, loss
+        if not math.isnan(delta) and self.valid_deltas >= 13:
+            rs = _safe_div(self.gains.mean_with(gain), self.losses.mean_with(loss))
+            values['rsi'] = 100 - (100 / (1 + rs)) if not math.isnan(rs) else math.nan
+        else:
+            values['rsi'] = math.nan
+
+        # KD
+        low_14 = self.lows.with_value(low)
+        high_14 = self.highs.with_value(high)
+        values['rsv'] = _safe_div(close - low_14, high_14 - low_14) * 100
+        pending['k'] = self.k_ewm.peek(values['rsv'])
+        values['k'] = self.k_ewm.value_of(pending['k'])
+        pending['d'] = self.d_ewm.peek(values['k'])
+        values['d'] = self.d_ewm.value_of(pending['d'])
+
+        # MACD
+        pending['ema12'] = self.ema12.peek(close)
+        pending['ema26'] = self.ema26.peek(close)
+        values['ema12'] = self.ema12.value_of(pending['ema12'])
+        values['ema26'] = self.ema26.value_of(pending['ema26'])
+        values['macd'] = values['ema12'] - values['ema26']
+        pending['signal'] = self.signal_ewm.peek(values['macd'])
+        values['macd_signal'] = self.signal_ewm.value_of(pending['signal'])
+
+        values['vol_ma20'] = self.volumes.mean_with(volume)
+        return values, pending
+
+    def _commit(self):
+        """將目前盤中K棒收盤，併入狀態"""
+        if self.live_bar is None:
+            return
+        _, high, low, close, volume = self.live_bar
+        pending = self._live_pending
+
+        for rolling in self.closes.values():
+            rolling.push(close)
+        self.volumes.push(volume)
+        if not math.isnan(pending['gain']):
+            self.gains.push(pending['gain'])
+            self.losses.push(pending['loss'])
+            self.valid_deltas += 1
+        self.lows.push(low)
+        self.highs.push(high)
+        self.k_ewm.commit(pending['k'])
+        self.d_ewm.commit(pending['d'])
+        self.ema12.commit(pending['ema12'])
+        self.ema26.commit(pending['ema26'])
+        self.signal_ewm.commit(pending['signal'])
+
+        self.prev_close = close
+        self.last_label = self.live_label
+        self.last_bar = self.live_bar
+        self.live_bar = None
+        self.live_label = None
+        self.live_values = None
+        self._live_pending = None
+
+    def add_bar(self, label, open_, high, low, close, volume):
+        """加入新的一根K棒（前一根自動收盤）"""
+        self._commit()
+        if self.first_label is None:
+            self.first_label = label
+        self.live_label = label
+        return self.replace_live_bar(open_, high, low, close, volume)
+
+    def replace_live_bar(self, open_, high, low, close, volume):
+        """替換盤中K棒（整根更新）"""
+        self.live_bar = (float(open_), float(high), float(low), float(close), float(volume))
+        self.live_values, self._live_pending = self._evaluate(self.live_bar)
+        return self.live_values
+
+    def _matches_closed(self, values):
+        """K棒是否與最後一根已收盤K棒的開高低收量相同"""
+        return all(a == b or (math.isnan(a) and math.isnan(b)) for a, b in zip(values, self.last_bar))
+
+    def absorb(self, df):
+        """嘗試以常數時間吸收 df 的最後一根K棒
+
+        df 可以是同一序列的任何尾段（起點不早於狀態的第一根）；
+        資料不連續、已收盤K棒被改動或 df 有狀態沒有的更早歷史時回傳 None。
+        """
+        if self.live_bar is None or self.last_bar is None or len(df) < 3 or df.index[0] < self.first_label:
+            return None
+        closed, prev, bar = _tail_values(df, 3).tolist()
+
+        if df.index[-1] == self.live_label and df.index[-2] == self.last_label and self._matches_closed(prev):
+            return self.replace_live_bar(*bar)
+
+        if df.index[-2] == self.live_label and df.index[-3] == self.last_label and self._matches_closed(closed):
+            # 新的一天：以 df 中定稿的前一根K棒收盤後，再加入新K棒
+            self.replace_live_bar(*prev)
+            return self.add_bar(df.index[-1], *bar)
+
+        return None
+
+
+class IndicatorEngine:
+    """指標引擎：每個 (股票代號, 資料版本) 只計算一次"""
+
+    def __init__(self, max_entries=64):
+        # 指標表唯讀共用，不需要讀取副本
+        self._frames = TTLCache('indicator_frames', max_entries=max_entries,
+                                max_bytes=32 * 1024 * 1024, default_ttl=3600, copy_on_read=False)
+        self._streams = TTLCache('indicator_streams', max_entries=256,
+                                 default_ttl=24 * 3600, copy_on_read=False)
+        self._lock = threading.Lock()
+
+    def frame(self, df):
+        """取得 df 對應的完整指標表（唯讀共用，請勿修改）"""
+        if df is None or df.empty:
+            return None
+
+        key = (df.attrs.get('symbol'), data_version(df))
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = compute_indicator_frame(df)
+            self._frames.set(key, frame)
+        return frame
+
+    def track(self, df):
+        """以股票的日K基準序列更新串流狀態，回傳最後一根K棒的指標值
+
+        即時報價只改動最後一根（或多一根新K棒）時以常數時間套用（replace_live_bar），
+        資料不連續（如除權息重抓）時才逐筆重播。狀態依股票代號保存，1mo/3mo 切片共用。
+        """
+        symbol = df.attrs.get('symbol') if df is not None and not df.empty else None
+        if not symbol:
+            return None
+        with self._lock:
+            stream = self._streams.get(symbol)
+            values = stream.absorb(df) if stream is not None else None
+            if values is None:
+                stream = StreamingIndicators.from_frame(df)
+                self._streams.set(symbol, stream)
+                values = stream.live_values
+        return values
+
+    def latest(self, df):
+        """取得最後一根K棒的所有指標值
+
+        同一檔股票已有串流狀態時（基準序列由 track 餵入），切片直接讀取狀態，
+        只把K棒數不足的指標換成 NaN，不重算整段歷史；EWM 指標（KD、MACD）以較長的歷史為準。
+        """
+        if df is None or df.empty:
+            return None
+
+        symbol = df.attrs.get('symbol')
+        stream = self._streams.get(symbol) if symbol else None
+        if stream is not None:
+            with self._lock:
+                values = stream.absorb(df)
+            if values is not None:
+                return pd.Series(_mask_warmup(values, len(df)))
+
+        frame = self.frame(df)
+        if symbol:
+            self.track(df)
+        return frame.iloc[-1]
+
+    def stats(self):
+        """快取統計"""
+        return [self._frames.stats(), self._streams.stats()]
+
+
+# 建立全域實例
+indicator_engine = IndicatorEngine()
@@ -0,0 +1,251 @@
+"""
+stock_intraday.py - 盤中1分K（固定大小環狀緩衝區）
+背景執行緒在交易時段批次輪詢 TWSE 即時報價，把持股與提醒股票組成1分K，
+存在每檔固定長度的 numpy 環狀緩衝區（記憶體有上限），
+讓盤中 VWAP、盤中 RSI 與突破判斷不必再額外連網。
+"""
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pytz
+from stock_symbols import normalize_code
+from utils.trading_calendar import trading_calendar
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+
+RING_CAPACITY = 300      # 一個交易日 09:00~13:30 共 270 根1分K
+POLL_INTERVAL = 20       # 秒，TWSE 即時報價有頻率限制
+WATCHLIST_REFRESH = 300  # 秒，重新整理要收集的股票清單
+
+
+class MinuteBarRing:
+    """單一股票的1分K環狀緩衝區
+
+    TWSE 的 v 是當日累積成交量，每根K棒的量為前後兩筆累積量的差。
+    """
+
+    FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.minutes = np.zeros(capacity, dtype=np.int64)  # epoch 分鐘
+        self.data = np.zeros((capacity, len(self.FIELDS)), dtype=float)
+        self.count = 0
+        self.head = -1           # 最新一根K棒的位置
+        self.session_date = None
+        self.last_cum_volume = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.count = 0
+        self.head = -1
+        self.last_cum_volume = None
+
+    def update(self, timestamp, price, cum_volume=None):
+        """加入一筆報價（timestamp 為台灣時間 datetime）"""
+        minute = int(timestamp.timestamp() // 60)
+        with self._lock:
+            if self.session_date != timestamp.date():
+                # 新交易日：清空前一天的K棒與累積量
+                self.session_date = timestamp.date()
+                self.reset()
+
+            if self.count and minute < self.minutes[self.head]:
+                return  # 較舊的報價（例如快取重送），略過，也不影響累積量
+
+            volume = 0.0
+            if cum_volume is not None:
+                if self.last_cum_volume is None:
+                    self.last_cum_volume = cum_volume
+                elif cum_volume >= self.last_cum_volume:
+                    # 累積量倒退（資料源重送較舊的量）時不更新，避免下一筆重複計算
+                    volume = float(cum_volume - self.last_cum_volume)
+                    self.last_cum_volume = cum_volume
+
+            if self.count and self.minutes[self.head] == minute:
+                bar = self.data[self.head]
+                bar[1] = max(bar[1], price)
+                bar[2] = min(bar[2], price)
+                bar[3] = price
+                bar[4] += volume
+                return
+
+            self.head = (self.head + 1) % self.capacity
+            self.minutes[self.head] = minute
+            self.data[self.head] = (price, price, price, price, volume)
+            self.count = min(self.count + 1, self.capacity)
+
+    def arrays(self):
+        """依時間排序的 (minutes, ohlcv) 副本"""
+        with self._lock:
+            if not self.count:
+                return self.minutes[:0].copy(), self.data[:0].copy()
+            order = (np.arange(self.head - self.count + 1, self.head + 1)) % self.capacity
+            return self.minutes[order], self.data[order]
+
+    def vwap(self):
+        """盤中成交量加權平均價（以收盤價近似每分鐘均價）"""
+        _, bars = self.arrays()
+        volume = bars[:, 4]
+        if not volume.sum():
+            return None
+        return float((bars[:, 3] * volume).sum() / volume.sum())
+
+    def rsi(self, period=14):
+        """盤中 RSI（1分K收盤價，與日K RSI 相同的簡單平均算法）"""
+        _, bars = self.arrays()
+        closes = bars[:, 3]
+        if len(closes) <= period:
+            return None
+        delta = np.diff(closes[-(period + 1):])
+        gain = delta[delta > 0].sum() / period
+        loss = -delta[delta < 0].sum() / period
+        if loss == 0:
+            return 100.0 if gain > 0 else 50.0
+        return float(100 - 100 / (1 + gain / loss))
+
+    def breakout(self, lookback=30):
+        """最新價突破前 lookback 根1分K的高點回傳 'up'，跌破低點回傳 'down'，否則 None"""
+        _, bars = self.arrays()
+        if len(bars) <= lookback:
+            return None
+        window = bars[-(lookback + 1):-1]
+        last = bars[-1, 3]
+        if last > window[:, 1].max():
+            return 'up'
+        if last < window[:, 2].min():
+            return 'down'
+        return None
+
+
+class IntradayCollector:
+    """盤中1分K收集器（背景執行緒）"""
+
+    def __init__(self, capacity=RING_CAPACITY, poll_interval=POLL_INTERVAL):
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.rings = {}
+        self.watchlist = {}
+        self._watchlist_at = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.polls = 0
+        self.errors = 0
+
+    def ring(self, stock_code):
+        """取得股票的環狀緩衝區（沒有資料時回傳 None）"""
+        return self.rings.get(normalize_code(stock_code))
+
+    def _ring_for(self, stock_code):
+        with self._lock:
+            ring = self.rings.get(stock_code)
+            if ring is None:
+                ring = MinuteBarRing(self.capacity)
+                self.rings[stock_code] = ring
+            return ring
+
+    def _refresh_watchlist(self):
+        if time.monotonic() - self._watchlist_at < WATCHLIST_REFRESH and self.watchlist:
+            return
+        from stock_screener import collect_watchlist
+        self.watchlist = collect_watchlist()
+        self._watchlist_at = time.monotonic()
+
+    def ingest(self, quotes, now=None):
+        """把一批 TWSE 報價寫入各股票的1分K"""
+        now = now or datetime.now(TAIWAN_TZ)
+        for stock_code, quote in quotes.items():
+            timestamp = now
+            if quote.get('time'):
+                try:
+                    hour, minute, second = (int(x) for x in quote['time'].split(':'))
+                    timestamp = now.replace(hour=hour, minute=minute, second=second, microsecond=0)
+                except ValueError:
+                    pass
+            self._ring_for(stock_code).update(timestamp, quote['price'], quote.get('volume'))
+
+    def poll_once(self):
+        """輪詢一次（僅限盤中）"""
+        if not trading_calendar.is_market_open():
+            return False
+        self._refresh_watchlist()
+        if not self.watchlist:
+            return False
+
+        from stock_analyzer import stock_analyzer
+        quotes = stock_analyzer.get_realtime_prices(list(self.watchlist.keys()))
+        self.ingest(quotes)
+        self.polls += 1
+        return True
+
+    def run(self):
+        while True:
+            try:
+                if trading_calendar.is_market_open():
+                    self.poll_once()
+                    time.sleep(self.poll_interval)
+                else:
+                    # 休市時睡到下次開盤（最多每 10 分鐘醒來一次，處理臨時停市等變動）
+                    time.sleep(min(600, max(1, trading_calendar.seconds_until_next_open())))
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ 盤中1分K收集失敗: {e}")
+                time.sleep(self.poll_interval)
+
+    def start(self):
+        """啟動背景收集執行緒"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True, name='intraday-collector')
+        self._thread.start()
+
+    def summary(self, stock_code):
+        """盤中 VWAP / RSI / 突破摘要"""
+        ring = self.ring(stock_code)
+        if ring is None or not ring.count:
+            return None
+        minutes, bars = ring.arrays()
+        return {
+            'bars': len(bars),
+            'last_price': float(bars[-1, 3]),
+            'high': float(bars[:, 1].max()),
+            'low': float(bars[:, 2].min()),
+            'volume': float(bars[:, 4].sum()),
+            'vwap': ring.vwap(),
+            'rsi': ring.rsi(),
+            'breakout': ring.breakout(),
+            'last_time': datetime.fromtimestamp(int(minutes[-1]) * 60, TAIWAN_TZ).strftime('%H:%M')
+        }
+
+
+def format_intraday_report(stock_label, summary):
+    """格式化盤中摘要（LINE 訊息）"""
+    if not summary:
+        return f"❌ {stock_label} 目前沒有盤中1分K資料（僅收集持股與提醒股票，且限交易時段）"
+
+    text = f"⏱️ {stock_label} 盤中走勢（{summary['bars']} 根1分K，至 {summary['last_time']}）\n\n"
+    text += f"💹 最新價：{summary['last_price']:.2f}元\n"
+    text += f"📈 盤中高低：{summary['low']:.2f} ~ {summary['high']:.2f}元\n"
+    if summary['vwap'] is not None:
+        position = '上方' if summary['last_price'] >= summary['vwap'] else '下方'
+        text += f"⚖️ VWAP：{summary['vwap']:.2f}元（現價在其{position}）\n"
+    if summary['rsi'] is not None:
+        text += f"📊 1分K RSI：{summary['rsi']:.1f}\n"
+    if summary['breakout'] == 'up':
+        text += "🚀 突破近30分鐘高點\n"
+    elif summary['breakout'] == 'down':
+        text += "⚠️ 跌破近30分鐘低點\n"
+    text += "\n⚠️ 僅供參考，非投資建議"
+    return text
+
+
+# 建立全域實例
+intraday_collector = IntradayCollector()
+
+
+# 對外接口
+def get_intraday_report(stock_code, stock_name=None):
+    """盤中走勢 - 對外接口"""
+    label = f"{stock_name} ({stock_code})" if stock_name else stock_code
+    return format_intraday_report(label, intraday_collector.summary(stock_code))
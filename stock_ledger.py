@@ -0,0 +1,359 @@
+"""
+stock_ledger.py - 本機記帳帳本
+以 SQLite（WAL）保存帳戶、持股、交易記錄與股票代號，是記帳資料的主要來源：
+啟動時直接從本機讀取，每筆記帳異動在回覆前寫入並落地，
+Google Sheets 只作為背景同步的副本（以版本號記錄副本同步到哪一筆異動）。
+"""
+import bisect
+import os
+import sqlite3
+import threading
+from utils.data_dir import get_data_path
+
+
+class LedgerStore:
+    """記帳帳本資料庫（SQLite，WAL + synchronous=FULL，提交後即使當機也不會遺失）"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('STOCK_LEDGER_PATH') or get_data_path('stock_ledger.db')
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS accounts (
+                name TEXT PRIMARY KEY,
+                cash INTEGER NOT NULL,
+                created_date TEXT,
+                position INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS holdings (
+                account TEXT NOT NULL,
+                stock_name TEXT NOT NULL,
+                stock_code TEXT,
+                quantity INTEGER NOT NULL,
+                avg_cost REAL NOT NULL,
+                total_cost REAL NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (account, stock_name)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS transactions (
+                seq INTEGER PRIMARY KEY,
+                id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                account TEXT NOT NULL,
+                stock_name TEXT,
+                quantity INTEGER,
+                amount INTEGER,
+                price_per_share REAL,
+                date TEXT,
+                cash_after INTEGER,
+                created_at TEXT,
+                profit_loss REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions (account, created_at);
+            CREATE INDEX IF NOT EXISTS idx_transactions_stock ON transactions (account, stock_name, seq);
+            CREATE TABLE IF NOT EXISTS stock_codes (
+                stock_name TEXT PRIMARY KEY,
+                stock_code TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        ''')
+        self.conn.commit()
+
+        # 上次寫入的內容，用來比對出這次要寫入的異動
+        self._accounts = {}
+        self._holdings = {}
+        self._stock_codes = {}
+        self._transaction_count = 0
+        self._position = 0
+        self.version = self._get_meta('version')
+
+    def _get_meta(self, key, default=0):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def is_empty(self):
+        """帳本是否尚未建立（第一次啟動，需從 Google Sheets 匯入）"""
+        with self._lock:
+            return not self._get_meta('initialized')
+
+    def has_replica(self):
+        """帳本是否曾與 Google Sheets 同步過（只在記憶體模式記帳過的帳本回傳 False）"""
+        with self._lock:
+            return self._get_meta('sheets_version') > 0
+
+    def load(self):
+        """讀取帳本為 stock_data 結構（帳戶、持股依加入順序）"""
+        stock_data = {'accounts': {}, 'transactions': [], 'stock_codes': {}}
+        with self._lock:
+            for name, cash, created_date in self.conn.execute(
+                    'SELECT name, cash, created_date FROM accounts ORDER BY position'):
+                stock_data['accounts'][name] = {'cash': cash, 'stocks': {}, 'created_date': created_date}
+
+            for account, stock_name, stock_code, quantity, avg_cost, total_cost in self.conn.execute(
+                    'SELECT h.account, h.stock_name, h.stock_code, h.quantity, h.avg_cost, h.total_cost '
+                    'FROM holdings h JOIN accounts a ON a.name = h.account ORDER BY a.position, h.position'):
+                stock_data['accounts'][account]['stocks'][stock_name] = {
+                    'quantity': quantity,
+                    'total_cost': _number(total_cost),
+                    'avg_cost': avg_cost,
+                    'stock_code': stock_code
+                }
+
+            stock_data['stock_codes'] = dict(self.conn.execute('SELECT stock_name, stock_code FROM stock_codes'))
+
+            for row in self.conn.execute(
+                    'SELECT id, type, account, stock_name, quantity, amount, price_per_share, date, '
+                    'cash_after, created_at, profit_loss FROM transactions ORDER BY seq'):
+                transaction = {
+                    'id': row[0],
+                    'type': row[1],
+                    'account': row[2],
+                    'stock_code': row[3],
+                    'quantity': row[4],
+                    'amount': row[5],
+                    'price_per_share': row[6],
+                    'date': row[7],
+                    'cash_after': row[8],
+                    'created_at': row[9]
+                }
+                if row[10] is not None:
+                    transaction['profit_loss'] = _number(row[10])
+                stock_data['transactions'].append(transaction)
+
+            self._position = self.conn.execute(
+                'SELECT MAX(p) FROM (SELECT MAX(position) AS p FROM accounts UNION ALL SELECT MAX(position) FROM holdings)'
+            ).fetchone()[0] or 0
+        self._remember(stock_data)
+        return stock_data
+
+    def _remember(self, stock_data):
+        """記錄已寫入的內容"""
+        self._accounts = _account_values(stock_data)
+        self._holdings = _holding_values(stock_data)
+        self._stock_codes = dict(stock_data['stock_codes'])
+        self._transaction_count = len(stock_data['transactions'])
+
+    def _changes(self, stock_data):
+        """與上次寫入內容比對，整理出需要寫入的資料列"""
+        stock_codes = stock_data['stock_codes']
+        accounts = _account_values(stock_data)
+        holdings = _holding_values(stock_data)
+        return {
+            'accounts': [(name, cash, created_date)
+                         for name, (cash, created_date) in accounts.items()
+                         if self._accounts.get(name) != (cash, created_date)],
+            'holdings': [key + values
+                         for key, values in holdings.items()
+                         if self._holdings.get(key) != values],
+            'removed_holdings': [key for key in self._holdings if key not in holdings],
+            'codes': [(name, code) for name, code in stock_codes.items()
+                      if code and self._stock_codes.get(name) != code],
+            'removed_codes': [(name,) for name in self._stock_codes if name not in stock_codes],
+            'transactions': [
+                (seq,) + _transaction_values(t)
+                for seq, t in enumerate(stock_data['transactions'][self._transaction_count:],
+                                        start=self._transaction_count + 1)
+            ],
+        }
+
+    def _write(self, changes):
+        """執行寫入（呼叫端需持有鎖並在同一個交易內）"""
+        for name, cash, created_date in changes['accounts']:
+            if name in self._accounts:
+                self.conn.execute('UPDATE accounts SET cash = ?, created_date = ? WHERE name = ?',
+                                  (cash, created_date, name))
+            else:
+                self._position += 1
+                self.conn.execute('INSERT INTO accounts (name, cash, created_date, position) VALUES (?, ?, ?, ?)',
+                                  (name, cash, created_date, self._position))
+        self.conn.executemany('DELETE FROM holdings WHERE account = ? AND stock_name = ?', changes['removed_holdings'])
+        for account, stock_name, stock_code, quantity, avg_cost, total_cost in changes['holdings']:
+            if (account, stock_name) in self._holdings:
+                self.conn.execute(
+                    'UPDATE holdings SET stock_code = ?, quantity = ?, avg_cost = ?, total_cost = ? '
+                    'WHERE account = ? AND stock_name = ?',
+                    (stock_code, quantity, avg_cost, total_cost, account, stock_name))
+            else:
+                self._position += 1
+                self.conn.execute(
+                    'INSERT INTO holdings (account, stock_name, stock_code, quantity, avg_cost, total_cost, position) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (account, stock_name, stock_code, quantity, avg_cost, total_cost, self._position))
+        self.conn.executemany('INSERT OR REPLACE INTO stock_codes (stock_name, stock_code) VALUES (?, ?)', changes['codes'])
+        self.conn.executemany('DELETE FROM stock_codes WHERE stock_name = ?', changes['removed_codes'])
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO transactions (seq, id, type, account, stock_name, quantity, amount, '
+            'price_per_share, date, cash_after, created_at, profit_loss) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            changes['transactions'])
+
+    def save(self, stock_data):
+        """把與上次寫入不同的部分寫入帳本（同一個交易內完成），回傳是否有異動"""
+        changes = self._changes(stock_data)
+        if not any(changes.values()):
+            return False
+
+        with self._lock:
+            with self.conn:
+                self._write(changes)
+                self._set_meta('version', self.version + 1)
+                self._set_meta('initialized', 1)
+            self.version += 1
+
+        self._remember(stock_data)
+        return True
+
+    def replace_all(self, stock_data, replicated=True):
+        """以整份資料取代帳本（第一次從 Google Sheets 匯入或重新匯入時使用）
+
+        清空與寫入在同一個交易內完成，中途失敗時帳本維持原本的內容。
+        """
+        with self._lock:
+            previous = (self._accounts, self._holdings, self._stock_codes, self._transaction_count, self._position)
+            self._accounts, self._holdings, self._stock_codes = {}, {}, {}
+            self._transaction_count = 0
+            self._position = 0
+            try:
+                with self.conn:
+                    for table in ('accounts', 'holdings', 'transactions', 'stock_codes'):
+                        self.conn.execute(f'DELETE FROM {table}')
+                    self._write(self._changes(stock_data))
+                    version = self.version + 1
+                    self._set_meta('version', version)
+                    self._set_meta('initialized', 1)
+                    if replicated:
+                        self._set_meta('sheets_version', version)
+            except Exception:
+                (self._accounts, self._holdings, self._stock_codes,
+                 self._transaction_count, self._position) = previous
+                raise
+            self.version = version
+            self._remember(stock_data)
+
+    def mark_replicated(self, version):
+        """記錄 Google Sheets 副本已同步到哪一個版本"""
+        with self._lock:
+            with self.conn:
+                if version > self._get_meta('sheets_version'):
+                    self._set_meta('sheets_version', version)
+
+    def replication_lag(self):
+        """Google Sheets 副本落後幾個版本（0 表示已同步）"""
+        with self._lock:
+            return self.version - self._get_meta('sheets_version')
+
+    def stats(self):
+        """帳本筆數統計"""
+        with self._lock:
+            counts = {
+                table: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('accounts', 'holdings', 'transactions')
+            }
+        counts['version'] = self.version
+        counts['replication_lag'] = self.replication_lag()
+        return counts
+
+
+class TransactionIndex:
+    """交易記錄的次要索引（新增交易時同步維護）
+
+    - 依建立時間排序的全部交易與各帳戶交易：最近 N 筆只取尾端 N 筆
+    - (帳戶, 股票) -> 交易（依記帳順序）：成本分析只看該檔股票的交易
+    """
+
+    def __init__(self, transactions=()):
+        self.by_time = []
+        self.by_account = {}
+        self.by_stock = {}
+        self.count = 0
+
+        # 整份資料一次排序建立（O(n log n)），之後逐筆維護
+        for transaction in transactions:
+            self.count += 1
+            self.by_time.append(self._entry(transaction))
+            self._add_stock(transaction)
+        self.by_time.sort(key=lambda item: item[:2])
+        for entry in self.by_time:
+            self.by_account.setdefault(entry[2]['account'], []).append(entry)
+
+    def _entry(self, transaction):
+        # 同一時間的交易，較早記帳的排在前面（與依建立時間穩定排序的結果相同）
+        return (str(transaction.get('created_at') or ''), -self.count, transaction)
+
+    def _add_stock(self, transaction):
+        if transaction.get('stock_code'):
+            self.by_stock.setdefault((transaction['account'], transaction['stock_code']), []).append(transaction)
+
+    @staticmethod
+    def _insert(entries, entry):
+        # 新交易幾乎都是最新的，直接接在尾端；補登舊交易時才二分插入
+        if not entries or entries[-1][:2] <= entry[:2]:
+            entries.append(entry)
+        else:
+            bisect.insort(entries, entry, key=lambda item: item[:2])
+
+    def add(self, transaction):
+        """加入一筆交易"""
+        self.count += 1
+        entry = self._entry(transaction)
+        self._insert(self.by_time, entry)
+        self._insert(self.by_account.setdefault(transaction['account'], []), entry)
+        self._add_stock(transaction)
+
+    def recent(self, limit, account_name=None):
+        """最近 limit 筆交易（新到舊）"""
+        entries = self.by_time if account_name is None else self.by_account.get(account_name, [])
+        return [entry[2] for entry in entries[:-limit - 1:-1]] if limit > 0 else []
+
+    def has_account(self, account_name):
+        """帳戶是否有交易記錄"""
+        return bool(self.by_account.get(account_name))
+
+    def for_stock(self, account_name, stock_name):
+        """某帳戶某檔股票的所有交易（依記帳順序）"""
+        return self.by_stock.get((account_name, stock_name), [])
+
+
+def _number(value):
+    """整數值的浮點數轉回整數（SQLite REAL 欄位讀回時）"""
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _account_values(stock_data):
+    return {
+        name: (account['cash'], account['created_date'])
+        for name, account in stock_data['accounts'].items()
+    }
+
+
+def _holding_values(stock_data):
+    return {
+        (account_name, stock_name): (holding.get('stock_code'), holding['quantity'],
+                                     holding['avg_cost'], holding['total_cost'])
+        for account_name, account in stock_data['accounts'].items()
+        for stock_name, holding in account['stocks'].items()
+    }
+
+
+def _transaction_values(transaction):
+    return (
+        transaction['id'], transaction['type'], transaction['account'], transaction.get('stock_code'),
+        transaction['quantity'], transaction['amount'], transaction.get('price_per_share', 0),
+        transaction['date'], transaction['cash_after'], transaction['created_at'],
+        transaction.get('profit_loss')
+    )
+
+
+# 建立全域實例（資料庫無法開啟時停用，退回以 Google Sheets 為主的記憶體模式）
+try:
+    ledger_store = LedgerStore()
+except Exception as e:
+    print(f"⚠️ 本機記帳帳本無法開啟，改用 Google Sheets 載入: {e}")
+    ledger_store = None
@@ -5,20 +5,149 @@ stock_manager.py - 獨立股票記帳模組 + Google Sheets 整合
 import re
 import os
 import json
+import hashlib
+import threading
 from datetime import datetime
 import pytz
 import gspread
 from google.oauth2.service_account import Credentials
 import traceback
+from stock_ledger import TransactionIndex, ledger_store
+from utils.write_behind import WriteBehindQueue
 
 # 設定台灣時區
 TAIWAN_TZ = pytz.timezone('Asia/Taipei')
 
+# 工作表名稱與讀取範圍（持股明細的標題可能含空白，載入時以實際名稱取代）
+ACCOUNTS_SHEET = '帳戶資訊'
+HOLDINGS_SHEET = '持股明細'
+TRANSACTIONS_SHEET = '交易記錄'
+
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files'
+REMOTE_PROBE_INTERVAL = 30  # 查詢試算表版本的最短間隔（秒）
+
+
+def _cell_int(value, default=0):
+    """儲存格轉整數（空白回傳預設值，容許 '1,000' 與 '1000.0'）"""
+    if value == '' or value is None:
+        return default
+    if isinstance(value, str):
+        value = value.replace(',', '')
+    return int(float(value))
+
+
+def _cell_float(value, default=0):
+    """儲存格轉浮點數（空白回傳預設值）"""
+    if value == '' or value is None:
+        return default
+    if isinstance(value, str):
+        value = value.replace(',', '')
+    return float(value)
+
+
+def _cell_text(value):
+    """儲存格轉字串（整數代號如 2330 不帶小數點）"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _sheet_records(values):
+    """工作表值（第一列為標題）逐列產生 {標題: 值}，缺欄補空白"""
+    if not values:
+        return
+    header = values[0]
+    width = len(header)
+    for row in values[1:]:
+        if len(row) < width:
+            row = row + [''] * (width - len(row))
+        yield dict(zip(header, row))
+
+
+def parse_ledger_values(accounts_values, holdings_values, transactions_values):
+    """把三張工作表的原始值一次解析成記帳資料
+
+    各參數為工作表的二維值（第一列為標題，缺少的工作表傳 None）。
+    回傳 (stock_data, sheet_rows, skipped)：sheet_rows 為各工作表資料列數，
+    skipped 為各工作表無法解析而略過的列數。
+    """
+    stock_data = {'accounts': {}, 'transactions': [], 'stock_codes': {}}
+    sheet_rows = {}
+    skipped = {'accounts': 0, 'holdings': 0, 'transactions': 0}
+    accounts = stock_data['accounts']
+
+    if accounts_values is not None:
+        sheet_rows['accounts'] = max(0, len(accounts_values) - 1)
+        for row in _sheet_records(accounts_values):
+            try:
+                account_name = _cell_text(row.get('帳戶名稱', ''))
+                if not account_name:
+                    skipped['accounts'] += 1
+                    continue
+                accounts[account_name] = {
+                    'cash': _cell_int(row.get('現金餘額')),
+                    'stocks': {},
+                    'created_date': row.get('建立日期', '')
+                }
+            except (TypeError, ValueError):
+                skipped['accounts'] += 1
+
+    if holdings_values is not None:
+        sheet_rows['holdings'] = max(0, len(holdings_values) - 1)
+        for row in _sheet_records(holdings_values):
+            try:
+                account_name = _cell_text(row.get('帳戶名稱', ''))
+                stock_name = _cell_text(row.get('股票名稱', ''))
+                stock_code = _cell_text(row.get('股票代號', '')) or None
+                if not (account_name and stock_name and account_name in accounts):
+                    skipped['holdings'] += 1
+                    continue
+                accounts[account_name]['stocks'][stock_name] = {
+                    'quantity': _cell_int(row.get('持股數量')),
+                    'avg_cost': _cell_float(row.get('平均成本')),
+                    'total_cost': _cell_int(row.get('總成本')),
+                    'stock_code': stock_code
+                }
+                # 同時建立股票代號對應
+                if stock_code:
+                    stock_data['stock_codes'][stock_name] = stock_code
+            except (TypeError, ValueError):
+                skipped['holdings'] += 1
+
+    if transactions_values is not None:
+        sheet_rows['transactions'] = max(0, len(transactions_values) - 1)
+        transactions = stock_data['transactions']
+        for row in _sheet_records(transactions_values):
+            try:
+                if row.get('交易ID', '') == '':
+                    skipped['transactions'] += 1
+                    continue
+                stock_name = row.get('股票名稱', '')
+                profit_loss = row.get('損益', '')
+                transactions.append({
+                    'id': _cell_int(row['交易ID']),
+                    'type': row.get('類型', ''),
+                    'account': _cell_text(row.get('帳戶', '')),
+                    'stock_code': _cell_text(stock_name) if stock_name != '' else None,
+                    'quantity': _cell_int(row.get('數量')),
+                    'amount': _cell_int(row.get('金額')),
+                    'price_per_share': _cell_float(row.get('單價')),
+                    'date': row.get('日期', ''),
+                    'cash_after': _cell_int(row.get('現金餘額')),
+                    'created_at': row.get('建立時間', ''),
+                    'profit_loss': _cell_float(profit_loss) if profit_loss != '' else None
+                })
+            except (TypeError, ValueError):
+                skipped['transactions'] += 1
+
+    return stock_data, sheet_rows, skipped
+
+
 class StockManager:
-    """股票記帳管理器 - 整合 Google Sheets"""
+    """股票記帳管理器 - 本機帳本為主，Google Sheets 為副本"""
     
-    def __init__(self):
-        """初始化股票資料和 Google Sheets 連接"""
+    def __init__(self, ledger=ledger_store):
+        """初始化股票資料和 Google Sheets 連接（ledger=None 時只用記憶體與 Google Sheets）"""
         # 初始化資料結構
         self.stock_data = {
             'accounts': {},
@@ -31,16 +160,102 @@ class StockManager:
         self.gc = None
         self.sheet = None
         self.sheets_enabled = False
+        self.sheets_loaded = False   # 已取得試算表內容作為同步基準（載入失敗前不寫入試算表）
         self.last_sync_time = None
+        self.holdings_title = None
+        self.reset_sync_state()
+        
+        # 外部修改偵測：Drive 版本與各工作表內容校驗碼
+        self.remote_version = None
+        self.remote_modified_time = None
+        self.last_probe_time = None
+        
+        # 記帳異動先寫入本機帳本，再由背景佇列合併寫入 Google Sheets
+        self.ledger = ledger
+        self.lock = threading.RLock()
+        self.sync_queue = WriteBehindQueue('Google Sheets 同步', self.sync_to_sheets_safe)
         
         # 初始化 Google Sheets 連接
         self.init_google_sheets()
         
-        # 從 Google Sheets 載入資料
-        if self.sheets_enabled:
-            self.load_from_sheets_debug()
+        has_ledger = self.ledger is not None and not self.ledger.is_empty()
+        if has_ledger and (not self.sheets_enabled or self.ledger.has_replica()):
+            self.load_from_ledger()
+        elif self.sheets_enabled:
+            # 第一次連接 Google Sheets：從試算表載入並建立本機帳本
+            if self.load_from_sheets_debug():
+                self.adopt_sheet_data()
+            else:
+                print("⚠️ 尚未從 Google Sheets 載入帳本，暫停記帳與寫入試算表，稍後重試載入")
         else:
             print("📊 股票記帳模組初始化完成（記憶體模式）")
+        
+        self.rebuild_indexes()
+    
+    def adopt_sheet_data(self):
+        """第一次載入試算表後建立本機帳本（試算表為空且本機已有記憶體模式的帳時以本機為準）"""
+        if self.ledger is None:
+            return
+        has_ledger = not self.ledger.is_empty()
+        if has_ledger and not (self.stock_data['accounts'] or self.stock_data['transactions']):
+            # 試算表是空的，本機帳本已有記憶體模式時記的帳：以本機為準寫到試算表
+            self.load_from_ledger()
+        else:
+            if has_ledger:
+                print("⚠️ 試算表已有資料，以試算表取代未同步過的本機帳本")
+            self.ledger.replace_all(self.stock_data)
+            print("📒 已從 Google Sheets 建立本機帳本")
+    
+    def ensure_sheets_loaded(self):
+        """連接 Google Sheets 但啟動時載入失敗：重試載入，成功才允許記帳與同步（需在 self.lock 內呼叫）
+        
+        載入前的記憶體資料是空的，以它記帳或同步都會覆蓋試算表上的真實資料。
+        """
+        if not self.sheets_enabled or self.sheets_loaded:
+            return True
+        print("🔄 重試從 Google Sheets 載入帳本...")
+        if not self.load_from_sheets_debug():
+            return False
+        self.adopt_sheet_data()
+        self.rebuild_indexes()
+        return True
+    
+    def rebuild_indexes(self):
+        """重建交易記錄索引（整份資料載入後呼叫）"""
+        self.transaction_index = TransactionIndex(self.stock_data['transactions'])
+    
+    def add_transaction(self, transaction):
+        """新增交易記錄並更新索引"""
+        self.stock_data['transactions'].append(transaction)
+        self.transaction_index.add(transaction)
+    
+    def load_from_ledger(self):
+        """從本機帳本載入資料（不需網路）"""
+        self.stock_data = self.ledger.load()
+        print(f"📒 從本機帳本載入 {len(self.stock_data['accounts'])} 個帳戶、"
+              f"{len(self.stock_data['transactions'])} 筆交易記錄")
+        
+        if not self.sheets_enabled:
+            return
+        self.sheets_loaded = True
+        if self.ledger.replication_lag():
+            # 上次結束前還有異動沒寫到 Google Sheets：整張重寫一次
+            print(f"☁️ Google Sheets 副本落後 {self.ledger.replication_lag()} 筆異動，排入同步")
+            self.sync_queue.mark_dirty()
+        else:
+            self.mark_synced(self.account_rows(), self.holding_rows(), len(self.stock_data['transactions']))
+    
+    def persist_ledger(self):
+        """把記憶體中的異動寫入本機帳本，回傳是否成功（需在 self.lock 內呼叫）"""
+        if self.ledger is None:
+            return True
+        try:
+            self.ledger.save(self.stock_data)
+            return True
+        except Exception as e:
+            print(f"❌ 寫入本機帳本失敗: {e}")
+            traceback.print_exc()
+            return False
     
     def init_google_sheets(self):
         """初始化 Google Sheets 連接"""
@@ -76,270 +291,402 @@ class StockManager:
             print("📝 將使用記憶體模式運行")
             return False
     
+    def fetch_sheet_values(self):
+        """以一次 values.batchGet 讀取三張工作表，回傳 {'accounts'|'holdings'|'transactions': 二維值}"""
+        params = {'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'}
+        
+        def batch_get(titles):
+            ranges = [f"'{title}'!A:{last_col}" for title, last_col in titles.values()]
+            response = self.sheet.values_batch_get(ranges, params=params)
+            return {
+                key: value_range.get('values', [])
+                for key, value_range in zip(titles, response.get('valueRanges', []))
+            }
+        
+        titles = {
+            'accounts': (ACCOUNTS_SHEET, 'C'),
+            'holdings': (self.holdings_title or HOLDINGS_SHEET, 'F'),
+            'transactions': (TRANSACTIONS_SHEET, 'K')
+        }
+        try:
+            return batch_get(titles)
+        except gspread.exceptions.APIError as e:
+            # 工作表名稱與預設不同（例如持股明細標題含空白）或缺少工作表：
+            # 查一次實際的工作表名稱，只讀取存在的工作表
+            print(f"⚠️ 批次讀取失敗，重新查詢工作表名稱: {e}")
+            existing = [ws.title for ws in self.sheet.worksheets()]
+            self.holdings_title = next((t for t in existing if HOLDINGS_SHEET in t.strip()), None)
+            titles['holdings'] = (self.holdings_title, 'F')
+            titles = {key: value for key, value in titles.items() if value[0] in existing}
+            for key in ('accounts', 'holdings', 'transactions'):
+                if key not in titles:
+                    print(f"⚠️ 找不到工作表：{key}")
+            return batch_get(titles) if titles else {}
+    
     def load_from_sheets_debug(self):
-        """從 Google Sheets 載入資料"""
+        """從 Google Sheets 載入資料（一次 API 請求讀取所有工作表），回傳是否成功"""
         if not self.sheets_enabled:
-            return
+            return False
         
         try:
             print("🔄 載入 Google Sheets 資料...")
-            
-            worksheets = self.sheet.worksheets()
-            print(f"📋 找到 {len(worksheets)} 個工作表")
-            
-            # 載入帳戶資訊
-            try:
-                accounts_sheet = self.sheet.worksheet("帳戶資訊")
-                accounts_data = accounts_sheet.get_all_records()
-                
-                for row in accounts_data:
-                    if row.get('帳戶名稱'):
-                        self.stock_data['accounts'][row['帳戶名稱']] = {
-                            'cash': int(row.get('現金餘額', 0)),
-                            'stocks': {},
-                            'created_date': row.get('建立日期', self.get_taiwan_time())
-                        }
-                print(f"✅ 載入 {len(self.stock_data['accounts'])} 個帳戶")
-                
-            except Exception as e:
-                print(f"❌ 載入帳戶資訊失敗: {e}")
-            
-            # 載入持股明細
-            try:
-                holdings_sheet = None
-                for ws in worksheets:
-                    if '持股明細' in ws.title.strip():
-                        holdings_sheet = ws
-                        break
-                
-                if holdings_sheet:
-                    holdings_data = holdings_sheet.get_all_records()
-                    holdings_count = 0
-                    
-                    for row in holdings_data:
-                        account_name = row.get('帳戶名稱')
-                        stock_name = row.get('股票名稱')
-                        stock_code = row.get('股票代號')
-                        
-                        if account_name and stock_name and account_name in self.stock_data['accounts']:
-                            self.stock_data['accounts'][account_name]['stocks'][stock_name] = {
-                                'quantity': int(row.get('持股數量', 0)),
-                                'avg_cost': float(row.get('平均成本', 0)),
-                                'total_cost': int(row.get('總成本', 0)),
-                                'stock_code': str(stock_code) if stock_code else None
-                            }
-                            
-                            # 同時建立股票代號對應
-                            if stock_code:
-                                self.stock_data['stock_codes'][stock_name] = str(stock_code)
-                            
-                            holdings_count += 1
-                    
-                    print(f"✅ 載入 {holdings_count} 筆持股記錄")
-                    print(f"✅ 載入 {len(self.stock_data['stock_codes'])} 個股票代號")
-                else:
-                    print("⚠️ 找不到持股明細工作表")
-                
-            except Exception as e:
-                print(f"❌ 載入持股明細失敗: {e}")
-                
-            # 載入交易記錄
-            try:
-                transactions_sheet = self.sheet.worksheet("交易記錄")
-                transactions_data = transactions_sheet.get_all_records()
-                
-                for row in transactions_data:
-                    if row.get('交易ID'):
-                        transaction = {
-                            'id': int(row['交易ID']),
-                            'type': row.get('類型', ''),
-                            'account': row.get('帳戶', ''),
-                            'stock_code': row.get('股票名稱') if row.get('股票名稱') else None,
-                            'quantity': int(row.get('數量', 0)),
-                            'amount': int(row.get('金額', 0)),
-                            'price_per_share': float(row.get('單價', 0)) if row.get('單價') else 0,
-                            'date': row.get('日期', ''),
-                            'cash_after': int(row.get('現金餘額', 0)),
-                            'created_at': row.get('建立時間', ''),
-                            'profit_loss': float(row.get('損益', 0)) if row.get('損益') else None
-                        }
-                        self.stock_data['transactions'].append(transaction)
-                
-                print(f"✅ 載入 {len(self.stock_data['transactions'])} 筆交易記錄")
-                
-            except Exception as e:
-                print(f"❌ 載入交易記錄失敗: {e}")
-            
+            version = self.probe_remote_version()
+            values = self.fetch_sheet_values()
+            if not values:
+                print("❌ 載入 Google Sheets 資料失敗: 找不到任何工作表")
+                return False
+            self.apply_sheet_values(values)
+            self.remote_version = version
+            self.sheets_loaded = True
             print(f"✅ 資料載入完成")
+            return True
             
         except Exception as e:
             print(f"❌ 載入 Google Sheets 資料失敗: {e}")
             traceback.print_exc()
+            return False
+    
+    def apply_sheet_values(self, values):
+        """以試算表讀回的值取代記憶體資料，並設定同步基準"""
+        self.reset_sync_state()
+        stock_data, sheet_rows, skipped = parse_ledger_values(
+            values.get('accounts'), values.get('holdings'), values.get('transactions'))
+        self.stock_data = stock_data
+        
+        print(f"✅ 載入 {len(stock_data['accounts'])} 個帳戶")
+        print(f"✅ 載入 {sum(len(a['stocks']) for a in stock_data['accounts'].values())} 筆持股記錄")
+        print(f"✅ 載入 {len(stock_data['stock_codes'])} 個股票代號")
+        print(f"✅ 載入 {len(stock_data['transactions'])} 筆交易記錄")
+        if any(skipped.values()):
+            print(f"⚠️ 略過無法解析的資料列: {skipped}")
+        
+        # 試算表每一列都成功載入時，以載入的資料作為同步基準，
+        # 之後只寫入變動的列；否則第一次同步整張重寫
+        self.mark_synced(self.account_rows(), self.holding_rows(),
+                         len(self.stock_data['transactions']), sheet_rows)
+        if len(self.synced_accounts) != sheet_rows.get('accounts'):
+            self.synced_accounts = None
+        if len(self.synced_holdings) != sheet_rows.get('holdings'):
+            self.synced_holdings = None
+        if self.synced_transactions != sheet_rows.get('transactions'):
+            self.synced_transactions = None
+    
+    def probe_remote_version(self):
+        """查詢試算表在 Drive 的版本（只取 modifiedTime 與 version 欄位，查詢失敗回傳 None）"""
+        try:
+            response = self.gc.request(
+                'get', f"{DRIVE_FILES_URL}/{self.sheet.id}",
+                params={'fields': 'modifiedTime,version', 'supportsAllDrives': True}
+            )
+            metadata = response.json()
+            self.remote_modified_time = metadata.get('modifiedTime')
+            return metadata.get('version') or metadata.get('modifiedTime')
+        except Exception as e:
+            print(f"⚠️ 查詢試算表版本失敗: {e}")
+            return None
+    
+    def content_checksums(self, stock_data):
+        """各工作表內容的校驗碼（以正規化後的列計算，試算表讀回的資料與記憶體資料可直接比對）"""
+        def normalize(value):
+            if value is None:
+                return ''
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            return str(value)
+        
+        def checksum(rows):
+            digest = hashlib.sha1()
+            for row in rows:
+                digest.update('\x1f'.join(normalize(v) for v in row).encode('utf-8'))
+                digest.update(b'\n')
+            return digest.hexdigest()
+        
+        return {
+            'accounts': checksum(row for _, row in self.account_rows(stock_data)),
+            'holdings': checksum(row for _, row in self.holding_rows(stock_data)),
+            'transactions': checksum(self.transaction_row(t) for t in stock_data['transactions'])
+        }
     
     def check_and_reload_if_needed(self):
-        """檢查是否需要重新載入資料"""
+        """試算表被手動修改時才重新載入
+
+        先查詢 Drive 版本（極小的請求），版本沒變就不讀取；版本改變時一次讀取三張工作表，
+        比對各工作表校驗碼，只有內容與本機不同（外部修改）才匯入。
+        """
         if not self.sheets_enabled:
             return
         
         import time
-        current_time = time.time()
+        now = time.time()
+        if self.last_probe_time is not None and now - self.last_probe_time < REMOTE_PROBE_INTERVAL:
+            return
+        self.last_probe_time = now
+        
+        with self.lock:
+            if not self.ensure_sheets_loaded():
+                return
+        
+        # 還有異動沒寫到試算表時，差異來自本機，等同步完成後再比對
+        if self.has_unsynced_changes():
+            return
+        # 讀取試算表不持有鎖，記下目前的異動計數，匯入前確認期間沒有新的記帳
+        local_version = self.local_version()
+        
+        version = self.probe_remote_version()
+        if version is None or version == self.remote_version:
+            return
         
-        if (self.last_sync_time is None or 
-            current_time - self.last_sync_time > 30):
-            print("🔄 檢測到可能的外部修改，重新載入資料...")
-            self.reload_data_from_sheets()
+        try:
+            values = self.fetch_sheet_values()
+        except Exception as e:
+            print(f"⚠️ 讀取試算表失敗: {e}")
+            return
+        if any(key not in values for key in ('accounts', 'holdings', 'transactions')):
+            return
+        
+        remote_data, _, _ = parse_ledger_values(
+            values.get('accounts'), values.get('holdings'), values.get('transactions'))
+        remote_checksums = self.content_checksums(remote_data)
+        
+        with self.lock:
+            if self.local_version() != local_version or self.has_unsynced_changes():
+                # 讀取期間有新的記帳，讀回的內容已過時；保留 remote_version，下次探測再比對
+                print("⏳ 讀取試算表期間本機有新的異動，暫不匯入")
+                return
+            local_checksums = self.content_checksums(self.stock_data)
+            changed = [sheet for sheet, value in remote_checksums.items() if value != local_checksums[sheet]]
+            self.remote_version = version
+            if not changed:
+                print(f"✅ 試算表版本 {version} 內容與本機相同，不需重新載入")
+                return
+            if self.stock_data['transactions'] and not remote_data['transactions']:
+                # 交易記錄整張被清空多半是誤刪，保留本機資料，下次同步會寫回
+                print("⚠️ 試算表交易記錄被清空，保留本機資料")
+                self.reset_sync_state()
+                self.sync_queue.mark_dirty()
+                return
+            
+            print(f"🔄 偵測到試算表被修改（{', '.join(changed)}，{self.remote_modified_time}），重新載入資料...")
+            self.import_sheet_values(values)
+    
+    def local_version(self):
+        """本機資料的異動計數（帳本版本、同步佇列的異動數），任何記帳都會改變"""
+        ledger_version = self.ledger.version if self.ledger is not None else 0
+        return (ledger_version, self.sync_queue.mutations)
 
-    def reload_data_from_sheets(self):
-        """重新從 Google Sheets 載入最新資料"""
-        if self.sheets_enabled:
-            print("🔄 重新載入 Google Sheets 最新資料...")
-            self.stock_data = {'accounts': {}, 'transactions': [], 'stock_codes': {}}
-            self.load_from_sheets_debug()
+    def has_unsynced_changes(self):
+        """是否還有異動沒寫到試算表"""
+        return bool(self.sync_queue.pending or (self.ledger is not None and self.ledger.replication_lag()))
+
+    def import_sheet_values(self, values):
+        """匯入試算表讀回的值：取代記憶體資料、重建索引並寫入本機帳本（需在 self.lock 內呼叫）"""
+        self.apply_sheet_values(values)
+        self.rebuild_indexes()
+        if self.ledger is not None:
+            self.ledger.replace_all(self.stock_data)
+
+    # 各工作表欄位（與試算表標題列一致）
+    ACCOUNT_HEADER = ['帳戶名稱', '現金餘額', '建立日期']
+    HOLDING_HEADER = ['帳戶名稱', '股票名稱', '股票代號', '持股數量', '平均成本', '總成本']
+    TRANSACTION_HEADER = ['交易ID', '類型', '帳戶', '股票名稱', '數量', '金額', '單價', '日期', '現金餘額', '建立時間', '損益']
+
+    def reset_sync_state(self):
+        """清除同步基準（下次同步整張重寫）"""
+        self.synced_accounts = None       # 上次寫入的帳戶列 [(帳戶名稱, 列內容), ...]
+        self.synced_holdings = None       # 上次寫入的持股列 [((帳戶, 股票), 列內容), ...]
+        self.synced_transactions = None   # 已寫入的交易筆數
+        self.sheet_rows = {}              # 各工作表目前資料列數（不含標題列）
+
+    def mark_synced(self, accounts, holdings, transaction_count, sheet_rows=None):
+        """記錄試算表目前內容作為同步基準"""
+        self.synced_accounts = accounts
+        self.synced_holdings = holdings
+        self.synced_transactions = transaction_count
+        if sheet_rows is None:
+            sheet_rows = {
+                'accounts': len(self.synced_accounts),
+                'holdings': len(self.synced_holdings),
+                'transactions': self.synced_transactions
+            }
+        self.sheet_rows = sheet_rows
+
+    def account_rows(self, stock_data=None):
+        """帳戶資訊工作表的資料列"""
+        stock_data = self.stock_data if stock_data is None else stock_data
+        return [
+            (account_name, [account_name, account_data['cash'], account_data['created_date']])
+            for account_name, account_data in stock_data['accounts'].items()
+        ]
+
+    def holding_rows(self, stock_data=None):
+        """持股明細工作表的資料列（依帳戶、持股的加入順序）"""
+        stock_data = self.stock_data if stock_data is None else stock_data
+        rows = []
+        for account_name, account_data in stock_data['accounts'].items():
+            for stock_name, stock_data in account_data['stocks'].items():
+                rows.append(((account_name, stock_name), [
+                    account_name,
+                    stock_name,
+                    stock_data.get('stock_code', ''),
+                    stock_data['quantity'],
+                    stock_data['avg_cost'],
+                    stock_data['total_cost']
+                ]))
+        return rows
+
+    def transaction_row(self, transaction):
+        """交易記錄工作表的一列"""
+        return [
+            transaction['id'],
+            transaction['type'],
+            transaction['account'],
+            transaction.get('stock_code', ''),
+            transaction['quantity'],
+            transaction['amount'],
+            transaction.get('price_per_share', 0),
+            transaction['date'],
+            transaction['cash_after'],
+            transaction['created_at'],
+            transaction.get('profit_loss', '')
+        ]
+
+    def get_holdings_title(self):
+        """持股明細工作表名稱（標題可能含空白，以包含比對）"""
+        if not self.holdings_title:
+            for ws in self.sheet.worksheets():
+                if HOLDINGS_SHEET in ws.title.strip():
+                    self.holdings_title = ws.title
+                    break
+        return self.holdings_title
+
+    @staticmethod
+    def sheet_range(title, last_col, first_row, last_row):
+        return f"'{title}'!A{first_row}:{last_col}{last_row}"
+
+    def diff_keyed_rows(self, title, last_col, header, synced, current, sheet_rows):
+        """比對帳戶/持股列，回傳 (要寫入的範圍, 是否需清除舊資料)
+
+        列的順序沒變（只有修改或在尾端新增）時只寫入變動的列；
+        有列被刪除或順序改變時整段重寫，多出的舊列以空白覆蓋。
+        """
+        data = []
+        synced_keys = [key for key, _ in synced] if synced is not None else None
+        current_keys = [key for key, _ in current]
+
+        if synced_keys is not None and current_keys[:len(synced_keys)] == synced_keys:
+            start = None
+            for i, (_, row) in enumerate(current + [(None, None)]):
+                changed = row is not None and (i >= len(synced) or synced[i][1] != row)
+                if changed and start is None:
+                    start = i
+                elif not changed and start is not None:
+                    # 連續變動的列合併成一個範圍（第 i 筆資料在第 i+2 列）
+                    data.append({
+                        'range': self.sheet_range(title, last_col, start + 2, i + 1),
+                        'values': [r for _, r in current[start:i]]
+                    })
+                    start = None
+            return data, False
+
+        values = [header] + [row for _, row in current]
+        if sheet_rows is not None:
+            values += [[''] * len(header)] * max(0, sheet_rows - len(current))
+        data.append({
+            'range': self.sheet_range(title, last_col, 1, len(values)),
+            'values': values
+        })
+        return data, sheet_rows is None
+
+    def build_sync_batch(self, holdings_title):
+        """比對同步基準，組出要寫入的範圍（只讀記憶體資料，需在 self.lock 內呼叫）"""
+        accounts = self.account_rows()
+        holdings = self.holding_rows()
+        transactions = self.stock_data['transactions']
+        
+        data = []
+        clear_ranges = []
+        
+        account_data, clear = self.diff_keyed_rows(
+            ACCOUNTS_SHEET, 'C', self.ACCOUNT_HEADER, self.synced_accounts, accounts,
+            self.sheet_rows.get('accounts'))
+        data += account_data
+        if clear:
+            clear_ranges.append(f"'{ACCOUNTS_SHEET}'!A{len(accounts) + 2}:C")
+        
+        holding_data, clear = self.diff_keyed_rows(
+            holdings_title, 'F', self.HOLDING_HEADER, self.synced_holdings, holdings,
+            self.sheet_rows.get('holdings'))
+        data += holding_data
+        if clear:
+            clear_ranges.append(f"'{holdings_title}'!A{len(holdings) + 2}:F")
+        
+        # 交易記錄只會新增：從上次寫到的筆數之後附加
+        synced_count = self.synced_transactions
+        if synced_count is not None and synced_count <= len(transactions):
+            if synced_count < len(transactions):
+                data.append({
+                    'range': self.sheet_range(TRANSACTIONS_SHEET, 'K', synced_count + 2, len(transactions) + 1),
+                    'values': [self.transaction_row(t) for t in transactions[synced_count:]]
+                })
+        else:
+            values = [self.TRANSACTION_HEADER] + [self.transaction_row(t) for t in transactions]
+            sheet_rows = self.sheet_rows.get('transactions')
+            if sheet_rows is not None:
+                values += [[''] * len(self.TRANSACTION_HEADER)] * max(0, sheet_rows - len(transactions))
+            else:
+                clear_ranges.append(f"'{TRANSACTIONS_SHEET}'!A{len(transactions) + 2}:K")
+            data.append({
+                'range': self.sheet_range(TRANSACTIONS_SHEET, 'K', 1, len(values)),
+                'values': values
+            })
+        
+        return data, clear_ranges, (accounts, holdings, len(transactions))
 
     def sync_to_sheets_safe(self):
-        """安全同步資料到 Google Sheets"""
+        """安全同步資料到 Google Sheets（只寫入變動的列，整批一次送出）"""
         if not self.sheets_enabled:
             return False
+        if not self.sheets_loaded:
+            # 不知道試算表原本的內容，寫入會覆蓋真實資料；交給佇列退避重試
+            print("⏳ 尚未從 Google Sheets 載入帳本，暫不寫入試算表")
+            return False
         
         try:
             import time
             self.last_sync_time = time.time()
             
-            print("🔄 安全同步資料到 Google Sheets...")
-            
-            # 同步帳戶資訊
-            print("📊 同步帳戶資訊...")
-            try:
-                accounts_sheet = self.sheet.worksheet("帳戶資訊")
-                
-                try:
-                    current_header = accounts_sheet.row_values(1)
-                    expected_header = ['帳戶名稱', '現金餘額', '建立日期']
-                    if current_header != expected_header:
-                        accounts_sheet.update('A1:C1', [expected_header])
-                except:
-                    accounts_sheet.update('A1:C1', [['帳戶名稱', '現金餘額', '建立日期']])
-                
-                data_rows = []
-                for account_name, account_data in self.stock_data['accounts'].items():
-                    data_rows.append([
-                        account_name,
-                        account_data['cash'],
-                        account_data['created_date']
-                    ])
-                
-                if data_rows:
-                    range_name = f"A2:C{len(data_rows) + 1}"
-                    accounts_sheet.update(range_name, data_rows)
-                    
-                    current_rows = len(accounts_sheet.get_all_values())
-                    if current_rows > len(data_rows) + 1:
-                        clear_range = f"A{len(data_rows) + 2}:C{current_rows}"
-                        accounts_sheet.batch_clear([clear_range])
-                
-                print("✅ 帳戶資訊同步成功")
-            except Exception as e:
-                print(f"❌ 同步帳戶資訊失敗: {e}")
+            holdings_title = self.get_holdings_title()
+            if not holdings_title:
+                print("❌ 找不到持股明細工作表")
                 return False
             
-            # 同步持股明細
-            print("📈 同步持股明細...")
-            try:
-                holdings_sheet = None
-                worksheets = self.sheet.worksheets()
-                for ws in worksheets:
-                    if '持股明細' in ws.title.strip():
-                        holdings_sheet = ws
-                        break
-                
-                if holdings_sheet:
-                    try:
-                        expected_header = ['帳戶名稱', '股票名稱', '股票代號', '持股數量', '平均成本', '總成本']
-                        holdings_sheet.update('A1:F1', [expected_header])
-                    except:
-                        pass
-                    
-                    data_rows = []
-                    for account_name, account_data in self.stock_data['accounts'].items():
-                        for stock_name, stock_data in account_data['stocks'].items():
-                            stock_code = stock_data.get('stock_code', '')
-                            data_rows.append([
-                                account_name,
-                                stock_name,
-                                stock_code,
-                                stock_data['quantity'],
-                                stock_data['avg_cost'],
-                                stock_data['total_cost']
-                            ])
-                    
-                    if data_rows:
-                        range_name = f"A2:F{len(data_rows) + 1}"
-                        holdings_sheet.update(range_name, data_rows)
-                        
-                        current_rows = len(holdings_sheet.get_all_values())
-                        if current_rows > len(data_rows) + 1:
-                            clear_range = f"A{len(data_rows) + 2}:F{current_rows}"
-                            holdings_sheet.batch_clear([clear_range])
-                    else:
-                        current_rows = len(holdings_sheet.get_all_values())
-                        if current_rows > 1:
-                            clear_range = f"A2:F{current_rows}"
-                            holdings_sheet.batch_clear([clear_range])
-                    
-                    print("✅ 持股明細同步成功")
-                else:
-                    print("❌ 找不到持股明細工作表")
-                    return False
-            except Exception as e:
-                print(f"❌ 同步持股明細失敗: {e}")
-                return False
+            # 在鎖內取出要寫入的內容，網路請求期間不阻擋記帳指令
+            with self.lock:
+                data, clear_ranges, synced = self.build_sync_batch(holdings_title)
+                version = self.ledger.version if self.ledger is not None else None
             
-            # 同步交易記錄
-            print("📋 同步交易記錄...")
-            try:
-                transactions_sheet = self.sheet.worksheet("交易記錄")
-                
-                try:
-                    expected_header = ['交易ID', '類型', '帳戶', '股票名稱', '數量', '金額', '單價', '日期', '現金餘額', '建立時間', '損益']
-                    transactions_sheet.update('A1:K1', [expected_header])
-                except:
-                    pass
-                
-                data_rows = []
-                for transaction in self.stock_data['transactions']:
-                    data_rows.append([
-                        transaction['id'],
-                        transaction['type'],
-                        transaction['account'],
-                        transaction.get('stock_code', ''),
-                        transaction['quantity'],
-                        transaction['amount'],
-                        transaction.get('price_per_share', 0),
-                        transaction['date'],
-                        transaction['cash_after'],
-                        transaction['created_at'],
-                        transaction.get('profit_loss', '')
-                    ])
-                
-                if data_rows:
-                    range_name = f"A2:K{len(data_rows) + 1}"
-                    transactions_sheet.update(range_name, data_rows)
-                    
-                    current_rows = len(transactions_sheet.get_all_values())
-                    if current_rows > len(data_rows) + 1:
-                        clear_range = f"A{len(data_rows) + 2}:K{current_rows}"
-                        transactions_sheet.batch_clear([clear_range])
-                else:
-                    current_rows = len(transactions_sheet.get_all_values())
-                    if current_rows > 1:
-                        clear_range = f"A2:K{current_rows}"
-                        transactions_sheet.batch_clear([clear_range])
-                
-                print("✅ 交易記錄同步成功")
-            except Exception as e:
-                print(f"❌ 同步交易記錄失敗: {e}")
-                return False
+            if not data and not clear_ranges:
+                print("✅ Google Sheets 已是最新，無需同步")
+                if self.ledger is not None:
+                    self.ledger.mark_replicated(version)
+                return True
             
+            print(f"🔄 同步 Google Sheets（{len(data)} 個範圍）...")
+            if clear_ranges:
+                # 不知道工作表原本有幾列時（例如載入失敗），先清除尾端舊資料
+                self.sheet.values_batch_clear(body={'ranges': clear_ranges})
+            if data:
+                self.sheet.values_batch_update(body={'valueInputOption': 'RAW', 'data': data})
+            
+            # 寫入成功才更新基準；失敗時下次同步會重送同一批變動
+            self.mark_synced(*synced)
+            if self.ledger is not None:
+                self.ledger.mark_replicated(version)
+            
+            # 記下這次寫入後的試算表版本，自己的寫入不會被當成外部修改而重新載入
+            remote_version = self.probe_remote_version()
+            if remote_version is not None:
+                self.remote_version = remote_version
             print("✅ 安全同步完成")
             return True
             
@@ -348,6 +695,43 @@ class StockManager:
             traceback.print_exc()
             return False
     
+    def request_sync(self):
+        """記帳異動後排入背景同步，回傳附加在回覆後的儲存狀態"""
+        if not self.sheets_enabled:
+            return "\n💾 已儲存到本機帳本" if self.ledger is not None else "\n💾 已儲存到記憶體"
+        self.sync_queue.mark_dirty()
+        return "\n☁️ 已儲存，稍後同步到 Google Sheets"
+    
+    def get_sync_status(self):
+        """查詢 Google Sheets 同步狀態"""
+        if not self.sheets_enabled:
+            if self.ledger is not None:
+                return "💾 未連接 Google Sheets，資料保存在本機帳本"
+            return "💾 目前為記憶體模式，未連接 Google Sheets"
+        
+        stats = self.sync_queue.stats()
+        result = "☁️ Google Sheets 同步狀態：\n\n"
+        if not self.sheets_loaded:
+            result += "⚠️ 尚未從 Google Sheets 載入帳本，暫停記帳與同步\n"
+        if stats['pending']:
+            result += f"⏳ 待同步異動：{stats['pending']} 筆（最早 {stats['oldest_pending_seconds']} 秒前）\n"
+        else:
+            result += "✅ 所有異動都已同步\n"
+        if self.remote_modified_time:
+            result += f"🔎 試算表最後修改：{self.remote_modified_time}\n"
+        if stats['last_flush_time']:
+            last_flush = datetime.fromtimestamp(stats['last_flush_time'], TAIWAN_TZ).strftime('%m/%d %H:%M:%S')
+            result += f"🕒 上次同步：{last_flush}（耗時 {stats['last_flush_seconds']:.2f} 秒）\n"
+        result += f"📊 累計異動 {stats['mutations']} 筆，寫入 {stats['flushes']} 次（合併 {stats['coalesced']} 筆）"
+        if self.ledger is not None:
+            ledger_stats = self.ledger.stats()
+            result += f"\n📒 本機帳本：{ledger_stats['accounts']} 個帳戶、{ledger_stats['transactions']} 筆交易"
+            if ledger_stats['replication_lag']:
+                result += f"（Google Sheets 落後 {ledger_stats['replication_lag']} 個版本）"
+        if stats['failures']:
+            result += f"\n❌ 連續失敗 {stats['failures']} 次，{stats['retry_in']} 秒後重試\n💬 {stats['last_error']}"
+        return result
+    
     def get_taiwan_time(self):
         """獲取台灣時間"""
         return datetime.now(TAIWAN_TZ).strftime('%Y/%m/%d %H:%M:%S')
@@ -364,60 +748,15 @@ class StockManager:
         return False
     
     def get_stock_price(self, stock_code):
-        """查詢股票即時價格 - 改進版"""
-        
-        # 修正問題股票代號
-        if stock_code == '915':
-            stock_code = '00915.TW'
-        elif stock_code == '929':
-            stock_code = '00929.TW'
-        elif stock_code == '3078':
-            stock_code = '3078.TWO'
-        elif stock_code == '3374':
-            stock_code = '3374.TWO'
-        elif stock_code == '5483':
-            stock_code = '5483.TWO'
-        elif stock_code == '4541':
-            stock_code = '4541.TWO'
+        """查詢股票即時價格 - 改進版（讀取全程序共用的最新報價，與技術分析、提醒共用）"""
         
         try:
-            import requests
-            import json
-            import time
+            from stock_prices import price_store
             
-            # 確保股票代號格式正確
-            if not stock_code.endswith('.TW') and not stock_code.endswith('.TWO'):
-                formatted_code = f"{stock_code}.TW"
-            else:
-                formatted_code = stock_code
-            
-            # 方法1: Yahoo Finance API
-            try:
-                url = f"https://query1.finance.yahoo.com/v8/finance/chart/{formatted_code}"
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                
-                response = requests.get(url, headers=headers, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                
-                if (data.get('chart') and 
-                    data['chart'].get('result') and 
-                    len(data['chart']['result']) > 0 and
-                    data['chart']['result'][0].get('meta')):
-                    
-                    meta = data['chart']['result'][0]['meta']
-                    price = meta.get('regularMarketPrice')
-                    
-                    if price and price > 0:
-                        print(f"✅ 取得 {stock_code} 股價: {price}")
-                        return round(float(price), 2)
-                
-            except requests.exceptions.RequestException as e:
-                print(f"⚠️ Yahoo Finance API 請求失敗: {e}")
-            except (KeyError, TypeError, ValueError) as e:
-                print(f"⚠️ Yahoo Finance 資料解析失敗: {e}")
+            price = price_store.get_price(stock_code)
+            if price and price > 0:
+                print(f"✅ 取得 {stock_code} 股價: {price}")
+                return round(float(price), 2)
             
             print(f"⚠️ {stock_code} 股價查詢失敗")
             return None
@@ -426,6 +765,25 @@ class StockManager:
             print(f"⚠️ 股價查詢發生未預期錯誤: {e}")
             return None
     
+    def get_stock_prices(self, stock_codes):
+        """批次查詢多檔股票即時價格 {代號: 價格}，所有代號一次送出（約一次網路來回）"""
+        try:
+            from stock_prices import price_store
+            from stock_symbols import normalize_code
+            
+            quotes = price_store.get_quotes(stock_codes)
+            prices = {}
+            for stock_code in stock_codes:
+                quote = quotes.get(normalize_code(stock_code))
+                if quote and quote['price'] > 0:
+                    prices[stock_code] = round(float(quote['price']), 2)
+            print(f"✅ 批次取得 {len(prices)}/{len(set(stock_codes))} 檔股價")
+            return prices
+            
+        except Exception as e:
+            print(f"⚠️ 批次股價查詢發生未預期錯誤: {e}")
+            return {}
+    
     def set_stock_code(self, stock_name, stock_code):
         """設定股票代號對應"""
         self.stock_data['stock_codes'][stock_name] = stock_code
@@ -465,6 +823,15 @@ class StockManager:
         has_price_data = False
         failed_stocks = []
         
+        # 先收集所有持股代號，一次批次查詢股價，再逐一計算損益
+        stock_codes = []
+        for account in accounts_to_check.values():
+            for stock_name, holding in account['stocks'].items():
+                stock_code = holding.get('stock_code') or self.stock_data['stock_codes'].get(stock_name)
+                if stock_code and stock_code not in stock_codes:
+                    stock_codes.append(stock_code)
+        prices = self.get_stock_prices(stock_codes) if stock_codes else {}
+        
         for acc_name, account in accounts_to_check.items():
             if not account['stocks']:
                 continue
@@ -481,8 +848,7 @@ class StockManager:
                 stock_code = holding.get('stock_code') or self.stock_data['stock_codes'].get(stock_name)
                 
                 if stock_code:
-                    print(f"🔍 正在查詢 {stock_name} ({stock_code}) 的股價...")
-                    current_price = self.get_stock_price(stock_code)
+                    current_price = prices.get(stock_code)
                     
                     if current_price:
                         current_value = holding['quantity'] * current_price
@@ -534,7 +900,7 @@ class StockManager:
         result += "💡 提示：\n"
         result += "• 新交易請使用格式：爸爸買 台積電 2330 1張 600000 0820\n"
         result += "• 零股交易：爸爸買 台積電 500 300000 0820\n"
-        result += "• 股價資料來源：Yahoo Finance\n"
+        result += "• 股價資料來源：TWSE / Yahoo Finance\n"
         result += "• 交易時間：週一至週五 09:00-13:30\n"
         result += "• 如持續無法取得股價，請檢查股票代號是否正確"
         
@@ -664,7 +1030,7 @@ class StockManager:
             'cash_after': self.stock_data['accounts'][account_name]['cash'],
             'created_at': self.get_taiwan_time()
         }
-        self.stock_data['transactions'].append(transaction)
+        self.add_transaction(transaction)
         
         # 格式化數量顯示
         if quantity >= 1000 and quantity % 1000 == 0:
@@ -684,14 +1050,7 @@ class StockManager:
         result_msg += f"💰 總成本：{total_cost:,}元\n"
         result_msg += f"💵 平均成本：{avg_cost}元/股"
         
-        if self.sheets_enabled:
-            sync_success = self.sync_to_sheets_safe()
-            if sync_success:
-                result_msg += "\n☁️ 已同步到 Google Sheets"
-            else:
-                result_msg += "\n❌ Google Sheets 同步失敗"
-        else:
-            result_msg += "\n💾 已儲存到記憶體"
+        result_msg += self.request_sync()
         
         return result_msg
     
@@ -712,7 +1071,7 @@ class StockManager:
             'cash_after': self.stock_data['accounts'][account_name]['cash'],
             'created_at': self.get_taiwan_time()
         }
-        self.stock_data['transactions'].append(transaction)
+        self.add_transaction(transaction)
         
         result_msg = f"💰 {account_name} 入帳成功！\n"
         if is_new:
@@ -720,14 +1079,7 @@ class StockManager:
         result_msg += f"💵 入帳金額：{amount:,}元\n"
         result_msg += f"💳 帳戶餘額：{self.stock_data['accounts'][account_name]['cash']:,}元"
         
-        if self.sheets_enabled:
-            sync_success = self.sync_to_sheets_safe()
-            if sync_success:
-                result_msg += "\n☁️ 已同步到 Google Sheets"
-            else:
-                result_msg += "\n❌ Google Sheets 同步失敗"
-        else:
-            result_msg += "\n💾 已儲存到記憶體"
+        result_msg += self.request_sync()
         
         return result_msg
     
@@ -754,18 +1106,11 @@ class StockManager:
             'cash_after': account['cash'],
             'created_at': self.get_taiwan_time()
         }
-        self.stock_data['transactions'].append(transaction)
+        self.add_transaction(transaction)
         
         result_msg = f"💸 {account_name} 提款成功！\n💵 提款金額：{amount:,}元\n💳 帳戶餘額：{account['cash']:,}元"
         
-        if self.sheets_enabled:
-            sync_success = self.sync_to_sheets_safe()
-            if sync_success:
-                result_msg += "\n☁️ 已同步到 Google Sheets"
-            else:
-                result_msg += "\n❌ Google Sheets 同步失敗"
-        else:
-            result_msg += "\n💾 已儲存到記憶體"
+        result_msg += self.request_sync()
         
         return result_msg
     
@@ -816,7 +1161,7 @@ class StockManager:
             'cash_after': account['cash'],
             'created_at': self.get_taiwan_time()
         }
-        self.stock_data['transactions'].append(transaction)
+        self.add_transaction(transaction)
         
         # 格式化數量顯示
         if quantity >= 1000 and quantity % 1000 == 0:
@@ -843,14 +1188,7 @@ class StockManager:
         
         result_msg = f"📈 {account_name} 買入成功！\n\n🏷️ {stock_name} ({stock_code})\n📊 買入：{quantity_display} @ {price_per_share}元\n💰 實付：{amount:,}元\n📅 日期：{date}\n\n📋 持股狀況：\n📊 總持股：{total_display}\n💵 平均成本：{stock_info['avg_cost']}元/股\n💳 剩餘現金：{account['cash']:,}元"
         
-        if self.sheets_enabled:
-            sync_success = self.sync_to_sheets_safe()
-            if sync_success:
-                result_msg += "\n☁️ 已同步到 Google Sheets"
-            else:
-                result_msg += "\n❌ Google Sheets 同步失敗"
-        else:
-            result_msg += "\n💾 已儲存到記憶體"
+        result_msg += self.request_sync()
         
         return result_msg
     
@@ -921,7 +1259,7 @@ class StockManager:
             'created_at': self.get_taiwan_time(),
             'profit_loss': profit_loss
         }
-        self.stock_data['transactions'].append(transaction)
+        self.add_transaction(transaction)
         
         # 格式化賣出數量顯示
         if quantity >= 1000 and quantity % 1000 == 0:
@@ -937,14 +1275,7 @@ class StockManager:
         
         result = f"📉 {account_name} 賣出成功！\n\n🏷️ {stock_name} ({stock_code})\n📊 賣出：{quantity_display} @ {price_per_share}元\n💰 實收：{amount:,}元\n📅 日期：{date}\n\n💹 本次交易：\n💵 成本：{sell_cost:,}元\n{profit_text}\n💳 現金餘額：{account['cash']:,}元"
         
-        if self.sheets_enabled:
-            sync_success = self.sync_to_sheets_safe()
-            if sync_success:
-                result += "\n☁️ 已同步到 Google Sheets"
-            else:
-                result += "\n❌ Google Sheets 同步失敗"
-        else:
-            result += "\n💾 已儲存到記憶體"
+        result += self.request_sync()
         
         if remaining_quantity > 0:
             # 格式化剩餘持股顯示
@@ -969,14 +1300,7 @@ class StockManager:
         if is_new:
             result_msg = f"🆕 已建立帳戶「{account_name}」\n💡 可以開始入帳和交易了！"
             
-            if self.sheets_enabled:
-                sync_success = self.sync_to_sheets_safe()
-                if sync_success:
-                    result_msg += "\n☁️ 已同步到 Google Sheets"
-                else:
-                    result_msg += "\n❌ Google Sheets 同步失敗"
-            else:
-                result_msg += "\n💾 已儲存到記憶體"
+            result_msg += self.request_sync()
             
             return result_msg
         else:
@@ -1097,19 +1421,17 @@ class StockManager:
     
     def get_transaction_history(self, account_name=None, limit=10):
         """獲取交易記錄"""
-        transactions = self.stock_data['transactions']
-        
         if account_name:
-            transactions = [t for t in transactions if t['account'] == account_name]
-            if not transactions:
+            if not self.transaction_index.has_account(account_name):
                 return f"📝 {account_name} 沒有交易記錄"
             title = f"📋 {account_name} 交易記錄 (最近{limit}筆)：\n\n"
         else:
-            if not transactions:
+            if not self.stock_data['transactions']:
                 return "📝 目前沒有任何交易記錄"
             title = f"📋 所有交易記錄 (最近{limit}筆)：\n\n"
         
-        recent_transactions = sorted(transactions, key=lambda x: x['created_at'], reverse=True)[:limit]
+        # 索引已依建立時間排序，只取最近 limit 筆
+        recent_transactions = self.transaction_index.recent(limit, account_name)
         
         result = title
         for i, t in enumerate(recent_transactions, 1):
@@ -1173,10 +1495,7 @@ class StockManager:
         else:
             quantity_display = f"{quantity}股"
         
-        related_transactions = [
-            t for t in self.stock_data['transactions'] 
-            if t['account'] == account_name and t.get('stock_code') == stock_name
-        ]
+        related_transactions = self.transaction_index.for_stock(account_name, stock_name)
         
         result = f"📊 {account_name} - {stock_name}{code_display} 成本分析：\n\n"
         result += f"📈 目前持股：{quantity_display}\n"
@@ -1226,6 +1545,16 @@ class StockManager:
             return "📝 目前沒有任何帳戶"
     
     def handle_command(self, message_text):
+        """處理股票指令（記帳異動與背景同步互斥，回覆前先寫入本機帳本）"""
+        with self.lock:
+            if not self.ensure_sheets_loaded():
+                return "❌ 尚未從 Google Sheets 載入帳本，暫時無法記帳\n💡 請稍後再試"
+            result = self.dispatch_command(message_text)
+            if not self.persist_ledger():
+                result += "\n⚠️ 本機帳本寫入失敗，請稍後再確認"
+            return result
+    
+    def dispatch_command(self, message_text):
         """處理股票指令的主要函數"""
         parsed = self.parse_command(message_text)
         
@@ -1333,6 +1662,7 @@ class StockManager:
 - 交易記錄 爸爸 - 個人交易記錄
 - 成本查詢 爸爸 台積電 - 持股成本分析
 - 帳戶列表 - 查看所有帳戶
+- 同步狀態 - 查看 Google Sheets 同步狀態
 
 💹 即時損益功能：
 - 即時損益 - 查看所有帳戶即時損益
@@ -1410,6 +1740,16 @@ def get_stock_realtime_pnl(account_name=None):
     return stock_manager.get_realtime_pnl(account_name)
 
 
+def get_stock_sync_status():
+    """獲取 Google Sheets 同步狀態 - 對外接口"""
+    return stock_manager.get_sync_status()
+
+
+def flush_stock_sync():
+    """立即寫入尚未同步的記帳異動 - 對外接口"""
+    return stock_manager.sync_queue.flush()
+
+
 def get_stock_help():
     """獲取股票幫助 - 對外接口"""
     return stock_manager.get_help_text()
@@ -1428,7 +1768,7 @@ def is_stock_query(message_text):
     stock_specific_patterns = [
         '總覽', '帳戶列表', '股票幫助', '交易記錄', '成本查詢',
         '即時損益', '股價查詢', '股價', '檢查代號', '批量設定代號',
-        '估價查詢', '即時股價查詢'
+        '估價查詢', '即時股價查詢', '同步狀態'
     ]
     
     # 檢查是否包含明確的股票相關關鍵字
@@ -1465,8 +1805,58 @@ def is_stock_query(message_text):
     return False
 
 
+def benchmark_sheet_load(sizes=(1000, 10000, 100000), accounts=4, holdings_per_account=10):
+    """冷啟動載入效能測試：解析 N 筆交易記錄所需時間（不含網路，網路固定為一次 batchGet）"""
+    import time
+    from gspread.utils import numericise_all
+    
+    account_values = [StockManager.ACCOUNT_HEADER] + [
+        [f"帳戶{a}", 100000 + a, '2024/01/01 09:00:00'] for a in range(accounts)
+    ]
+    holding_values = [StockManager.HOLDING_HEADER] + [
+        [f"帳戶{a}", f"股票{h}", str(2300 + h), 1000, 55.5, 55500]
+        for a in range(accounts) for h in range(holdings_per_account)
+    ]
+    
+    print("📊 冷啟動載入效能測試（解析時間，不含網路）")
+    for size in sizes:
+        transaction_values = [StockManager.TRANSACTION_HEADER] + [
+            [i + 1, '買入', f"帳戶{i % accounts}", f"股票{i % holdings_per_account}", 1000,
+             55500, 55.5, '2024/08/20', 100000, '2024/08/20 10:00:00', '']
+            for i in range(size)
+        ]
+        
+        started = time.perf_counter()
+        stock_data, _, _ = parse_ledger_values(account_values, holding_values, transaction_values)
+        parse_seconds = time.perf_counter() - started
+        
+        # 舊流程：get_all_records 逐列 numericise 後建立 dict，再逐欄轉型
+        formatted = [[str(v) for v in row] for row in transaction_values]
+        started = time.perf_counter()
+        keys = formatted[0]
+        records = [dict(zip(keys, numericise_all(row))) for row in formatted[1:]]
+        legacy = [{
+            'id': int(row['交易ID']),
+            'quantity': int(row.get('數量', 0)),
+            'amount': int(row.get('金額', 0)),
+            'price_per_share': float(row.get('單價', 0)) if row.get('單價') else 0,
+            'cash_after': int(row.get('現金餘額', 0)),
+            'profit_loss': float(row.get('損益', 0)) if row.get('損益') else None
+        } for row in records]
+        legacy_seconds = time.perf_counter() - started
+        
+        assert len(stock_data['transactions']) == len(legacy) == size
+        print(f"  {size:>7,} 筆交易：{parse_seconds * 1000:8.1f} ms"
+              f"（舊流程 {legacy_seconds * 1000:8.1f} ms，API 請求 1 次，舊流程 6 次）")
+
+
 if __name__ == "__main__":
-    sm = StockManager()
+    import sys
+    if '--bench' in sys.argv:
+        benchmark_sheet_load()
+        sys.exit(0)
+    
+    sm = StockManager(ledger=None)
     print("=== 測試持有（新格式）===")
     print(sm.handle_command("爸爸持有 台積電 2330 1張 600000"))
     print()
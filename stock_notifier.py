@@ -8,6 +8,9 @@ from datetime import datetime
 from pymongo import MongoClient
 from utils.line_api import send_push_message
 from stock_analyzer import stock_analyzer
+from stock_symbols import normalize_code
+from stock_prices import price_store
+from utils.trading_calendar import trading_calendar
 
 class StockNotifier:
     """股票提醒管理器"""
@@ -102,14 +105,22 @@ class StockNotifier:
     
     def check_price_alerts(self):
         """檢查所有價格提醒"""
+        # 休市時股價不會變動，不必檢查
+        if not trading_calendar.is_market_open():
+            return
+        
         try:
             alerts = self._get_active_alerts()
+            if not alerts:
+                return
+            
+            # 一次批次取得所有提醒股票的即時報價（共用最新報價，來源層已處理 TWSE / Yahoo 備援）
+            quotes = price_store.get_quotes([a['stock_code'] for a in alerts])
             
             for alert in alerts:
                 try:
-                    # 取得即時股價
-                    from stock_manager import stock_manager
-                    current_price = stock_manager.get_stock_price(alert['stock_code'])
+                    quote = quotes.get(normalize_code(alert['stock_code']))
+                    current_price = quote['price'] if quote else None
                     
                     if not current_price:
                         continue
@@ -199,6 +210,10 @@ class StockNotifier:
             print(f"刪除提醒失敗: {e}")
             return "❌ 刪除提醒失敗"
     
+    def get_alert_symbols(self):
+        """取得所有啟用中提醒的股票 {代號: 名稱}"""
+        return {a['stock_code']: a.get('stock_name') or a['stock_code'] for a in self._get_active_alerts()}
+    
     def _get_active_alerts(self):
         """取得所有啟用的提醒"""
         if self.use_mongodb:
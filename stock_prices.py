@@ -0,0 +1,70 @@
+"""
+stock_prices.py - 全程序共用的最新報價
+記帳（即時損益）、價格提醒、技術分析與盤中收集器都從這裡讀取報價，
+快取依交易時段決定存活時間（盤中10秒，休市保留到下次開盤），
+同一檔代號同時查詢只向資料來源層送出一次請求（重疊的批次也會合併）。
+"""
+from stock_providers import market_data
+from stock_symbols import normalize_code
+from utils.singleflight import SingleFlight
+from utils.trading_calendar import trading_calendar
+from utils.ttl_cache import TTLCache
+
+QUOTE_TTL = 10  # 盤中報價存活秒數
+
+
+class LastPriceStore:
+    """最新報價快取（執行緒安全）"""
+
+    def __init__(self, open_ttl=QUOTE_TTL, max_entries=2000):
+        self.open_ttl = open_ttl
+        self.cache = TTLCache('last_prices', max_entries=max_entries, default_ttl=open_ttl)
+        self.inflight = SingleFlight('last_prices')
+
+    def get_quotes(self, stock_codes):
+        """批次取得報價 {代號: 報價}，快取中沒有的代號一次向資料來源查詢"""
+        quotes = {}
+        codes = []
+        for stock_code in stock_codes:
+            code = normalize_code(stock_code)
+            if not code or code in codes or code in quotes:
+                continue
+            cached = self.cache.get(code)
+            if cached is not None:
+                quotes[code] = cached
+            else:
+                codes.append(code)
+
+        if codes:
+            # 逐檔合併：已在其他請求中查詢的代號等待共用結果，其餘代號一次查詢
+            quotes.update(self.inflight.do_many(codes, self._fetch))
+        return quotes
+
+    def get_quote(self, stock_code):
+        """取得單一股票報價（查不到回傳 None）"""
+        code = normalize_code(stock_code)
+        return self.get_quotes([code]).get(code)
+
+    def get_price(self, stock_code):
+        """取得單一股票最新價格（查不到回傳 None）"""
+        quote = self.get_quote(stock_code)
+        return quote['price'] if quote else None
+
+    def _fetch(self, codes):
+        quotes = market_data.quotes(codes)
+        self.update(quotes)
+        return quotes
+
+    def update(self, quotes):
+        """寫入報價（其他管道取得的報價也可以回填）"""
+        ttl = trading_calendar.ttl(self.open_ttl)
+        for code, quote in quotes.items():
+            self.cache.set(normalize_code(code), quote, ttl=ttl)
+
+    def stats(self):
+        """快取與請求合併統計"""
+        return {'cache': self.cache.stats(), 'inflight': self.inflight.stats()}
+
+
+# 建立全域實例
+price_store = LastPriceStore()
@@ -0,0 +1,356 @@
+"""
+stock_providers.py - 行情資料來源層
+把 TWSE 即時報價、Yahoo chart API 與 yfinance 包成統一介面，
+記錄每個來源的延遲（EWMA）與錯誤率，連續失敗或被限流（HTTP 429）時斷路一段時間，
+每次請求依健康狀態選最快的來源，失敗或缺漏的代號再交給下一個來源。
+"""
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+import pytz
+import yfinance as yf
+from stock_bar_store import period_start
+from stock_symbols import symbol_directory, normalize_code
+from utils.http_client import quote_http
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+
+
+class ProviderError(Exception):
+    """資料來源請求失敗（rate_limited 表示被限流，直接斷路）"""
+
+    def __init__(self, message, rate_limited=False):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+
+
+def _status_code(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _is_rate_limited(error):
+    if type(error).__name__ == 'YFRateLimitError':
+        return True
+    return _status_code(error) == 429
+
+
+class ProviderHealth:
+    """資料來源健康狀態：EWMA 延遲、錯誤率與斷路器"""
+
+    ERROR_HALF_LIFE = 300
+
+    def __init__(self, name, latency_hint=1.0, alpha=0.2, failure_threshold=3,
+                 cooldown=30, max_cooldown=600):
+        self.name = name
+        self.latency = None
+        self.latency_hint = latency_hint  # 還沒有量測資料時的預估延遲（秒）
+        self.error_rate = 0.0
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.last_failure_at = 0.0
+        self.successes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def available(self):
+        """斷路中回傳 False；冷卻時間過後允許試探（half-open）"""
+        return time.monotonic() >= self.open_until
+
+    def current_error_rate(self):
+        """錯誤率隨時間衰減（半衰期 ERROR_HALF_LIFE 秒），讓恢復的來源重新被選用"""
+        elapsed = time.monotonic() - self.last_failure_at
+        return self.error_rate * 0.5 ** (elapsed / self.ERROR_HALF_LIFE)
+
+    def score(self):
+        """越小越優先：延遲依錯誤率加權"""
+        latency = self.latency if self.latency is not None else self.latency_hint
+        return latency * (1 + 4 * self.current_error_rate())
+
+    def record_success(self, latency):
+        with self._lock:
+            self.successes += 1
+            self.latency = latency if self.latency is None else (
+                self.alpha * latency + (1 - self.alpha) * self.latency
+            )
+            self.error_rate = self.current_error_rate() * (1 - self.alpha)
+            self.last_failure_at = time.monotonic()
+            self.consecutive_failures = 0
+            self.cooldown = self.base_cooldown
+            self.open_until = 0.0
+
+    def record_failure(self, rate_limited=False):
+        with self._lock:
+            self.failures += 1
+            self.error_rate = self.alpha + (1 - self.alpha) * self.current_error_rate()
+            self.last_failure_at = time.monotonic()
+            self.consecutive_failures += 1
+            if rate_limited or self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                print(f"⛔ {self.name} 暫停使用 {self.cooldown} 秒（{'限流' if rate_limited else '連續失敗'}）")
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'error_rate': round(self.current_error_rate(), 3),
+            'successes': self.successes,
+            'failures': self.failures,
+            'circuit_open': not self.available(),
+            'open_seconds': max(0, round(self.open_until - time.monotonic()))
+        }
+
+
+class TwseProvider:
+    """TWSE mis 即時報價（以 | 串接多個 ex_ch 批次查詢）"""
+
+    name = 'twse'
+    supports_quotes = True
+    supports_history = False
+    latency_hint = 0.3
+
+    QUOTE_URL = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+    BATCH_SIZE = 50   # 每次請求最多查詢的 ex_ch 頻道數
+    DEADLINE = 5      # 整批報價最多等待秒數
+
+    @staticmethod
+    def parse_quote(stock):
+        """解析 TWSE msgArray 單筆報價"""
+        price = stock.get('z', '')  # 最新成交價
+        if not price or price == '-':
+            return None
+
+        price = float(price)
+        prev_close = float(stock.get('y') or 0)  # 昨收
+        change = price - prev_close if prev_close else 0.0
+        return {
+            'price': price,
+            'change': round(change, 2),  # 漲跌
+            'change_pct': round(change / prev_close * 100, 2) if prev_close else 0.0,  # 漲跌幅
+            'volume': int(stock.get('v') or 0),  # 累積成交量（張）
+            'time': stock.get('t', ''),  # 時間
+            'market': stock.get('ex', ''),  # tse / otc
+            'source': 'TWSE_realtime'
+        }
+
+    def get_quotes(self, codes):
+        channels = []
+        for code in codes:
+            channels.extend(symbol_directory.twse_channels(code))
+
+        batch_requests = [
+            {
+                'url': self.QUOTE_URL,
+                'params': {
+                    'ex_ch': '|'.join(channels[i:i + self.BATCH_SIZE]),
+                    'json': '1',
+                    'delay': '0'
+                }
+            }
+            for i in range(0, len(channels), self.BATCH_SIZE)
+        ]
+        responses = quote_http.get_many(batch_requests, deadline=self.DEADLINE, return_exceptions=True)
+        errors = [r for r in responses if isinstance(r, Exception)]
+        if responses and len(errors) == len(responses):
+            raise ProviderError(f"TWSE 報價失敗: {errors[0]}", any(_is_rate_limited(e) for e in errors))
+
+        quotes = {}
+        for data in responses:
+            if isinstance(data, Exception) or not data:
+                continue
+            for stock in data.get('msgArray') or []:
+                try:
+                    quote = self.parse_quote(stock)
+                except (TypeError, ValueError):
+                    continue
+                if quote and stock.get('c'):
+                    symbol_directory.learn(stock['c'], stock.get('ex'), stock.get('n'))
+                    quotes[stock['c']] = quote
+        return quotes
+
+
+class YahooChartProvider:
+    """Yahoo Finance chart API（報價與日K）"""
+
+    name = 'yahoo_chart'
+    supports_quotes = True
+    supports_history = True
+    latency_hint = 0.8
+
+    CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+    DEADLINE = 6
+
+    def _fetch(self, symbols, params=None):
+        requests_list = [{'url': self.CHART_URL.format(symbol=s), 'params': params} for s in symbols]
+        responses = quote_http.get_many(requests_list, deadline=self.DEADLINE, return_exceptions=True)
+        # 404 表示代號不存在（例如上櫃股票查 .TW），不算來源失敗
+        responses = [None if _status_code(r) == 404 else r for r in responses]
+        errors = [r for r in responses if isinstance(r, Exception)]
+        if responses and len(errors) == len(responses):
+            raise ProviderError(f"Yahoo chart 請求失敗: {errors[0]}", any(_is_rate_limited(e) for e in errors))
+        if any(_is_rate_limited(e) for e in errors):
+            raise ProviderError("Yahoo chart 限流 (429)", rate_limited=True)
+        return responses
+
+    @staticmethod
+    def _result(data):
+        if isinstance(data, Exception) or not data:
+            return None
+        results = (data.get('chart') or {}).get('result') or []
+        return results[0] if results else None
+
+    def get_quotes(self, codes):
+        quotes = {}
+        # 依代號目錄決定上市/上櫃後綴；未知代號上市查不到時再試一次上櫃
+        pending = {symbol_directory.yahoo_symbol(code): normalize_code(code) for code in codes}
+        for attempt in range(2):
+            if not pending:
+                break
+            retry = {}
+            for symbol, data in zip(pending, self._fetch(list(pending))):
+                code = pending[symbol]
+                meta = (self._result(data) or {}).get('meta') or {}
+                price = meta.get('regularMarketPrice')
+                if price and price > 0:
+                    prev_close = meta.get('chartPreviousClose') or meta.get('previousClose') or 0
+                    change = price - prev_close if prev_close else 0.0
+                    market_time = meta.get('regularMarketTime')
+                    quotes[code] = {
+                        'price': round(float(price), 2),
+                        'change': round(change, 2),
+                        'change_pct': round(change / prev_close * 100, 2) if prev_close else 0.0,
+                        'volume': int((meta.get('regularMarketVolume') or 0) / 1000),  # 股 -> 張
+                        'time': datetime.fromtimestamp(market_time, TAIWAN_TZ).strftime('%H:%M:%S') if market_time else '',
+                        'market': 'otc' if symbol.endswith('.TWO') else 'tse',
+                        'source': 'Yahoo_chart'
+                    }
+                    symbol_directory.learn(code, quotes[code]['market'])
+                elif attempt == 0 and symbol.endswith('.TW') and not symbol_directory.resolve(code):
+                    retry[f"{symbol[:-3]}.TWO"] = code
+            pending = retry
+        return quotes
+
+    def get_history(self, symbol, period=None, start=None):
+        # 一律以 period1/period2 指定起訖：range=max 會被 Yahoo 自動降為月K
+        if start is None:
+            start = period_start(period or 'max')
+        params = {
+            'period1': int(pd.Timestamp(start).tz_localize(TAIWAN_TZ).timestamp()) if start is not None else 0,
+            'period2': int(time.time()) + 86400,
+            'interval': '1d'
+        }
+
+        result = self._result(self._fetch([symbol], params)[0])
+        if not result:
+            raise ProviderError(f"Yahoo chart 沒有 {symbol} 的日K")
+
+        timestamps = result.get('timestamp') or []
+        quote = ((result.get('indicators') or {}).get('quote') or [{}])[0]
+        index = pd.to_datetime(timestamps, unit='s', utc=True).tz_convert(TAIWAN_TZ).normalize()
+        df = pd.DataFrame({
+            'Open': quote.get('open', []),
+            'High': quote.get('high', []),
+            'Low': quote.get('low', []),
+            'Close': quote.get('close', []),
+            'Volume': quote.get('volume', [])
+        }, index=pd.DatetimeIndex(index, name='Date'), dtype=float)
+        # 與 yfinance history 預設的 auto_adjust 相同：開高低收依還原權值調整
+        adjclose = (((result.get('indicators') or {}).get('adjclose') or [{}])[0]).get('adjclose')
+        if adjclose and len(adjclose) == len(df):
+            ratio = pd.Series(adjclose, index=df.index, dtype=float) / df['Close']
+            df[['Open', 'High', 'Low', 'Close']] = df[['Open', 'High', 'Low', 'Close']].mul(ratio, axis=0)
+        df = df.dropna(subset=['Close'])
+        return df[~df.index.duplicated(keep='last')]
+
+
+class YFinanceProvider:
+    """yfinance 日K"""
+
+    name = 'yfinance'
+    supports_quotes = False
+    supports_history = True
+    latency_hint = 1.5
+
+    def get_history(self, symbol, period=None, start=None):
+        ticker = yf.Ticker(symbol)
+        if start is not None:
+            return ticker.history(start=start)
+        return ticker.history(period=period or 'max')
+
+
+class MarketDataRouter:
+    """依延遲與健康狀態選擇資料來源，失敗時自動換下一個"""
+
+    def __init__(self, providers):
+        self.providers = providers
+        self.health = {p.name: ProviderHealth(p.name, p.latency_hint) for p in providers}
+
+    def _candidates(self, capability):
+        candidates = [
+            p for p in self.providers
+            if getattr(p, capability) and self.health[p.name].available()
+        ]
+        return sorted(candidates, key=lambda p: self.health[p.name].score())
+
+    def _call(self, provider, fn, *args, **kwargs):
+        health = self.health[provider.name]
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except ProviderError as e:
+            health.record_failure(rate_limited=e.rate_limited)
+            raise
+        except Exception as e:
+            # 各來源的例外型別不同（requests、yfinance 自訂例外、解析錯誤），統一視為來源失敗
+            health.record_failure(rate_limited=_is_rate_limited(e))
+            raise ProviderError(str(e), _is_rate_limited(e)) from e
+        health.record_success(time.perf_counter() - start)
+        return result
+
+    def quotes(self, codes):
+        """批次即時報價 {代號: 報價}，缺漏的代號交給下一個來源"""
+        remaining = [normalize_code(c) for c in codes]
+        quotes = {}
+        for provider in self._candidates('supports_quotes'):
+            if not remaining:
+                break
+            try:
+                quotes.update(self._call(provider, provider.get_quotes, remaining))
+            except ProviderError as e:
+                print(f"⚠️ {provider.name} 報價失敗，改用下一個來源: {e}")
+                continue
+            remaining = [c for c in remaining if c not in quotes]
+        return quotes
+
+    def history(self, symbol, period=None, start=None):
+        """日K（欄位與 yfinance history 相同）；全部來源失敗時丟出 ProviderError"""
+        last_error = None
+        empty = None
+        for provider in self._candidates('supports_history'):
+            try:
+                df = self._call(provider, provider.get_history, symbol, period=period, start=start)
+            except ProviderError as e:
+                print(f"⚠️ {provider.name} 日K失敗，改用下一個來源: {e}")
+                last_error = e
+                continue
+            if df is not None and not df.empty:
+                return df
+            empty = df
+        if empty is not None:
+            return empty
+        raise last_error or ProviderError(f"沒有可用的日K資料來源: {symbol}")
+
+    def stats(self):
+        """各資料來源健康狀態"""
+        return [self.health[p.name].stats() for p in self.providers]
+
+
+# 建立全域實例
+market_data = MarketDataRouter([TwseProvider(), YahooChartProvider(), YFinanceProvider()])
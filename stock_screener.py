@@ -0,0 +1,131 @@
+"""
+stock_screener.py - 持股/提醒股票掃描
+以有上限的執行緒池同時對所有持股與提醒股票做快速分析，
+先一次批次取得即時報價讓各檔共用，
+回傳最接近支撐或壓力的排行，控制在一次 LINE 回覆的時間內。
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from stock_analyzer import stock_analyzer, quick_analyze_stock
+
+MAX_WORKERS = 8
+SCAN_DEADLINE = 20  # 秒，LINE reply token 有效時間內完成
+NEAR_PERCENT = 3    # 距離支撐/壓力 3% 內視為接近
+
+
+def collect_watchlist():
+    """收集所有持股與啟用中提醒的股票，回傳 {代號: 名稱}"""
+    watchlist = {}
+
+    try:
+        from stock_manager import stock_manager
+        for account in stock_manager.stock_data['accounts'].values():
+            for stock_name, holding in account['stocks'].items():
+                stock_code = holding.get('stock_code') or stock_manager.stock_data['stock_codes'].get(stock_name)
+                if stock_code:
+                    watchlist.setdefault(str(stock_code), stock_name)
+    except Exception as e:
+        print(f"⚠️ 讀取持股清單失敗: {e}")
+
+    try:
+        from stock_notifier import stock_notifier
+        for stock_code, stock_name in stock_notifier.get_alert_symbols().items():
+            watchlist.setdefault(str(stock_code), stock_name)
+    except Exception as e:
+        print(f"⚠️ 讀取提醒清單失敗: {e}")
+
+    return watchlist
+
+
+def scan_stocks(watchlist, max_workers=MAX_WORKERS, deadline=SCAN_DEADLINE):
+    """平行快速分析，回傳依「距離支撐/壓力」排序的結果與逾時的股票"""
+    if not watchlist:
+        return [], []
+
+    # 先批次取得所有報價，quick_analysis 會直接讀取報價快取（休市時直接使用盤後快照）
+    stock_analyzer.get_realtime_prices(list(watchlist.keys()))
+
+    rows = []
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(watchlist)))
+    futures = {
+        executor.submit(quick_analyze_stock, code, name): (code, name)
+        for code, name in watchlist.items()
+    }
+    done, pending = wait(futures, timeout=deadline)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        code, name = futures[future]
+        try:
+            analysis = future.result()
+        except Exception as e:
+            print(f"掃描 {code} 失敗: {e}")
+            continue
+        if not analysis:
+            continue
+
+        price = analysis['current_price']
+        support_gap = (price - analysis['support']) / price * 100 if analysis['support'] else None
+        resistance_gap = (analysis['resistance'] - price) / price * 100 if analysis['resistance'] else None
+        gaps = [g for g in (support_gap, resistance_gap) if g is not None]
+
+        rows.append({
+            'code': code,
+            'name': name,
+            'price': price,
+            'support': analysis['support'],
+            'resistance': analysis['resistance'],
+            'support_gap': round(support_gap, 2) if support_gap is not None else None,
+            'resistance_gap': round(resistance_gap, 2) if resistance_gap is not None else None,
+            'nearest_gap': min(gaps) if gaps else float('inf')
+        })
+
+    rows.sort(key=lambda r: r['nearest_gap'])
+    timed_out = [futures[f] for f in pending]
+    return rows, timed_out
+
+
+def format_scan_report(rows, timed_out, elapsed, near_percent=NEAR_PERCENT):
+    """格式化掃描結果（LINE 訊息）"""
+    if not rows and not timed_out:
+        return "📝 目前沒有持股或提醒中的股票可以掃描"
+
+    near_support = [r for r in rows if r['support_gap'] is not None and r['support_gap'] <= near_percent]
+    near_resistance = [r for r in rows if r['resistance_gap'] is not None and r['resistance_gap'] <= near_percent]
+
+    text = f"🔍 持股/提醒掃描（{len(rows)} 檔，{elapsed:.1f} 秒）\n"
+
+    text += f"\n🟢 接近支撐（{near_percent}% 內）\n"
+    if near_support:
+        for r in sorted(near_support, key=lambda r: r['support_gap']):
+            text += f"• {r['name']} ({r['code']}) {r['price']}元 → 支撐 {r['support']}元 (-{r['support_gap']}%)\n"
+    else:
+        text += "暫無\n"
+
+    text += f"\n🔴 接近壓力（{near_percent}% 內）\n"
+    if near_resistance:
+        for r in sorted(near_resistance, key=lambda r: r['resistance_gap']):
+            text += f"• {r['name']} ({r['code']}) {r['price']}元 → 壓力 {r['resistance']}元 (+{r['resistance_gap']}%)\n"
+    else:
+        text += "暫無\n"
+
+    others = [r for r in rows if r not in near_support and r not in near_resistance]
+    if others:
+        text += "\n⚪ 其他\n"
+        for r in others:
+            support = f"{r['support']}" if r['support'] else '-'
+            resistance = f"{r['resistance']}" if r['resistance'] else '-'
+            text += f"• {r['name']} {r['price']}元（支撐 {support} / 壓力 {resistance}）\n"
+
+    if timed_out:
+        text += "\n⏱️ 逾時未完成：" + "、".join(name for _, name in timed_out) + "\n"
+
+    text += "\n💡 輸入「分析 股票名稱」查看完整技術分析"
+    return text
+
+
+def scan_watchlist():
+    """掃描所有持股與提醒股票 - 對外接口"""
+    start = time.perf_counter()
+    rows, timed_out = scan_stocks(collect_watchlist())
+    return format_scan_report(rows, timed_out, time.perf_counter() - start)
@@ -0,0 +1,183 @@
+"""
+stock_snapshots.py - 盤後分析快照
+收盤資料定稿後，在背景把記帳中所有股票與啟用中提醒的股票
+先跑完 analyze() 與 quick_analysis() 並存成快照，
+休市時間的「分析 XXXX」直接回傳快照，不必在 webhook 內重新下載與計算。
+"""
+import os
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytz
+from stock_symbols import normalize_code
+from utils.data_dir import get_data_path
+from utils.trading_calendar import trading_calendar
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+
+SNAPSHOT_WORKERS = 4
+RETRY_INTERVAL = 20 * 60  # 秒，快照失敗或仍過期時，最快每 20 分鐘重試一次
+
+
+def _json_default(value):
+    """numpy 數值轉成 JSON 可用的型別"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class AnalysisSnapshotStore:
+    """盤後分析快照（依最近一次收盤定稿時間判斷是否有效）"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('STOCK_SNAPSHOT_FILE') or get_data_path('stock_snapshots.json')
+        self._lock = threading.Lock()
+        self._running = False
+        self.last_attempt = None  # 上次開始產生快照的時間（time.time()）
+        self.session = None      # 快照對應的收盤定稿時間（ISO 字串）
+        self.snapshots = {}      # 代號 -> {'stock_name', 'analysis', 'quick', 'computed_at'}
+        self.load()
+
+    def load(self):
+        """讀取快照檔"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.session = data.get('session')
+            self.snapshots = data.get('snapshots', {})
+            print(f"🗂️ 已載入 {len(self.snapshots)} 檔盤後分析快照（{self.session}）")
+        except Exception as e:
+            print(f"⚠️ 讀取盤後分析快照失敗: {e}")
+
+    def _save(self):
+        """寫回快照檔（先寫暫存檔再取代，避免寫到一半損毀）"""
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'session': self.session, 'snapshots': self.snapshots},
+                          f, ensure_ascii=False, default=_json_default)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ 儲存盤後分析快照失敗: {e}")
+
+    def is_current(self):
+        """快照是否為最近一次收盤定稿後產生"""
+        return self.session == trading_calendar.last_settle().isoformat()
+
+    def get(self, stock_code, kind, stock_name=None):
+        """休市時取得快照（kind: 'analysis' / 'quick'），盤中或快照過期回傳 None"""
+        if trading_calendar.is_data_settling() or not self.is_current():
+            return None
+        snapshot = self.snapshots.get(normalize_code(stock_code))
+        if not snapshot or snapshot.get(kind) is None:
+            return None
+        if stock_name and snapshot.get('stock_name') and stock_name != snapshot['stock_name']:
+            return None
+        return snapshot
+
+    def collect_symbols(self):
+        """記帳中所有股票代號與啟用中提醒的股票，回傳 {代號: 名稱}"""
+        symbols = {}
+        try:
+            from stock_manager import stock_manager
+            for stock_name, stock_code in stock_manager.stock_data['stock_codes'].items():
+                if stock_code:
+                    symbols.setdefault(normalize_code(stock_code), stock_name)
+        except Exception as e:
+            print(f"⚠️ 讀取股票代號清單失敗: {e}")
+
+        try:
+            from stock_notifier import stock_notifier
+            for stock_code, stock_name in stock_notifier.get_alert_symbols().items():
+                symbols.setdefault(normalize_code(stock_code), stock_name)
+        except Exception as e:
+            print(f"⚠️ 讀取提醒清單失敗: {e}")
+
+        return symbols
+
+    def _compute(self, stock_code, stock_name):
+        from stock_analyzer import stock_analyzer
+        quick = stock_analyzer.quick_analysis(stock_code, stock_name)
+        if quick is None:
+            # 取不到資料時不存快照，避免休市期間一直回覆錯誤訊息
+            return None
+        return {
+            'stock_name': stock_name,
+            'analysis': stock_analyzer.analyze(stock_code, stock_name),
+            'quick': quick,
+            'computed_at': datetime.now(TAIWAN_TZ).strftime('%Y/%m/%d %H:%M')
+        }
+
+    def rebuild(self, max_workers=SNAPSHOT_WORKERS):
+        """重新計算所有股票的快照"""
+        session = trading_calendar.last_settle().isoformat()
+        symbols = self.collect_symbols()
+        start = time.perf_counter()
+        print(f"🗂️ 開始產生盤後分析快照：{len(symbols)} 檔")
+
+        snapshots = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._compute, code, name): code for code, name in symbols.items()}
+            for future, code in futures.items():
+                try:
+                    snapshot = future.result()
+                    if snapshot:
+                        snapshots[code] = snapshot
+                except Exception as e:
+                    print(f"⚠️ {code} 快照產生失敗: {e}")
+
+        if symbols and not snapshots:
+            # 全部失敗（多半是資料來源無法連線），保留舊快照，下次排程再試
+            print("⚠️ 盤後分析快照全部失敗，稍後重試")
+            return 0
+
+        with self._lock:
+            self.session = session
+            self.snapshots = snapshots
+            self._save()
+        print(f"✅ 盤後分析快照完成：{len(snapshots)} 檔，{time.perf_counter() - start:.1f} 秒")
+        return len(snapshots)
+
+    def run_if_due(self, now=None):
+        """收盤定稿後且快照尚未更新時，在背景執行緒產生快照（提醒迴圈每分鐘呼叫）
+
+        失敗或產生後仍過期時，距上次嘗試 RETRY_INTERVAL 內不再重試，
+        避免資料來源故障時每分鐘重跑整批分析。
+        """
+        if trading_calendar.is_data_settling() or self.is_current():
+            return False
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._running:
+                return False
+            if self.last_attempt is not None and now - self.last_attempt < RETRY_INTERVAL:
+                return False
+            self._running = True
+            self.last_attempt = now
+
+        def worker():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"❌ 盤後分析快照失敗: {e}")
+            finally:
+                self._running = False
+            if not self.is_current():
+                print(f"⏳ 盤後分析快照尚未更新，{RETRY_INTERVAL // 60} 分鐘後重試")
+
+        threading.Thread(target=worker, daemon=True, name='analysis-snapshot').start()
+        return True
+
+
+# 建立全域實例
+snapshot_store = AnalysisSnapshotStore()
+
+
+# 對外接口
+def run_nightly_snapshots():
+    """盤後快照排程 - 對外接口"""
+    return snapshot_store.run_if_due()
@@ -0,0 +1,186 @@
+"""
+stock_symbols.py - 股票代號目錄
+記錄每個代號的掛牌市場（上市 tse / 上櫃 otc）、Yahoo 代號後綴與名稱，
+從本地上市櫃清單載入，並從成功的報價中學習、跨重啟保存，
+讓報價請求不必再先猜上市、失敗再猜上櫃。
+"""
+import os
+import json
+import tempfile
+import threading
+from utils.data_dir import get_data_path
+
+MARKET_SUFFIX = {'tse': '.TW', 'otc': '.TWO'}
+
+# 隨程式附帶的上市櫃清單快照（以 python stock_symbols.py --refresh 更新）
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'twse_symbols.json')
+
+# 上市櫃清單來源：(市場, 網址, 代號欄位, 名稱欄位)
+LISTING_SOURCES = [
+    ('tse', 'https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL', 'Code', 'Name'),
+    ('otc', 'https://www.tpex.org.tw/openapi/v1/tpex_mainboard_daily_close_quotes',
+     'SecuritiesCompanyCode', 'CompanyName'),
+]
+
+# 已知需要特別處理的代號（原本寫死在 get_stock_price 的判斷）
+SEED_SYMBOLS = {
+    '00915': {'market': 'tse'},
+    '00929': {'market': 'tse'},
+    '3078': {'market': 'otc'},
+    '3374': {'market': 'otc'},
+    '5483': {'market': 'otc'},
+    '4541': {'market': 'otc'},
+}
+
+# 試算表會吃掉數字代號的前導 0（00915 -> 915）
+CODE_ALIASES = {
+    '915': '00915',
+    '929': '00929',
+}
+
+
+def normalize_code(stock_code):
+    """去掉 .TW / .TWO 後綴並還原被吃掉的前導 0"""
+    code = str(stock_code).strip().upper().replace('.TWO', '').replace('.TW', '')
+    return CODE_ALIASES.get(code, code)
+
+
+class SymbolDirectory:
+    """代號 -> (市場, Yahoo 後綴, 名稱) 目錄"""
+
+    def __init__(self, snapshot_path=None, learned_path=None):
+        self.snapshot_path = snapshot_path or os.getenv('STOCK_SYMBOLS_FILE') or SNAPSHOT_PATH
+        self.learned_path = learned_path or get_data_path('stock_symbols_learned.json')
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 依序寫檔，較舊的內容不會蓋掉較新的
+        self._symbols = {code: dict(info) for code, info in SEED_SYMBOLS.items()}
+        self._learned = {}
+
+        self._symbols.update(self._read_json(self.snapshot_path))
+        self._learned = self._read_json(self.learned_path)
+        self._symbols.update(self._learned)
+
+    @staticmethod
+    def _read_json(path):
+        """讀取 {代號: {'market': ..., 'name': ...}} 格式的清單"""
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {
+                str(code): {'market': info['market'], 'name': info.get('name')}
+                for code, info in data.items()
+                if info.get('market') in MARKET_SUFFIX
+            }
+        except Exception as e:
+            print(f"⚠️ 讀取股票代號清單失敗 {path}: {e}")
+            return {}
+
+    def resolve(self, stock_code):
+        """查詢代號，回傳 {'code', 'market', 'suffix', 'name'}；未知代號回傳 None"""
+        code = normalize_code(stock_code)
+        info = self._symbols.get(code)
+        if not info:
+            return None
+        return {
+            'code': code,
+            'market': info['market'],
+            'suffix': MARKET_SUFFIX[info['market']],
+            'name': info.get('name')
+        }
+
+    def yahoo_symbol(self, stock_code):
+        """Yahoo / yfinance 代號（明確帶後綴的輸入優先，未知代號預設上市 .TW）"""
+        raw = str(stock_code).strip().upper()
+        code = normalize_code(raw)
+        if raw.endswith('.TWO'):
+            return f"{code}.TWO"
+        if raw.endswith('.TW'):
+            return f"{code}.TW"
+        info = self.resolve(code)
+        if info:
+            return f"{code}{info['suffix']}"
+        return f"{code}.TW"
+
+    def twse_channels(self, stock_code):
+        """TWSE 即時報價頻道；未知市場時同時查詢上市與上櫃"""
+        code = normalize_code(stock_code)
+        info = self.resolve(code)
+        if info:
+            return [f"{info['market']}_{code}.tw"]
+        return [f"tse_{code}.tw", f"otc_{code}.tw"]
+
+    def learn(self, stock_code, market, name=None):
+        """從成功的報價記錄市場，有新資訊時寫回本地檔案"""
+        if market not in MARKET_SUFFIX:
+            return
+        code = normalize_code(stock_code)
+        entry = {'market': market, 'name': name}
+
+        with self._lock:
+            current = self._symbols.get(code)
+            if current and current['market'] == market and (not name or current.get('name') == name):
+                return
+            if current and not name:
+                entry['name'] = current.get('name')
+            self._symbols[code] = entry
+            self._learned[code] = entry
+
+        self._save_learned()
+
+    def _save_learned(self):
+        """寫回學習到的代號（寫檔期間持有鎖，寫入當下最新的內容）"""
+        with self._save_lock:
+            with self._lock:
+                learned = dict(self._learned)
+            try:
+                _write_json(self.learned_path, learned)
+            except Exception as e:
+                print(f"⚠️ 儲存股票代號清單失敗: {e}")
+
+
+def _write_json(path, data):
+    """先寫入同目錄的唯一暫存檔再取代，避免寫到一半損毀或多個寫入者共用暫存檔"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.symbols-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def refresh_snapshot(path=SNAPSHOT_PATH):
+    """下載上市（TWSE）與上櫃（TPEx）清單，重新產生代號快照，回傳代號數"""
+    from utils.http_client import quote_http
+
+    symbols = {}
+    for market, url, code_key, name_key in LISTING_SOURCES:
+        rows = quote_http.get_json(url, timeout=30) or []
+        count = 0
+        for row in rows:
+            code = str(row.get(code_key) or '').strip()
+            if code:
+                symbols[code] = {'market': market, 'name': str(row.get(name_key) or '').strip() or None}
+                count += 1
+        if not count:
+            # 任一市場抓不到時不覆寫，避免快照只剩一半
+            raise RuntimeError(f"{market} 清單沒有資料: {url}")
+        print(f"📋 {market}: {count} 檔")
+
+    _write_json(path, dict(sorted(symbols.items())))
+    print(f"✅ 已更新 {path}（共 {len(symbols)} 檔）")
+    return len(symbols)
+
+
+# 建立全域實例
+symbol_directory = SymbolDirectory()
+
+
+if __name__ == "__main__":
+    import sys
+    if '--refresh' in sys.argv:
+        refresh_snapshot()
@@ -0,0 +1,208 @@
+"""
+stock_volume_profile.py - 成交量價格分布（籌碼區）
+以 numpy searchsorted + bincount 計算各價格區間的累積成交量，
+取代 groupby(pd.cut(...)) 的類別分組；分組方式與 pd.cut 相同，
+並提供最大量價位（POC）、70% 價值區，以及共用價格區間一次算完 1mo/3mo/1y。
+"""
+import numpy as np
+from stock_bar_store import period_start
+
+DEFAULT_BINS = 30
+VALUE_AREA_PERCENT = 0.7
+PROFILE_PERIODS = ('1mo', '3mo', '1y')
+
+
+def price_edges(low, high, bins=DEFAULT_BINS):
+    """價格區間邊界（與 pd.cut(bins=N) 相同：最低邊界外擴 0.1% 讓最小值落在第一格）"""
+    if low == high:
+        adjust = 0.001 * abs(low) if low != 0 else 0.001
+        return np.linspace(low - adjust, high + adjust, bins + 1)
+    edges = np.linspace(low, high, bins + 1)
+    edges[0] -= (high - low) * 0.001
+    return edges
+
+
+def _round_frac(x, precision):
+    """與 pd.cut 標籤相同的有效位數取整"""
+    if not np.isfinite(x) or x == 0:
+        return x
+    frac, whole = np.modf(x)
+    if whole == 0:
+        digits = -int(np.floor(np.log10(abs(frac)))) - 1 + precision
+    else:
+        digits = precision
+    return np.around(x, digits)
+
+
+def label_edges(edges, precision=3):
+    """區間標籤邊界（pd.cut 會把標籤取到 3 位，重複時再加位數）"""
+    for p in range(precision, 20):
+        labels = np.array([_round_frac(e, p) for e in edges])
+        if len(np.unique(labels)) == len(labels):
+            return labels
+    return np.asarray(edges)
+
+
+def bin_volume(close, volume, edges):
+    """每個價格區間的成交量與K棒數（右閉區間，與 pd.cut 相同）"""
+    close = np.asarray(close, dtype=float)
+    volume = np.asarray(volume, dtype=float)
+    bins = len(edges) - 1
+    idx = np.searchsorted(edges, close, side='left') - 1
+    valid = (idx >= 0) & (idx < bins) & ~np.isnan(volume)
+    volume_by_bin = np.bincount(idx[valid], weights=volume[valid], minlength=bins)
+    counts = np.bincount(idx[valid], minlength=bins)
+    return volume_by_bin, counts
+
+
+def _value_area(volume_by_bin, poc, percent):
+    """從 POC 往成交量較大的一側擴張，直到涵蓋 percent 的成交量"""
+    total = volume_by_bin.sum()
+    low = high = poc
+    covered = volume_by_bin[poc]
+    while covered < total * percent and (low > 0 or high < len(volume_by_bin) - 1):
+        below = volume_by_bin[low - 1] if low > 0 else -1
+        above = volume_by_bin[high + 1] if high < len(volume_by_bin) - 1 else -1
+        if above >= below:
+            high += 1
+            covered += above
+        else:
+            low -= 1
+            covered += below
+    return low, high
+
+
+def _build_profile(volume_by_bin, counts, edges, labels, top_n, value_area_percent):
+    mids = (labels[:-1] + labels[1:]) / 2
+    observed = np.flatnonzero(counts)
+    if observed.size == 0:
+        return None
+
+    # 成交量由大到小，同量時保留較低的價格區間（與 nlargest keep='first' 相同）
+    order = observed[np.argsort(-volume_by_bin[observed], kind='stable')]
+    poc = int(order[0])
+    va_low, va_high = _value_area(volume_by_bin, poc, value_area_percent)
+    total = float(volume_by_bin.sum())
+
+    return {
+        'edges': edges,
+        'volume': volume_by_bin,
+        'mids': mids,
+        'total_volume': total,
+        'poc': float(mids[poc]),
+        'value_area_low': float(labels[va_low]),
+        'value_area_high': float(labels[va_high + 1]),
+        'top_zones': [
+            {
+                'low': float(labels[i]),
+                'high': float(labels[i + 1]),
+                'mid': float(mids[i]),
+                'volume': float(volume_by_bin[i]),
+                'share': round(float(volume_by_bin[i]) / total * 100, 1) if total else 0.0
+            }
+            for i in order[:top_n]
+        ]
+    }
+
+
+def volume_profile(df, bins=DEFAULT_BINS, top_n=3, value_area_percent=VALUE_AREA_PERCENT):
+    """單一區間的成交量價格分布（價格區間依 df 收盤價的高低範圍）"""
+    if df is None or df.empty:
+        return None
+    close = df['Close'].to_numpy(dtype=float)
+    finite = close[~np.isnan(close)]
+    if finite.size == 0:
+        return None
+
+    edges = price_edges(finite.min(), finite.max(), bins)
+    volume_by_bin, counts = bin_volume(close, df['Volume'].to_numpy(dtype=float), edges)
+    return _build_profile(volume_by_bin, counts, edges, label_edges(edges), top_n, value_area_percent)
+
+
+def trailing_zone_mids(close, volume, starts, bins=DEFAULT_BINS, top_n=3):
+    """每根K棒以 [starts[i], i] 區間計算的前 top_n 量區中價（與逐段呼叫 volume_profile 相同）
+
+    區間的價格高低範圍不變時沿用同一組邊界與標籤，回測時不必每根K棒重算。
+    """
+    close = np.asarray(close, dtype=float)
+    volume = np.asarray(volume, dtype=float)
+    result = []
+    cached_range, edges, labels = None, None, None
+    for i, start in enumerate(starts):
+        window = close[start:i + 1]
+        finite = window[~np.isnan(window)]
+        if finite.size == 0:
+            result.append([])
+            continue
+        price_range = (finite.min(), finite.max())
+        if price_range != cached_range:
+            cached_range = price_range
+            edges = price_edges(price_range[0], price_range[1], bins)
+            labels = label_edges(edges)
+        volume_by_bin, counts = bin_volume(window, volume[start:i + 1], edges)
+        profile = _build_profile(volume_by_bin, counts, edges, labels, top_n, VALUE_AREA_PERCENT)
+        result.append([zone['mid'] for zone in profile['top_zones']] if profile else [])
+    return result
+
+
+def multi_timeframe_profiles(df, periods=PROFILE_PERIODS, bins=DEFAULT_BINS, top_n=3,
+                             value_area_percent=VALUE_AREA_PERCENT):
+    """多個區間共用同一組價格邊界，分組只做一次，各區間以 bincount 加總
+
+    回傳 {period: profile}，方便直接比較短期與長期的籌碼集中位置。
+    """
+    if df is None or df.empty:
+        return {}
+
+    # 各區間在 df 中的起始位置（df 依日期排序）
+    firsts = {}
+    for period in periods:
+        start = period_start(period)
+        firsts[period] = 0 if start is None else int(np.searchsorted(df.index, start.tz_localize(df.index.tz)))
+    offset = min(firsts.values())
+
+    close = df['Close'].to_numpy(dtype=float)[offset:]
+    volume = df['Volume'].to_numpy(dtype=float)[offset:]
+    finite = close[~np.isnan(close)]
+    if finite.size == 0:
+        return {}
+
+    # 以最長區間的價格範圍建立共用邊界，所有K棒只分組一次
+    edges = price_edges(finite.min(), finite.max(), bins)
+    labels = label_edges(edges)
+    idx = np.searchsorted(edges, close, side='left') - 1
+    valid = (idx >= 0) & (idx < bins) & ~np.isnan(volume)
+
+    profiles = {}
+    for period in periods:
+        first = firsts[period] - offset
+        sel = idx[first:][valid[first:]]
+        volume_by_bin = np.bincount(sel, weights=volume[first:][valid[first:]], minlength=bins)
+        counts = np.bincount(sel, minlength=bins)
+        profile = _build_profile(volume_by_bin, counts, edges, labels, top_n, value_area_percent)
+        if profile:
+            profile['bars'] = len(close) - first
+            profiles[period] = profile
+    return profiles
+
+
+def format_volume_profile_report(stock_label, current_price, profiles):
+    """格式化籌碼區（LINE 訊息）"""
+    if not profiles:
+        return f"❌ {stock_label} 資料不足，無法計算籌碼區"
+
+    period_names = {'1mo': '近1月', '3mo': '近3月', '6mo': '近半年', '1y': '近1年'}
+    text = f"🧱 {stock_label} 籌碼區（成交量價格分布）\n"
+    text += f"💹 目前價格：{current_price}元\n"
+
+    for period, profile in profiles.items():
+        text += f"\n📅 {period_names.get(period, period)}（{profile['bars']} 天）\n"
+        position = '上方' if current_price >= profile['poc'] else '下方'
+        text += f"   🎯 最大量價位：{profile['poc']:.2f}元（現價在其{position}）\n"
+        text += f"   📦 70% 價值區：{profile['value_area_low']:.2f} ~ {profile['value_area_high']:.2f}元\n"
+        for zone in profile['top_zones']:
+            icon = '🟢' if zone['mid'] < current_price else '🔴'
+            text += f"   {icon} {zone['low']:.2f}~{zone['high']:.2f}元 佔 {zone['share']}%\n"
+
+    text += "\n💡 🟢 現價下方的量區可視為支撐、🔴 上方的量區可視為壓力"
+    return text
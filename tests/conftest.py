@@ -0,0 +1,32 @@
+"""
+測試共用設定：資料庫與快取檔寫到暫存目錄，不動到 data/
+"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('STOCK_DATA_DIR', tempfile.mkdtemp(prefix='stock-test-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_bars(n=250, seed=0, start='2023-01-02'):
+    """隨機漫步日K（台灣時區，含偶發爆量）"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(start, periods=n, tz='Asia/Taipei')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    open_ = close * (1 + rng.normal(0, 0.01, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n)))
+    volume = rng.integers(1000, 5000, n).astype(float)
+    volume[rng.random(n) < 0.05] *= 4
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close.round(2), 'Volume': volume},
+                        index=index)
+
+
+@pytest.fixture
+def bars():
+    return make_bars()
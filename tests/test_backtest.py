@@ -0,0 +1,26 @@
+from stock_analyzer import StockAnalyzer
+from stock_backtest import backtest_signals, compute_signal_strength, format_backtest_report
+from stock_bar_store import PERIOD_OFFSETS
+
+
+def test_signal_strength_matches_live_rules(bars):
+    """每根K棒的強度與 analyze() 在近3月切片上得到的結果相同"""
+    signals = compute_signal_strength(bars)
+    analyzer = StockAnalyzer()
+    for i in range(len(bars)):
+        window = bars.iloc[:i + 1]
+        window = window[window.index >= bars.index[i].normalize() - PERIOD_OFFSETS['3mo']]
+        sr = analyzer.calculate_support_resistance(window)
+        indicators = analyzer.calculate_indicators(window)
+        volume_check = analyzer.check_volume_confirmation(window)
+        buy = sum(s['strength'] for s in analyzer.analyze_buy_signals(window, sr, indicators, volume_check))
+        sell = sum(s['strength'] for s in analyzer.analyze_sell_signals(window, sr, indicators, volume_check))
+        assert (signals['buy_strength'].iloc[i], signals['sell_strength'].iloc[i]) == (buy, sell), bars.index[i]
+
+
+def test_backtest_report(bars):
+    result = backtest_signals(bars)
+    assert result['bars'] == len(bars)
+    assert set(result['horizons']) == {5, 10, 20}
+    assert '規則與技術分析相同' in format_backtest_report('2330', result)
+    assert backtest_signals(bars.iloc[:30]) is None
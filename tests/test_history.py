@@ -0,0 +1,55 @@
+import pandas as pd
+
+import stock_analyzer
+from stock_bar_store import StockBarStore
+from conftest import make_bars
+
+
+class FakeMarketData:
+    """依 start / period 從固定的日K切出資料，記錄每次請求"""
+
+    def __init__(self, bars):
+        self.bars = bars
+        self.calls = []
+
+    def history(self, symbol, period=None, start=None):
+        self.calls.append('max' if start is None else start)
+        if start is None:
+            return self.bars.copy()
+        return self.bars[self.bars.index >= pd.Timestamp(start).tz_localize(self.bars.index.tz)].copy()
+
+
+def load(monkeypatch, tmp_path, bars):
+    store = StockBarStore(str(tmp_path / 'bars.db'))
+    monkeypatch.setattr(store, 'is_up_to_date', lambda symbol: False)
+    monkeypatch.setattr(stock_analyzer, 'bar_store', store)
+    source = FakeMarketData(bars)
+    monkeypatch.setattr(stock_analyzer, 'market_data', source)
+    return store, source
+
+
+def test_incremental_fetch_keeps_history(monkeypatch, tmp_path):
+    bars = make_bars(100)
+    store, source = load(monkeypatch, tmp_path, bars.iloc[:90])
+    analyzer = stock_analyzer.StockAnalyzer()
+    analyzer._load_history('2330.TW', 'max')
+
+    source.bars = bars
+    df = analyzer._load_history('2330.TW', 'max')
+    assert source.calls == ['max', bars.index[88].strftime('%Y-%m-%d')]
+    pd.testing.assert_frame_equal(df, bars[df.columns], check_freq=False, check_names=False)
+
+
+def test_adjustment_change_refetches_full_history(monkeypatch, tmp_path):
+    bars = make_bars(100)
+    store, source = load(monkeypatch, tmp_path, bars.iloc[:90])
+    analyzer = stock_analyzer.StockAnalyzer()
+    analyzer._load_history('2330.TW', 'max')
+
+    # 除息：資料源把除息日之前的價格全部往下還原
+    adjusted = bars.copy()
+    adjusted.loc[adjusted.index[:95], ['Open', 'High', 'Low', 'Close']] *= 0.97
+    source.bars = adjusted
+    df = analyzer._load_history('2330.TW', 'max')
+    assert source.calls[-1] == 'max'
+    pd.testing.assert_frame_equal(df, adjusted[df.columns], check_freq=False, check_names=False)
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from conftest import make_bars
+from stock_indicators import IndicatorEngine, StreamingIndicators, compute_indicator_frame
+
+
+def assert_matches_frame(values, df, tolerance=1e-9):
+    expected = compute_indicator_frame(df).iloc[-1]
+    for name, value in expected.items():
+        if np.isnan(value):
+            assert np.isnan(values[name]), name
+        else:
+            assert values[name] == pytest.approx(value, rel=tolerance, abs=tolerance), name
+
+
+def test_stream_matches_frame_with_nan_volume():
+    df = make_bars(120)
+    df.iloc[50, df.columns.get_loc('Volume')] = np.nan
+    state = StreamingIndicators()
+    frame = compute_indicator_frame(df)
+    for i, (label, row) in enumerate(zip(df.index, df[['Open', 'High', 'Low', 'Close', 'Volume']].itertuples(index=False))):
+        values = state.add_bar(label, *row)
+        expected = frame['vol_ma20'].iloc[i]
+        assert np.isnan(values['vol_ma20']) if np.isnan(expected) else values['vol_ma20'] == pytest.approx(expected)
+    # NaN 移出 20 日視窗後均量恢復
+    assert not np.isnan(values['vol_ma20'])
+
+
+def test_latest_uses_stream_for_tick_and_new_bar():
+    engine = IndicatorEngine()
+    df = make_bars(120)
+    df.attrs['symbol'] = 'X'
+    engine.latest(df)
+
+    tick = df.copy()
+    tick.iloc[-1, tick.columns.get_loc('Close')] *= 1.01
+    assert_matches_frame(engine.latest(tick), tick)
+
+    new_bar = make_bars(121)
+    new_bar.iloc[:-1] = tick
+    new_bar.attrs['symbol'] = 'X'
+    assert_matches_frame(engine.latest(new_bar), new_bar)
+
+
+def test_absorb_rejects_changed_closed_bar():
+    df = make_bars(120)
+    state = StreamingIndicators.from_frame(df)
+    revised = df.copy()
+    revised.iloc[-2, revised.columns.get_loc('Close')] *= 0.97  # 前一根被修正（如還原權值）
+    assert state.absorb(revised) is None
+
+    engine = IndicatorEngine()
+    df.attrs['symbol'] = revised.attrs['symbol'] = 'X'
+    engine.latest(df)
+    assert_matches_frame(engine.latest(revised), revised)
+
+
+EWM_INDICATORS = {'k', 'd', 'ema12', 'ema26', 'macd', 'macd_signal'}
+
+
+def count_replays(monkeypatch):
+    replays = []
+    original = StreamingIndicators.from_frame.__func__
+    monkeypatch.setattr(StreamingIndicators, 'from_frame',
+                        classmethod(lambda cls, frame: replays.append(len(frame)) or original(cls, frame)))
+    return replays
+
+
+def test_slices_share_the_base_stream(monkeypatch):
+    engine = IndicatorEngine()
+    base = make_bars(250)
+    base.attrs['symbol'] = 'X'
+    engine.track(base)
+    replays = count_replays(monkeypatch)
+
+    for length in (22, 63, 22, 63):
+        base.iloc[-1, base.columns.get_loc('Close')] += 0.5  # 即時報價
+        engine.track(base)
+        sliced = base.iloc[-length:].copy()
+        sliced.attrs['symbol'] = 'X'
+        values = engine.latest(sliced)
+
+        # 滾動視窗指標與切片重算相同（K棒數不足的為 NaN），EWM 指標以基準序列為準
+        rolling = compute_indicator_frame(sliced).iloc[-1]
+        ewm = compute_indicator_frame(base).iloc[-1]
+        for name, value in rolling.items():
+            expected = ewm[name] if name in EWM_INDICATORS else value
+            if np.isnan(expected):
+                assert np.isnan(values[name]), (length, name)
+            else:
+                assert values[name] == pytest.approx(expected, rel=1e-9, abs=1e-9), (length, name)
+    assert replays == []
+
+
+def test_moving_base_start_does_not_replay(monkeypatch):
+    engine = IndicatorEngine()
+    history = make_bars(300)
+    base = history.iloc[:250].copy()
+    base.attrs['symbol'] = 'X'
+    engine.track(base)
+    replays = count_replays(monkeypatch)
+
+    # 每天切出的 1y 區間：起點與終點一起往後移一根
+    for day in range(1, 6):
+        base = history.iloc[day:250 + day].copy()
+        base.attrs['symbol'] = 'X'
+        # 移出區間的最舊K棒在 EMA26 中的權重約 1e-8
+        assert_matches_frame(engine.track(base), base, tolerance=1e-6)
+    assert replays == []
+
+    # 除權息重抓：已收盤K棒改變時才重播
+    revised = base.copy()
+    revised.iloc[:, :4] *= 0.95
+    revised.attrs['symbol'] = 'X'
+    assert_matches_frame(engine.track(revised), revised)
+    assert replays == [len(revised)]
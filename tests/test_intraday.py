@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from stock_intraday import MinuteBarRing
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+OPEN = TAIWAN_TZ.localize(datetime(2026, 10, 16, 9, 0))
+
+
+def at(minutes, seconds=0, start=OPEN):
+    return start + timedelta(minutes=minutes, seconds=seconds)
+
+
+def test_minute_bars_and_volume_deltas():
+    ring = MinuteBarRing()
+    ring.update(at(0, 5), 100, 1000)
+    ring.update(at(0, 30), 102, 1300)
+    ring.update(at(0, 50), 99, 1400)
+    ring.update(at(1, 10), 101, 1600)
+
+    minutes, bars = ring.arrays()
+    assert list(np.diff(minutes)) == [1]
+    # 第一筆只作為累積量基準
+    assert bars.tolist() == [[100, 102, 99, 99, 400], [101, 101, 101, 101, 200]]
+    assert ring.vwap() == (99 * 400 + 101 * 200) / 600
+
+
+def test_stale_quote_does_not_touch_volume_state():
+    ring = MinuteBarRing()
+    ring.update(at(0), 100, 1000)
+    ring.update(at(1), 101, 1500)
+    ring.update(at(0, 30), 90, 1200)    # 較舊的報價重送
+    ring.update(at(1, 30), 102, 1400)   # 累積量倒退
+    ring.update(at(2), 103, 1700)
+
+    _, bars = ring.arrays()
+    assert bars[:, 4].tolist() == [0, 500, 200]
+    assert bars[:, 3].tolist() == [100, 102, 103]
+    assert bars[:, 4].sum() == 1700 - 1000
+
+
+def test_ring_wraps_and_resets_each_session():
+    ring = MinuteBarRing(capacity=5)
+    for i in range(8):
+        ring.update(at(i), 100 + i, 1000 + i * 10)
+    minutes, bars = ring.arrays()
+    assert len(bars) == 5
+    assert bars[:, 3].tolist() == [103, 104, 105, 106, 107]
+    assert list(np.diff(minutes)) == [1, 1, 1, 1]
+
+    ring.update(at(0, start=OPEN + timedelta(days=1)), 200, 50)
+    _, bars = ring.arrays()
+    assert bars.tolist() == [[200, 200, 200, 200, 0]]
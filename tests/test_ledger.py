@@ -0,0 +1,174 @@
+import random
+import sqlite3
+
+import pytest
+
+from stock_ledger import LedgerStore, TransactionIndex
+
+
+def sample_data():
+    return {
+        'accounts': {
+            '爸爸': {'cash': 400000, 'created_date': '2026/01/02', 'stocks': {
+                '台積電': {'quantity': 1000, 'total_cost': 600000, 'avg_cost': 600.0, 'stock_code': '2330'},
+            }},
+            '媽媽': {'cash': 50000, 'created_date': '2026/01/03', 'stocks': {}},
+        },
+        'transactions': [
+            {'id': 1, 'type': '入帳', 'account': '爸爸', 'stock_code': None, 'quantity': 0, 'amount': 1000000,
+             'price_per_share': 0, 'date': '2026/01/02', 'cash_after': 1000000, 'created_at': '2026/01/02 09:00:00'},
+            {'id': 2, 'type': '買入', 'account': '爸爸', 'stock_code': '台積電', 'quantity': 1000, 'amount': 600000,
+             'price_per_share': 600.0, 'date': '2026/01/05', 'cash_after': 400000,
+             'created_at': '2026/01/05 10:00:00'},
+        ],
+        'stock_codes': {'台積電': '2330'},
+    }
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return LedgerStore(str(tmp_path / 'ledger.db'))
+
+
+def test_replace_all_then_reload(ledger, tmp_path):
+    ledger.save({'accounts': {'舊帳戶': {'cash': 1, 'created_date': 'x', 'stocks': {}}},
+                 'transactions': [], 'stock_codes': {'鴻海': '2317'}})
+    ledger.replace_all(sample_data())
+
+    assert ledger.replication_lag() == 0
+    assert LedgerStore(ledger.path).load() == sample_data()
+
+
+def test_replace_all_rolls_back_on_failure(ledger):
+    ledger.save(sample_data())
+    version = ledger.version
+    broken = sample_data()
+    broken['accounts']['新帳戶'] = {'cash': 1, 'created_date': 'x', 'stocks': {}}
+    broken['transactions'][1]['type'] = None  # NOT NULL 欄位，寫入時失敗
+
+    with pytest.raises(sqlite3.IntegrityError):
+        ledger.replace_all(broken)
+
+    assert ledger.version == version
+    assert LedgerStore(ledger.path).load() == sample_data()
+    # 記憶體中的比對基準也還原，之後的增量寫入仍正確
+    updated = sample_data()
+    updated['accounts']['媽媽']['cash'] = 60000
+    assert ledger.save(updated)
+    assert LedgerStore(ledger.path).load() == updated
+
+
+def test_save_load_round_trip(ledger):
+    data = sample_data()
+    data['transactions'][1]['profit_loss'] = 1500
+    assert ledger.save(data)
+    assert not ledger.save(data)  # 沒有異動時不寫入
+    assert LedgerStore(ledger.path).load() == data
+
+
+def test_incremental_save_updates_and_appends(ledger):
+    data = sample_data()
+    ledger.save(data)
+    data['accounts']['爸爸']['cash'] = 300000
+    data['accounts']['爸爸']['stocks']['台積電'].update(quantity=1100, total_cost=660000)
+    data['transactions'].append(
+        {'id': 3, 'type': '買入', 'account': '爸爸', 'stock_code': '台積電', 'quantity': 100, 'amount': 60000,
+         'price_per_share': 600.0, 'date': '2026/01/06', 'cash_after': 300000, 'created_at': '2026/01/06 10:00:00'})
+    assert ledger.save(data)
+    assert LedgerStore(ledger.path).load() == data
+
+
+def test_holding_removal_and_re_add(ledger):
+    data = sample_data()
+    data['accounts']['爸爸']['stocks']['鴻海'] = {
+        'quantity': 500, 'total_cost': 52500, 'avg_cost': 105.0, 'stock_code': '2317'}
+    data['stock_codes']['鴻海'] = '2317'
+    ledger.save(data)
+
+    sold = sample_data()
+    sold['stock_codes']['鴻海'] = '2317'
+    ledger.save(sold)
+    assert LedgerStore(ledger.path).load() == sold
+
+    # 重新買回：加在最後，與記憶體中的 dict 順序相同
+    rebought = sample_data()
+    rebought['stock_codes']['鴻海'] = '2317'
+    rebought['accounts']['爸爸']['stocks']['鴻海'] = {
+        'quantity': 200, 'total_cost': 21000, 'avg_cost': 105.0, 'stock_code': '2317'}
+    ledger.save(rebought)
+    loaded = LedgerStore(ledger.path).load()
+    assert loaded == rebought
+    assert list(loaded['accounts']['爸爸']['stocks']) == ['台積電', '鴻海']
+
+
+def test_replication_lag(ledger):
+    assert ledger.is_empty() and not ledger.has_replica()
+    data = sample_data()
+    ledger.save(data)
+    data['accounts']['媽媽']['cash'] += 1
+    ledger.save(data)
+    assert not ledger.is_empty()
+    assert ledger.replication_lag() == 2
+
+    ledger.mark_replicated(ledger.version - 1)
+    assert ledger.replication_lag() == 1 and ledger.has_replica()
+    ledger.mark_replicated(ledger.version - 2)  # 較舊的版本不會倒退
+    assert ledger.replication_lag() == 1
+    ledger.mark_replicated(ledger.version)
+    assert ledger.replication_lag() == 0
+    assert LedgerStore(ledger.path).replication_lag() == 0
+
+
+def random_transactions(rng, count, accounts=('爸爸', '媽媽', '小明'), stocks=('台積電', '鴻海', None)):
+    """建立時間刻意重複（同一秒多筆）的交易"""
+    return [
+        {'id': i, 'account': rng.choice(accounts), 'stock_code': rng.choice(stocks),
+         'created_at': f"2026/01/{rng.randint(1, 5):02d} 09:00:{rng.randint(0, 3):02d}"}
+        for i in range(count)
+    ]
+
+
+def legacy_recent(transactions, limit, account_name=None):
+    if account_name:
+        transactions = [t for t in transactions if t['account'] == account_name]
+    return sorted(transactions, key=lambda x: x['created_at'], reverse=True)[:limit]
+
+
+def legacy_for_stock(transactions, account_name, stock_name):
+    return [t for t in transactions if t['account'] == account_name and t.get('stock_code') == stock_name]
+
+
+def assert_index_matches(index, transactions):
+    for limit in (0, 1, 5, 50, len(transactions) + 1):
+        assert index.recent(limit) == legacy_recent(transactions, limit)
+        for account in ('爸爸', '媽媽', '小明', '沒有這個帳戶'):
+            assert index.recent(limit, account) == legacy_recent(transactions, limit, account)
+            assert index.has_account(account) == bool(legacy_recent(transactions, 1, account))
+    for account in ('爸爸', '媽媽', '小明'):
+        for stock in ('台積電', '鴻海'):
+            assert index.for_stock(account, stock) == legacy_for_stock(transactions, account, stock)
+
+
+def test_transaction_index_matches_legacy_queries():
+    rng = random.Random(7)
+    transactions = random_transactions(rng, 300)
+    index = TransactionIndex(transactions)
+    assert_index_matches(index, transactions)
+
+    # 之後逐筆加入：多半是最新的，也有補登的舊交易與同時間的交易
+    for transaction in random_transactions(rng, 200):
+        transaction['id'] += 1000
+        transactions.append(transaction)
+        index.add(transaction)
+    assert_index_matches(index, transactions)
+
+
+def test_transaction_index_ties_keep_entry_order():
+    same_time = '2026/01/02 09:00:00'
+    transactions = [{'id': i, 'account': '爸爸', 'stock_code': None, 'created_at': same_time} for i in range(3)]
+    index = TransactionIndex(transactions[:2])
+    index.add(transactions[2])
+    backdated = {'id': 9, 'account': '爸爸', 'stock_code': None, 'created_at': '2026/01/01 09:00:00'}
+    index.add(backdated)
+    assert [t['id'] for t in index.recent(10)] == [0, 1, 2, 9]
+    assert index.recent(10) == legacy_recent(transactions + [backdated], 10)
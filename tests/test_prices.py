@@ -0,0 +1,48 @@
+import threading
+import time
+
+import stock_prices
+from stock_prices import LastPriceStore
+
+
+class SlowQuotes:
+    """第一次查詢等待放行，記錄每次向資料來源查詢的代號"""
+
+    def __init__(self):
+        self.requests = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def quotes(self, codes):
+        self.requests.append(sorted(codes))
+        if len(self.requests) == 1:
+            self.started.set()
+            assert self.release.wait(5)
+        return {code: {'price': float(code), 'time': '10:00:00'} for code in codes}
+
+
+def test_overlapping_batches_fetch_each_code_once(monkeypatch):
+    source = SlowQuotes()
+    monkeypatch.setattr(stock_prices, 'market_data', source)
+    store = LastPriceStore()
+    results = {}
+
+    alerts = threading.Thread(target=lambda: results.update(alerts=store.get_quotes(['2330', '2317'])))
+    alerts.start()
+    assert source.started.wait(5)
+
+    # 2330 正在提醒的請求中查詢：損益只查 2454，2330 共用同一次結果
+    holdings = threading.Thread(target=lambda: results.update(holdings=store.get_quotes(['2330', '2454'])))
+    holdings.start()
+    deadline = time.monotonic() + 5
+    while store.inflight.stats()['saved_calls'] < 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    source.release.set()
+    alerts.join(5)
+    holdings.join(5)
+
+    assert source.requests == [['2317', '2330'], ['2454']]
+    assert set(results['alerts']) == {'2330', '2317'}
+    assert results['holdings']['2330']['price'] == 2330.0
+    assert set(results['holdings']) == {'2330', '2454'}
+    assert store.inflight.stats()['in_flight'] == 0
@@ -0,0 +1,37 @@
+import time
+
+import stock_snapshots
+from stock_snapshots import RETRY_INTERVAL, AnalysisSnapshotStore
+
+
+def wait_idle(store):
+    deadline = time.time() + 5
+    while store._running and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_rebuild_backs_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_snapshots.trading_calendar, 'is_data_settling', lambda now=None: False)
+    store = AnalysisSnapshotStore(str(tmp_path / 'snapshots.json'))
+    attempts = []
+
+    def failing_rebuild():
+        attempts.append(1)
+        raise RuntimeError('資料來源無法連線')
+
+    monkeypatch.setattr(store, 'rebuild', failing_rebuild)
+    started = 1_000_000.0
+    assert store.run_if_due(now=started)
+    wait_idle(store)
+    assert not store.run_if_due(now=started + 60)
+    assert not store.run_if_due(now=started + RETRY_INTERVAL - 1)
+    assert store.run_if_due(now=started + RETRY_INTERVAL)
+    wait_idle(store)
+    assert len(attempts) == 2
+
+
+def test_current_snapshot_is_not_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_snapshots.trading_calendar, 'is_data_settling', lambda now=None: False)
+    store = AnalysisSnapshotStore(str(tmp_path / 'snapshots.json'))
+    store.session = stock_snapshots.trading_calendar.last_settle().isoformat()
+    assert not store.run_if_due()
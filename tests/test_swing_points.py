@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_bars
+from stock_analyzer import StockAnalyzer, _legacy_swing_points
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window', [5, 20])
+def test_swing_points_match_loop(seed, window):
+    df = make_bars(300, seed=seed)
+    # 價格取整製造同值的高低點
+    df[['High', 'Low']] = df[['High', 'Low']].round(0)
+    supports, resistances = _legacy_swing_points(df, window)
+    assert StockAnalyzer.find_swing_points(df['Low'], window, 'low').tolist() == supports
+    assert StockAnalyzer.find_swing_points(df['High'], window, 'high').tolist() == resistances
+
+
+def test_swing_points_short_series():
+    series = pd.Series(np.arange(40, dtype=float))
+    assert StockAnalyzer.find_swing_points(series, 20, 'low').size == 0
+    assert _legacy_swing_points(pd.DataFrame({'Low': series, 'High': series}), 20) == ([], [])
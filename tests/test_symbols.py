@@ -0,0 +1,55 @@
+import json
+import os
+import threading
+
+import stock_symbols
+from stock_symbols import SymbolDirectory
+
+
+def directory(tmp_path, snapshot=None):
+    snapshot_path = tmp_path / 'twse_symbols.json'
+    snapshot_path.write_text(json.dumps(snapshot or {}), encoding='utf-8')
+    return SymbolDirectory(str(snapshot_path), str(tmp_path / 'learned.json'))
+
+
+def test_shipped_snapshot_loads(tmp_path):
+    symbols = SymbolDirectory(stock_symbols.SNAPSHOT_PATH, str(tmp_path / 'learned.json'))
+    assert symbols.resolve('2330')['market'] == 'tse'
+    assert symbols.resolve('6488')['market'] == 'otc'
+
+
+def test_explicit_suffix_wins(tmp_path):
+    symbols = directory(tmp_path, {'6488': {'market': 'otc'}, '2330': {'market': 'tse'}})
+    assert symbols.yahoo_symbol('6488') == '6488.TWO'
+    assert symbols.yahoo_symbol('6488.tw') == '6488.TW'
+    assert symbols.yahoo_symbol('2330.TWO') == '2330.TWO'
+    assert symbols.yahoo_symbol('915') == '00915.TW'
+
+
+def test_concurrent_learn_keeps_every_code(tmp_path):
+    symbols = directory(tmp_path)
+    threads = [threading.Thread(target=symbols.learn, args=(str(1000 + i), 'otc')) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    learned = json.loads((tmp_path / 'learned.json').read_text(encoding='utf-8'))
+    assert len(learned) == 40
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+    assert SymbolDirectory(str(tmp_path / 'twse_symbols.json'), str(tmp_path / 'learned.json')).resolve('1039')
+
+
+def test_refresh_snapshot(tmp_path, monkeypatch):
+    responses = {
+        stock_symbols.LISTING_SOURCES[0][1]: [{'Code': '2330', 'Name': '台積電'}],
+        stock_symbols.LISTING_SOURCES[1][1]: [{'SecuritiesCompanyCode': '6488', 'CompanyName': '環球晶'}],
+    }
+    import utils.http_client
+    monkeypatch.setattr(utils.http_client.quote_http, 'get_json', lambda url, timeout=None: responses[url])
+    path = str(tmp_path / 'snapshot.json')
+    assert stock_symbols.refresh_snapshot(path) == 2
+
+    symbols = SymbolDirectory(path, str(tmp_path / 'learned.json'))
+    assert symbols.yahoo_symbol('6488') == '6488.TWO'
+    assert symbols.resolve('2330')['name'] == '台積電'
@@ -0,0 +1,255 @@
+import re
+
+import gspread
+import pytest
+
+from stock_ledger import LedgerStore
+
+from stock_manager import ACCOUNTS_SHEET, TRANSACTIONS_SHEET, StockManager
+
+HOLDINGS_TITLE = ' 持股明細'
+RANGE_PATTERN = re.compile(r"^'(.+)'!A(\d*)(?::[A-Z]+(\d*))?$")
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows):
+        self.title = title
+        self.rows = [list(row) for row in rows]
+
+
+class FakeSpreadsheet:
+    """記憶體中的試算表：實際套用 batchUpdate/batchClear，並記錄每次呼叫"""
+
+    id = 'fake-sheet'
+
+    def __init__(self):
+        self.sheets = {
+            ACCOUNTS_SHEET: FakeWorksheet(ACCOUNTS_SHEET, [
+                StockManager.ACCOUNT_HEADER,
+                ['爸爸', 1000, '2026/01/02'],
+            ]),
+            HOLDINGS_TITLE: FakeWorksheet(HOLDINGS_TITLE, [
+                StockManager.HOLDING_HEADER,
+                ['爸爸', '台積電', '2330', 1000, 500, 500000],
+            ]),
+            TRANSACTIONS_SHEET: FakeWorksheet(TRANSACTIONS_SHEET, [
+                StockManager.TRANSACTION_HEADER,
+                [1, '入帳', '爸爸', '', 0, 1000, 0, '2026/01/02', 1000, '2026/01/02 09:00:00', ''],
+            ]),
+        }
+        self.calls = []
+        self.fail_next_update = False
+        self.offline = False
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def _parse(self, a1):
+        title, first, last = RANGE_PATTERN.match(a1).groups()
+        return self.sheets[title].rows, int(first or 1), int(last) if last else None
+
+    def values_batch_get(self, ranges, params=None):
+        if self.offline:
+            raise ConnectionError('connection reset')
+        value_ranges = []
+        for a1 in ranges:
+            if RANGE_PATTERN.match(a1).group(1) not in self.sheets:
+                raise gspread.exceptions.APIError(FakeResponse({'error': {'message': f'Unable to parse range: {a1}'}}))
+            rows, _, _ = self._parse(a1)
+            values = [list(row) for row in rows]
+            while values and not any(cell not in ('', None) for cell in values[-1]):
+                values.pop()  # 和 Sheets API 一樣不回傳尾端空白列
+            value_ranges.append({'range': a1, 'values': values})
+        return {'valueRanges': value_ranges}
+
+    def values_batch_update(self, body):
+        if self.fail_next_update:
+            self.fail_next_update = False
+            raise RuntimeError('quota exceeded')
+        self.calls.append(('update', [(d['range'], len(d['values'])) for d in body['data']]))
+        for d in body['data']:
+            rows, first, _ = self._parse(d['range'])
+            for offset, value in enumerate(d['values']):
+                index = first - 1 + offset
+                while len(rows) <= index:
+                    rows.append([])
+                # JSON 的 null 寫入後是空白儲存格
+                rows[index] = ['' if cell is None else cell for cell in value]
+
+    def values_batch_clear(self, body):
+        self.calls.append(('clear', list(body['ranges'])))
+        for a1 in body['ranges']:
+            rows, first, last = self._parse(a1)
+            for index in range(first - 1, min(len(rows), last or len(rows))):
+                rows[index] = []
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeClient:
+    def request(self, method, url, params=None):
+        return FakeResponse({'version': '1', 'modifiedTime': '2026-01-02T01:00:00Z'})
+
+
+def connect(sheet):
+    def init_google_sheets(self):
+        self.gc = FakeClient()
+        self.sheet = sheet
+        self.sheets_enabled = True
+    return init_google_sheets
+
+
+@pytest.fixture
+def sheet():
+    return FakeSpreadsheet()
+
+
+@pytest.fixture
+def manager(sheet, monkeypatch):
+    monkeypatch.setattr(StockManager, 'init_google_sheets', connect(sheet))
+    manager = StockManager(ledger=None)
+    # 不啟動背景同步，由測試直接呼叫 sync_to_sheets_safe
+    monkeypatch.setattr(manager.sync_queue, 'mark_dirty', lambda: None)
+    return manager
+
+
+def assert_sheet_matches(sheet, manager):
+    """增量寫入後的試算表內容要和整張重寫的結果相同"""
+    def cells(rows):
+        rows = [['' if cell is None else cell for cell in row] for row in rows]
+        while rows and not any(cell != '' for cell in rows[-1]):
+            rows.pop()
+        return rows
+
+    expected = {
+        ACCOUNTS_SHEET: [manager.ACCOUNT_HEADER] + [row for _, row in manager.account_rows()],
+        HOLDINGS_TITLE: [manager.HOLDING_HEADER] + [row for _, row in manager.holding_rows()],
+        TRANSACTIONS_SHEET: [manager.TRANSACTION_HEADER] +
+                            [manager.transaction_row(t) for t in manager.stock_data['transactions']],
+    }
+    for title, rows in expected.items():
+        assert cells(sheet.sheets[title].rows) == cells(rows), title
+
+
+def test_deposit_writes_only_changed_rows(manager, sheet):
+    manager.handle_deposit('爸爸', 5000)
+    assert manager.sync_to_sheets_safe()
+
+    assert sheet.calls == [('update', [
+        (f"'{ACCOUNTS_SHEET}'!A2:C2", 1),
+        (f"'{TRANSACTIONS_SHEET}'!A3:K3", 1),
+    ])]
+    assert_sheet_matches(sheet, manager)
+
+
+def test_nothing_changed_skips_api(manager, sheet, capsys):
+    assert manager.sync_to_sheets_safe()
+    assert sheet.calls == []
+    assert '已是最新' in capsys.readouterr().out
+
+
+def test_coalesced_changes_in_one_batch(manager, sheet):
+    manager.handle_deposit('媽媽', 200000)
+    manager.handle_buy('媽媽', '鴻海', '2317', 1000, 100000, '2026/01/05')
+    manager.handle_buy('爸爸', '聯發科', '2454', 10, 800, '2026/01/05')
+    assert manager.sync_to_sheets_safe()
+
+    # 相鄰的變動列合併成一個範圍：爸爸的現金與新帳戶、兩筆新持股、三筆新交易
+    assert sheet.calls == [('update', [
+        (f"'{ACCOUNTS_SHEET}'!A2:C3", 2),
+        (f"'{HOLDINGS_TITLE}'!A3:F4", 2),
+        (f"'{TRANSACTIONS_SHEET}'!A3:K5", 3),
+    ])]
+    assert_sheet_matches(sheet, manager)
+
+
+def test_sell_out_rewrites_holdings_with_padding(manager, sheet):
+    manager.handle_buy('爸爸', '鴻海', '2317', 10, 1000, '2026/01/05')
+    assert manager.sync_to_sheets_safe()
+    sheet.calls.clear()
+
+    manager.handle_sell('爸爸', '台積電', '2330', 1000, 600000, '2026/01/06')
+    assert manager.sync_to_sheets_safe()
+
+    _, ranges = sheet.calls[0]
+    # 刪除一列：整段重寫，原本 2 列持股中多出的一列以空白覆蓋
+    assert (f"'{HOLDINGS_TITLE}'!A1:F3", 3) in ranges
+    assert sheet.sheets[HOLDINGS_TITLE].rows[2] == [''] * 6
+    assert_sheet_matches(sheet, manager)
+
+
+def test_unknown_baseline_rewrites_and_clears(manager, sheet):
+    manager.handle_deposit('爸爸', 5000)
+    manager.reset_sync_state()
+    assert manager.sync_to_sheets_safe()
+
+    assert [kind for kind, _ in sheet.calls] == ['clear', 'update']
+    _, cleared = sheet.calls[0]
+    assert f"'{TRANSACTIONS_SHEET}'!A4:K" in cleared
+    _, ranges = sheet.calls[1]
+    assert (f"'{TRANSACTIONS_SHEET}'!A1:K3", 3) in ranges
+    assert_sheet_matches(sheet, manager)
+
+
+def test_failed_update_resends_same_batch(manager, sheet):
+    manager.handle_deposit('爸爸', 5000)
+    sheet.fail_next_update = True
+    assert not manager.sync_to_sheets_safe()
+    assert sheet.calls == []
+
+    manager.handle_deposit('爸爸', 1000)
+    assert manager.sync_to_sheets_safe()
+    assert sheet.calls == [('update', [
+        (f"'{ACCOUNTS_SHEET}'!A2:C2", 1),
+        (f"'{TRANSACTIONS_SHEET}'!A3:K4", 2),
+    ])]
+    assert_sheet_matches(sheet, manager)
+
+
+def test_failed_first_load_never_writes_sheet(sheet, monkeypatch, tmp_path):
+    before = {title: [list(row) for row in ws.rows] for title, ws in sheet.sheets.items()}
+    ledger = LedgerStore(str(tmp_path / 'ledger.db'))
+    sheet.offline = True
+    monkeypatch.setattr(StockManager, 'init_google_sheets', connect(sheet))
+    manager = StockManager(ledger=ledger)
+    monkeypatch.setattr(manager.sync_queue, 'mark_dirty', lambda: None)
+
+    # 載入失敗：不建立帳本、不記帳、不寫入試算表
+    assert '尚未從 Google Sheets 載入' in manager.handle_command('爸爸入帳 5000')
+    assert not manager.sync_to_sheets_safe()
+    assert ledger.is_empty() and not ledger.has_replica()
+    assert sheet.calls == []
+    assert {title: ws.rows for title, ws in sheet.sheets.items()} == before
+
+    # 試算表恢復後，下一個指令先載入真實資料再記帳，只寫入變動的列
+    sheet.offline = False
+    assert '入帳' in manager.handle_command('爸爸入帳 5000')
+    assert manager.stock_data['accounts']['爸爸']['cash'] == 6000
+    assert manager.sync_to_sheets_safe()
+    assert sheet.calls == [('update', [
+        (f"'{ACCOUNTS_SHEET}'!A2:C2", 1),
+        (f"'{TRANSACTIONS_SHEET}'!A3:K3", 1),
+    ])]
+    assert_sheet_matches(sheet, manager)
+    assert ledger.replication_lag() == 0
+
+
+def test_failed_first_load_is_retried_on_restart(sheet, monkeypatch, tmp_path):
+    path = str(tmp_path / 'ledger.db')
+    sheet.offline = True
+    monkeypatch.setattr(StockManager, 'init_google_sheets', connect(sheet))
+    StockManager(ledger=LedgerStore(path))
+
+    sheet.offline = False
+    manager = StockManager(ledger=LedgerStore(path))
+    assert manager.sheets_loaded
+    assert manager.stock_data['accounts']['爸爸']['cash'] == 1000
+    ledger = LedgerStore(path)
+    assert ledger.has_replica() and ledger.replication_lag() == 0
+    assert ledger.load()['accounts'] == manager.stock_data['accounts']
@@ -0,0 +1,38 @@
+from datetime import date, datetime
+
+import pytz
+
+from utils.trading_calendar import TradingCalendar
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+
+
+def test_lunar_new_year_2026_closure():
+    calendar = TradingCalendar()
+    assert calendar.is_trading_day(date(2026, 2, 11))
+    for day in range(12, 21):
+        assert not calendar.is_trading_day(date(2026, 2, day)), day
+    after_close = TAIWAN_TZ.localize(datetime(2026, 2, 11, 15, 0))
+    assert calendar.next_open(after_close) == TAIWAN_TZ.localize(datetime(2026, 2, 23, 9, 0))
+
+
+def test_lunar_new_year_2027_closure():
+    calendar = TradingCalendar()
+    assert calendar.is_trading_day(date(2027, 2, 1))
+    for day in range(2, 11):
+        assert not calendar.is_trading_day(date(2027, 2, day)), day
+    assert calendar.is_trading_day(date(2027, 2, 11))
+
+
+def test_uncovered_year_warns_and_does_not_extend_cache(tmp_path, capsys):
+    path = tmp_path / 'calendar.json'
+    path.write_text('{"years": [2026], "holidays": {"2026-01-01": "開國紀念日"}}', encoding='utf-8')
+    calendar = TradingCalendar(str(path))
+
+    new_years_eve = TAIWAN_TZ.localize(datetime(2026, 12, 31, 20, 0))
+    assert calendar.ttl(10, new_years_eve) == 10
+    assert calendar.is_trading_day(date(2027, 2, 8))
+    out = capsys.readouterr().out
+    assert out.count('未涵蓋 2027') == 1
+
+    assert calendar.ttl(10, TAIWAN_TZ.localize(datetime(2026, 12, 29, 20, 0))) > 10
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_bars
+from stock_bar_store import period_start
+from stock_volume_profile import bin_volume, multi_timeframe_profiles, trailing_zone_mids, volume_profile
+
+
+def legacy_zone_mids(df, bins=30, top_n=3):
+    """舊版 groupby(pd.cut(...)) 的成交量密集區（只有出現過的價格區間，pandas 3 的預設）"""
+    volume_price = df.groupby(pd.cut(df['Close'], bins=bins), observed=True)['Volume'].sum()
+    return [(interval.left + interval.right) / 2 for interval in volume_price.nlargest(top_n).index]
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_zones_match_pd_cut(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(5, 300))
+    scale = 10 ** rng.uniform(-1, 3)
+    close = np.round(scale * (1 + 0.02 * rng.standard_normal(n).cumsum()), 2)
+    if seed % 7 == 0:
+        close = np.round(close, 0)  # 大量同價
+    volume = rng.integers(0, 5000, n).astype(float)
+    if seed % 11 == 0:
+        volume[:] = 100  # 同量時的排序
+    df = pd.DataFrame({'Close': close, 'Volume': volume})
+
+    expected = legacy_zone_mids(df)
+    actual = [zone['mid'] for zone in volume_profile(df)['top_zones']]
+    assert actual == pytest.approx(expected, rel=0, abs=1e-12)
+
+
+def test_multi_timeframe_matches_single_profiles():
+    df = make_bars(400, start='2025-03-03')
+    profiles = multi_timeframe_profiles(df, periods=('1y',))
+    single = volume_profile(df[df.index >= df.index[-profiles['1y']['bars']]])
+    assert profiles['1y']['poc'] == single['poc']
+    assert profiles['1y']['total_volume'] == single['total_volume']
+
+
+def test_multi_timeframe_slices_each_period():
+    df = make_bars(400)
+    df.index = pd.bdate_range(end=pd.Timestamp.now(tz='Asia/Taipei').normalize(), periods=len(df),
+                              tz='Asia/Taipei')
+    df.iloc[-5, df.columns.get_loc('Volume')] = np.nan
+    profiles = multi_timeframe_profiles(df, periods=('1mo', '3mo', '1y'))
+
+    # 共用邊界取自最長區間（1y）的價格範圍
+    edges = volume_profile(df[df.index >= period_start('1y').tz_localize(df.index.tz)])['edges']
+    for period in ('1mo', '3mo', '1y'):
+        direct = df[df.index >= period_start(period).tz_localize(df.index.tz)]
+        profile = profiles[period]
+        assert profile['bars'] == len(direct), period
+        assert profile['total_volume'] == pytest.approx(np.nansum(direct['Volume'])), period
+        np.testing.assert_array_equal(profile['edges'], edges)
+        volume_by_bin, _ = bin_volume(direct['Close'], direct['Volume'], edges)
+        np.testing.assert_allclose(profile['volume'], volume_by_bin)
+    assert profiles['1mo']['bars'] < profiles['3mo']['bars'] < profiles['1y']['bars']
+
+
+def test_trailing_zone_mids_match_volume_profile():
+    df = make_bars(150)
+    starts = np.maximum(np.arange(len(df)) - 40, 0)
+    mids = trailing_zone_mids(df['Close'], df['Volume'], starts)
+    for i, start in enumerate(starts):
+        profile = volume_profile(df.iloc[start:i + 1])
+        assert mids[i] == [zone['mid'] for zone in profile['top_zones']]
@@ -0,0 +1,12 @@
+"""
+data_dir.py - 本地資料目錄
+股價資料庫、代號表等需要跨重啟保存的檔案統一放在這裡
+"""
+import os
+
+DATA_DIR = os.getenv('STOCK_DATA_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+
+def get_data_path(filename):
+    """取得資料檔路徑（目錄不存在時自動建立）"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
@@ -0,0 +1,99 @@
+"""
+http_client.py - 報價用 HTTP 連線池
+每個主機一個 keep-alive Session（不必每次重新 TCP+TLS 握手），
+限制每個主機同時連線數、支援整批請求的截止時間，
+以執行緒池同時送出多檔報價，總延遲約等於一次來回。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+class QuoteHttpClient:
+    """每個主機一個連線池的 HTTP 用戶端（執行緒安全）"""
+
+    def __init__(self, max_per_host=8, max_workers=16, timeout=5):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._sessions = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='quote-http')
+
+    def _host_state(self, url):
+        """取得主機對應的 Session 與並行上限"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_per_host)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update(DEFAULT_HEADERS)
+                self._sessions[host] = session
+                self._limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return session, self._limits[host]
+
+    def get_json(self, url, params=None, headers=None, timeout=None, deadline=None):
+        """同步 GET 並解析 JSON（deadline 為 time.monotonic() 的截止時間）"""
+        timeout = timeout or self.timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"請求截止時間已過: {url}")
+            timeout = min(timeout, remaining)
+
+        session, limit = self._host_state(url)
+        if not limit.acquire(timeout=timeout):
+            raise TimeoutError(f"等待連線逾時: {url}")
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        finally:
+            limit.release()
+
+    def get_many(self, requests_list, deadline=None, return_exceptions=False):
+        """同步介面：同時送出多個 GET，回傳與輸入相同順序的 JSON（失敗為 None）
+
+        requests_list: [{'url': ..., 'params': ..., 'headers': ...}, ...]
+        deadline: 整批最多等待秒數
+        return_exceptions: 失敗時改回傳例外物件（可判斷 429 限流等錯誤）
+        """
+        if not requests_list:
+            return []
+        deadline_at = time.monotonic() + (deadline or self.timeout)
+        futures = [
+            self._executor.submit(self._safe_get_json, req, deadline_at, return_exceptions)
+            for req in requests_list
+        ]
+        wait(futures, timeout=max(0, deadline_at - time.monotonic()))
+        timeout_result = TimeoutError("整批請求逾時") if return_exceptions else None
+        return [f.result() if f.done() else timeout_result for f in futures]
+
+    def _safe_get_json(self, req, deadline_at, return_exceptions=False):
+        try:
+            return self.get_json(req['url'], req.get('params'), req.get('headers'),
+                                 req.get('timeout'), deadline_at)
+        except Exception as e:
+            print(f"⚠️ HTTP 請求失敗 {req['url']}: {e}")
+            return e if return_exceptions else None
+
+    def close(self):
+        """關閉所有連線"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# 建立全域實例
+quote_http = QuoteHttpClient()
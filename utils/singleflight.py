@@ -0,0 +1,127 @@
+"""
+singleflight.py - 同一資料的並行請求合併
+多個 LINE 訊息或背景工作同時查詢同一檔股票時，只送出一次上游請求，
+其他呼叫端等待同一個結果，並統計省下的上游請求次數。
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """相同 key 的並行呼叫共用一次執行結果（執行緒安全）"""
+
+    def __init__(self, name='singleflight', copy_shared=True):
+        self.name = name
+        self.copy_shared = copy_shared  # 共用的 DataFrame 回傳副本，避免互相修改
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.upstream_calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """執行 fn(*args, **kwargs)；同一 key 已在執行中時等待並共用其結果"""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.upstream_calls += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            if self.copy_shared and hasattr(call.result, 'copy'):
+                return call.result.copy()
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                waiters = call.waiters
+            if waiters and self.copy_shared and hasattr(call.result, 'copy'):
+                # 在 leader 拿回結果前先留一份副本給等待者
+                call.result = call.result.copy()
+            call.event.set()
+
+    def do_many(self, keys, fn):
+        """批次版的 do：已在執行中的 key 等待並共用結果，其餘 key 合併成一次 fn(其餘 keys)
+
+        fn 回傳 {key: 結果}，查不到的 key 不出現在回傳中；
+        重疊的批次（例如提醒與損益同時查詢 2330）只有其中一批會查詢重疊的 key。
+        """
+        joined = {}
+        own = []
+        batch = _Call()
+        with self._lock:
+            for key in keys:
+                if key in joined or key in own:
+                    continue
+                self.calls += 1
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    self.shared += 1
+                    joined[key] = call
+                else:
+                    self._calls[key] = batch
+                    own.append(key)
+            if own:
+                self.upstream_calls += 1
+
+        results = {}
+        if own:
+            try:
+                batch.result = fn(own) or {}
+            except Exception as e:
+                batch.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in own:
+                        self._calls.pop(key, None)
+                batch.event.set()
+            results.update((key, batch.result[key]) for key in own if key in batch.result)
+
+        for key, call in joined.items():
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            if key in call.result:
+                value = call.result[key]
+                results[key] = value.copy() if self.copy_shared and hasattr(value, 'copy') else value
+        return results
+
+    def stats(self):
+        """合併統計"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'calls': self.calls,
+                'upstream_calls': self.upstream_calls,
+                'saved_calls': self.shared,
+                'in_flight': len(self._calls),
+                'saved_rate': round(self.shared / self.calls, 3) if self.calls else 0.0
+            }
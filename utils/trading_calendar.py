@@ -0,0 +1,166 @@
+"""
+trading_calendar.py - 台股交易日曆
+從本地資料檔載入交易時段、休市日與颱風停市日，
+讓快取、提醒與報價在休市時不必連網，並把快取延長到下次開盤。
+"""
+import os
+import json
+import threading
+from datetime import datetime, timedelta, time as dt_time
+import pytz
+
+TAIWAN_TZ = pytz.timezone('Asia/Taipei')
+
+DEFAULT_CALENDAR_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'twse_calendar.json'
+)
+
+
+def _parse_hhmm(value):
+    hour, minute = value.split(':')
+    return dt_time(int(hour), int(minute))
+
+
+class TradingCalendar:
+    """台股交易日曆
+
+    - open / close：盤中交易時段（即時報價會變動）
+    - settle：收盤資料定稿時間（之後日K不會再變，可快取到下次開盤）
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('TWSE_CALENDAR_FILE') or DEFAULT_CALENDAR_FILE
+        self._lock = threading.Lock()
+        self.open_time = dt_time(9, 0)
+        self.close_time = dt_time(13, 30)
+        self.settle_time = dt_time(14, 30)
+        self.holidays = {}
+        self.closures = {}
+        self.years = set()          # 休市日資料涵蓋的年份
+        self._warned_years = set()
+        self.load()
+
+    def load(self):
+        """載入日曆資料檔（找不到檔案時只排除週末）"""
+        if not os.path.exists(self.path):
+            print(f"⚠️ 找不到交易日曆 {self.path}，僅排除週末")
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            session = data.get('session', {})
+            self.open_time = _parse_hhmm(session.get('open', '09:00'))
+            self.close_time = _parse_hhmm(session.get('close', '13:30'))
+            self.settle_time = _parse_hhmm(session.get('settle', '14:30'))
+            self.holidays = dict(data.get('holidays', {}))
+            self.closures = dict(data.get('closures', {}))
+            self.years = {int(year) for year in data.get('years', [])} or {int(key[:4]) for key in self.holidays}
+        except Exception as e:
+            print(f"⚠️ 讀取交易日曆失敗: {e}")
+
+    def add_closure(self, date, reason='颱風停止交易'):
+        """臨時停市（例如颱風假），只影響目前程序"""
+        key = date.strftime('%Y-%m-%d') if hasattr(date, 'strftime') else str(date)
+        with self._lock:
+            self.closures[key] = reason
+
+    def _now(self, now=None):
+        if now is None:
+            return datetime.now(TAIWAN_TZ)
+        if now.tzinfo is None:
+            return TAIWAN_TZ.localize(now)
+        return now.astimezone(TAIWAN_TZ)
+
+    def _at(self, day, t):
+        return TAIWAN_TZ.localize(datetime.combine(day, t))
+
+    def covers(self, day):
+        """日曆資料是否涵蓋該日的年份（未涵蓋時平日一律當成交易日）"""
+        if day.year in self.years:
+            return True
+        if day.year not in self._warned_years:
+            self._warned_years.add(day.year)
+            print(f"⚠️ 交易日曆未涵蓋 {day.year} 年休市日（{self.path}），平日一律視為交易日，快取不延長到下次開盤")
+        return False
+
+    def is_trading_day(self, day=None):
+        """是否為交易日（排除週末、國定假日與臨時停市）"""
+        day = day or self._now().date()
+        if hasattr(day, 'date') and callable(day.date):
+            day = day.date()
+        self.covers(day)
+        if day.weekday() >= 5:
+            return False
+        key = day.strftime('%Y-%m-%d')
+        return key not in self.holidays and key not in self.closures
+
+    def closed_reason(self, day=None):
+        """休市原因（交易日回傳 None）"""
+        day = day or self._now().date()
+        key = day.strftime('%Y-%m-%d')
+        if key in self.closures:
+            return self.closures[key]
+        if key in self.holidays:
+            return self.holidays[key]
+        if day.weekday() >= 5:
+            return '週末'
+        return None
+
+    def is_market_open(self, now=None):
+        """目前是否在盤中交易時段"""
+        now = self._now(now)
+        if not self.is_trading_day(now.date()):
+            return False
+        return self.open_time <= now.time() < self.close_time
+
+    def is_data_settling(self, now=None):
+        """是否在盤中或收盤後資料尚未定稿的時段（日K仍可能變動）"""
+        now = self._now(now)
+        if not self.is_trading_day(now.date()):
+            return False
+        return self.open_time <= now.time() < self.settle_time
+
+    def next_open(self, now=None):
+        """下一次開盤時間（盤中時回傳下一個交易日的開盤）"""
+        now = self._now(now)
+        day = now.date()
+        if self.is_trading_day(day) and now.time() < self.open_time:
+            return self._at(day, self.open_time)
+        day += timedelta(days=1)
+        for _ in range(366):
+            if self.is_trading_day(day):
+                return self._at(day, self.open_time)
+            day += timedelta(days=1)
+        return self._at(day, self.open_time)
+
+    def last_settle(self, now=None):
+        """最近一次收盤資料定稿時間"""
+        now = self._now(now)
+        day = now.date()
+        if self.is_trading_day(day) and now.time() >= self.settle_time:
+            return self._at(day, self.settle_time)
+        day -= timedelta(days=1)
+        for _ in range(366):
+            if self.is_trading_day(day):
+                return self._at(day, self.settle_time)
+            day -= timedelta(days=1)
+        return self._at(day, self.settle_time)
+
+    def seconds_until_next_open(self, now=None):
+        """距離下次開盤的秒數"""
+        now = self._now(now)
+        return max(0, int((self.next_open(now) - now).total_seconds()))
+
+    def ttl(self, open_ttl, now=None, min_ttl=60):
+        """快取存活秒數：資料可能變動時用 open_ttl，否則延長到下次開盤"""
+        now = self._now(now)
+        if self.is_data_settling(now):
+            return open_ttl
+        if not (self.covers(now.date()) and self.covers(self.next_open(now).date())):
+            # 不知道休市日時不把快取延長到下次開盤，照盤中的時間重新抓取
+            return open_ttl
+        return max(min_ttl, self.seconds_until_next_open(now))
+
+
+# 建立全域實例
+trading_calendar = TradingCalendar()
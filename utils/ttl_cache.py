@@ -0,0 +1,142 @@
+"""
+ttl_cache.py - 有上限的 TTL + LRU 快取
+限制筆數與記憶體用量、每筆可設定不同存活時間、統計命中/未命中/淘汰次數，
+DataFrame 讀取時回傳副本，避免呼叫端修改到共用的快取資料。
+"""
+from collections import OrderedDict
+import sys
+import threading
+import time
+from .trading_calendar import trading_calendar
+
+
+def market_hours_ttl(open_ttl, closed_ttl):
+    """依交易時段決定快取存活秒數
+
+    盤中用 open_ttl，收盤後到資料定稿前用 closed_ttl，
+    其餘休市時間直接延長到下次開盤。
+    """
+    if trading_calendar.is_market_open():
+        return open_ttl
+    if trading_calendar.is_data_settling():
+        return closed_ttl
+    return trading_calendar.ttl(open_ttl)
+
+
+def estimate_size(value):
+    """估算快取值佔用的位元組數"""
+    memory_usage = getattr(value, 'memory_usage', None)
+    if callable(memory_usage):
+        try:
+            usage = memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+        except Exception:
+            pass
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """TTL + LRU 快取（執行緒安全）"""
+
+    def __init__(self, name='cache', max_entries=128, max_bytes=64 * 1024 * 1024,
+                 default_ttl=300, copy_on_read=True):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.copy_on_read = copy_on_read
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _read(self, value):
+        if self.copy_on_read and hasattr(value, 'copy'):
+            return value.copy()
+        return value
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        """取得快取值；過期或不存在時回傳 default"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, _, value = entry
+            if time.monotonic() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._read(value)
+
+    def set(self, key, value, ttl=None):
+        """寫入快取（ttl 秒數，未指定時使用 default_ttl）"""
+        ttl = self.default_ttl if ttl is None else ttl
+        size = estimate_size(value)
+        if self.copy_on_read and hasattr(value, 'copy'):
+            # 寫入時也存副本，呼叫端之後修改原物件不影響快取
+            value = value.copy()
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """移除並回傳快取值"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+        return entry[2]
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() < entry[0]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """快取統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,144 @@
+"""
+write_behind.py - 背景延遲寫入佇列
+記帳異動先更新記憶體並立即回覆，再由背景執行緒寫入外部儲存（Google Sheets）；
+短時間內的多筆異動合併成一次寫入，失敗時退避重試，程式結束前會把未寫入的異動送出。
+"""
+import atexit
+import threading
+import time
+
+
+class WriteBehindQueue:
+    """合併寫入的背景佇列（執行緒安全）
+
+    flush_fn: 執行一次寫入，成功回傳 True；每次寫入都要送出「目前」所有未同步的變動，
+              因此佇列只需記錄有沒有待寫入的異動，不必保存每一筆內容。
+    delay: 最後一次異動後等待幾秒再寫入（讓連續交易合併成一次）
+    max_delay: 第一筆異動最多等待幾秒就一定寫入
+    """
+
+    def __init__(self, name, flush_fn, delay=2.0, max_delay=10.0, retry_delay=15.0, max_retry_delay=300.0):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.delay = delay
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 背景寫入與關機寫入不同時執行
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+        self.pending = 0           # 尚未寫入的異動筆數
+        self.first_pending = None  # 最早一筆未寫入異動的時間
+        self.last_pending = None   # 最近一筆異動的時間
+        self.retry_at = None       # 寫入失敗後下次重試時間
+        self.failures = 0          # 連續失敗次數
+
+        self.mutations = 0
+        self.flushes = 0
+        self.last_flush_time = None
+        self.last_flush_seconds = None
+        self.last_error = None
+
+        atexit.register(self.shutdown)
+
+    def mark_dirty(self):
+        """記錄一筆異動並喚醒背景執行緒"""
+        now = time.time()
+        with self._lock:
+            self.mutations += 1
+            self.pending += 1
+            if self.first_pending is None:
+                self.first_pending = now
+            self.last_pending = now
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name=f'{self.name}-writer')
+                self._thread.start()
+        self._wakeup.set()
+
+    def _due_in(self, now):
+        """距離下次應寫入的秒數（沒有待寫入異動時回傳 None）"""
+        with self._lock:
+            if not self.pending:
+                return None
+            if self.retry_at is not None:
+                return self.retry_at - now
+            debounce = self.last_pending + self.delay
+            deadline = self.first_pending + self.max_delay
+            return min(debounce, deadline) - now
+
+    def _run(self):
+        while not self._stopped:
+            due_in = self._due_in(time.time())
+            if due_in is None:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            if due_in > 0:
+                self._wakeup.wait(due_in)
+                self._wakeup.clear()
+                continue
+            self.flush()
+
+    def flush(self):
+        """立即寫入所有待寫入的異動，回傳是否已無待寫入異動"""
+        with self._flush_lock:
+            with self._lock:
+                if not self.pending:
+                    return True
+                batch = self.pending
+
+            started = time.time()
+            try:
+                ok = bool(self.flush_fn())
+                error = None if ok else '寫入失敗'
+            except Exception as e:
+                ok = False
+                error = str(e)
+
+            with self._lock:
+                if ok:
+                    # 寫入期間又有新異動時保留，交給下一輪
+                    self.pending -= batch
+                    self.first_pending = self.last_pending if self.pending else None
+                    self.retry_at = None
+                    self.failures = 0
+                    self.flushes += 1
+                    self.last_flush_time = time.time()
+                    self.last_flush_seconds = self.last_flush_time - started
+                    self.last_error = None
+                    print(f"☁️ {self.name} 已寫入 {batch} 筆異動（{self.last_flush_seconds:.2f}秒）")
+                else:
+                    self.failures += 1
+                    backoff = min(self.retry_delay * (2 ** (self.failures - 1)), self.max_retry_delay)
+                    self.retry_at = time.time() + backoff
+                    self.last_error = error
+                    print(f"⚠️ {self.name} 寫入失敗（第{self.failures}次），{backoff:.0f}秒後重試: {error}")
+                return not self.pending
+
+    def shutdown(self):
+        """程式結束前送出未寫入的異動"""
+        self._stopped = True
+        self._wakeup.set()
+        if self.pending:
+            print(f"💾 {self.name} 結束前寫入 {self.pending} 筆異動...")
+            self.flush()
+
+    def stats(self):
+        """佇列狀態"""
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'oldest_pending_seconds': round(time.time() - self.first_pending, 1) if self.first_pending else 0,
+                'mutations': self.mutations,
+                'flushes': self.flushes,
+                'coalesced': max(0, self.mutations - self.pending - self.flushes),
+                'failures': self.failures,
+                'retry_in': round(max(0, self.retry_at - time.time()), 1) if self.retry_at else None,
+                'last_flush_time': self.last_flush_time,
+                'last_flush_seconds': self.last_flush_seconds,
+                'last_error': self.last_error
+            }